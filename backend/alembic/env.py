@@ -28,6 +28,12 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 from backend.database_models import Base # Ahora debería funcionar porque la raíz del proyecto está en sys.path
 target_metadata = Base.metadata
 # target_metadata = None # Asegurarse que la metadata de los modelos sea la utilizada
+from backend.fulltext import FTS_TABLE
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Excluye del autogenerate la tabla FTS5 y sus tablas internas: las crean las migraciones, no los modelos."""
+    return not (type_ == "table" and name.startswith(FTS_TABLE))
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -53,6 +59,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -74,7 +81,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
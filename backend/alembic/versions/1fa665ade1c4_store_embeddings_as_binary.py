@@ -0,0 +1,62 @@
+"""store_embeddings_as_binary
+
+Revision ID: 1fa665ade1c4
+Revises: 720bafd8ee7b
+Create Date: 2026-10-17 10:12:40.118204
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1fa665ade1c4'
+down_revision: Union[str, Sequence[str], None] = '720bafd8ee7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def _convert(select_sql: str, update_sql: str, convert) -> None:
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(sa.text(select_sql), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows: break
+        conn.execute(sa.text(update_sql), [{"id": row[0], "value": convert(row)} for row in rows])
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('embeddings') as batch_op:
+        batch_op.add_column(sa.Column('vector_blob', sa.LargeBinary(), nullable=True))
+        batch_op.add_column(sa.Column('vector_dtype', sa.String(), server_default='float32', nullable=False))
+    _convert(
+        "SELECT id, vector FROM embeddings WHERE id > :last_id ORDER BY id LIMIT :limit",
+        "UPDATE embeddings SET vector_blob = :value WHERE id = :id",
+        lambda row: np.asarray(json.loads(row[1]), dtype=np.float32).tobytes(),
+    )
+    with op.batch_alter_table('embeddings') as batch_op:
+        batch_op.drop_column('vector')
+        batch_op.alter_column('vector_blob', new_column_name='vector', existing_type=sa.LargeBinary(), nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('embeddings') as batch_op:
+        batch_op.add_column(sa.Column('vector_json', sa.Text(), nullable=True))
+    _convert(
+        "SELECT id, vector, vector_dtype FROM embeddings WHERE id > :last_id ORDER BY id LIMIT :limit",
+        "UPDATE embeddings SET vector_json = :value WHERE id = :id",
+        lambda row: json.dumps(np.frombuffer(row[1], dtype=row[2] or 'float32').astype(np.float32).tolist()),
+    )
+    with op.batch_alter_table('embeddings') as batch_op:
+        batch_op.drop_column('vector')
+        batch_op.drop_column('vector_dtype')
+        batch_op.alter_column('vector_json', new_column_name='vector', existing_type=sa.Text(), nullable=False)
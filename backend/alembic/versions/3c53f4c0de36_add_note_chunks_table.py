@@ -0,0 +1,48 @@
+"""add_note_chunks_table
+
+Revision ID: 3c53f4c0de36
+Revises: 1fa665ade1c4
+Create Date: 2026-10-17 11:02:17.540931
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c53f4c0de36'
+down_revision: Union[str, Sequence[str], None] = '1fa665ade1c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('note_chunks',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('note_id', sa.String(), nullable=False),
+    sa.Column('chunk_index', sa.Integer(), nullable=False),
+    sa.Column('start_offset', sa.Integer(), nullable=False),
+    sa.Column('end_offset', sa.Integer(), nullable=False),
+    sa.Column('heading', sa.String(), nullable=True),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('token_count', sa.Integer(), nullable=False),
+    sa.Column('vector', sa.LargeBinary(), nullable=False),
+    sa.Column('vector_dtype', sa.String(), server_default='float32', nullable=False),
+    sa.Column('model_name', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['note_id'], ['notes.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('note_id', 'chunk_index', name='uq_note_chunks_note_id_chunk_index')
+    )
+    op.create_index(op.f('ix_note_chunks_id'), 'note_chunks', ['id'], unique=False)
+    op.create_index(op.f('ix_note_chunks_note_id'), 'note_chunks', ['note_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_note_chunks_note_id'), table_name='note_chunks')
+    op.drop_index(op.f('ix_note_chunks_id'), table_name='note_chunks')
+    op.drop_table('note_chunks')
@@ -0,0 +1,34 @@
+"""add_content_hashes
+
+Revision ID: 8b0f8cb377e9
+Revises: 3c53f4c0de36
+Create Date: 2026-10-17 11:48:05.291377
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b0f8cb377e9'
+down_revision: Union[str, Sequence[str], None] = '3c53f4c0de36'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notes', sa.Column('content_md5', sa.String(), nullable=True))
+    op.add_column('note_chunks', sa.Column('text_hash', sa.String(), nullable=True))
+    op.create_index(op.f('ix_note_chunks_text_hash'), 'note_chunks', ['text_hash'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_note_chunks_text_hash'), table_name='note_chunks')
+    with op.batch_alter_table('note_chunks') as batch_op:
+        batch_op.drop_column('text_hash')
+    with op.batch_alter_table('notes') as batch_op:
+        batch_op.drop_column('content_md5')
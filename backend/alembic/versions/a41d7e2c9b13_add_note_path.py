@@ -0,0 +1,31 @@
+"""add_note_path
+
+Revision ID: a41d7e2c9b13
+Revises: 5554e6af08cf
+Create Date: 2026-10-17 14:05:12.318220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41d7e2c9b13'
+down_revision: Union[str, Sequence[str], None] = '5554e6af08cf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notes', sa.Column('path', sa.String(), nullable=True))
+    op.create_index(op.f('ix_notes_path'), 'notes', ['path'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_notes_path'), table_name='notes')
+    with op.batch_alter_table('notes') as batch_op:
+        batch_op.drop_column('path')
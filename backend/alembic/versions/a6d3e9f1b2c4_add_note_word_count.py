@@ -0,0 +1,37 @@
+"""add_note_word_count
+
+Revision ID: a6d3e9f1b2c4
+Revises: f2c8d4e6a9b1
+Create Date: 2026-10-17 21:12:44.180362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d3e9f1b2c4'
+down_revision: Union[str, Sequence[str], None] = 'f2c8d4e6a9b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('notes', sa.Column('word_count', sa.Integer(), nullable=True))
+    # Notas ya sincronizadas: se cuentan aquí para que el listado no tenga que leer su contenido
+    connection = op.get_bind()
+    rows = connection.execute(sa.text("SELECT id, content FROM notes")).fetchall()
+    for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+        connection.execute(sa.text("UPDATE notes SET word_count = :word_count WHERE id = :id"),
+                           [{"id": note_id, "word_count": len((content or "").split())} for note_id, content in rows[start:start + BACKFILL_BATCH_SIZE]])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('notes') as batch_op:
+        batch_op.drop_column('word_count')
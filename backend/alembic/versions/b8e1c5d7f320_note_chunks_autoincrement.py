@@ -0,0 +1,30 @@
+"""note_chunks_autoincrement
+
+Revision ID: b8e1c5d7f320
+Revises: d4b7f2a8c915
+Create Date: 2026-10-18 10:24:37.915406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e1c5d7f320'
+down_revision: Union[str, Sequence[str], None] = 'd4b7f2a8c915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite solo admite AUTOINCREMENT al crear la tabla: se reconstruye conservando los ids (son los del índice FAISS)
+    with op.batch_alter_table('note_chunks', recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        pass
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('note_chunks', recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+        pass
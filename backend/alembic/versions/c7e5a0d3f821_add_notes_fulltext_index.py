@@ -0,0 +1,44 @@
+"""add_notes_fulltext_index
+
+Revision ID: c7e5a0d3f821
+Revises: a41d7e2c9b13
+Create Date: 2026-10-17 15:32:48.907114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7e5a0d3f821'
+down_revision: Union[str, Sequence[str], None] = 'a41d7e2c9b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Tabla FTS5 de contenido externo sobre notes, mantenida por triggers (ver backend/fulltext.py)
+    op.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title, content, content='notes', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.rowid, old.title, old.content);
+    END""")
+    op.execute("""CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.rowid, old.title, old.content);
+        INSERT INTO notes_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+    END""")
+    op.execute("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS notes_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS notes_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS notes_fts_ai")
+    op.execute("DROP TABLE IF EXISTS notes_fts")
@@ -0,0 +1,64 @@
+"""key_notes_fts_on_fts_rowid
+
+Revision ID: d4b7f2a8c915
+Revises: a6d3e9f1b2c4
+Create Date: 2026-10-17 23:05:12.604217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b7f2a8c915'
+down_revision: Union[str, Sequence[str], None] = 'a6d3e9f1b2c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# El rowid implícito de `notes` (clave primaria de texto) puede renumerarse con un
+# VACUUM; notes_fts pasa a enlazarse por una columna entera explícita y estable.
+FTS_OBJECTS = ["DROP TRIGGER IF EXISTS notes_fts_au", "DROP TRIGGER IF EXISTS notes_fts_ad",
+               "DROP TRIGGER IF EXISTS notes_fts_ai", "DROP TABLE IF EXISTS notes_fts"]
+
+
+def fulltext_ddl(rowid_column: str, assign_rowid: bool) -> list:
+    assign = ("UPDATE notes SET fts_rowid = (SELECT IFNULL(MAX(fts_rowid), 0) + 1 FROM notes) WHERE id = new.id AND fts_rowid IS NULL;\n"
+              "        INSERT INTO notes_fts(rowid, title, content) SELECT fts_rowid, title, content FROM notes WHERE id = new.id;"
+              if assign_rowid else
+              f"INSERT INTO notes_fts(rowid, title, content) VALUES (new.{rowid_column}, new.title, new.content);")
+    return [
+        f"""CREATE VIRTUAL TABLE notes_fts USING fts5(
+            title, content, content='notes', content_rowid='{rowid_column}',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+        f"""CREATE TRIGGER notes_fts_ai AFTER INSERT ON notes BEGIN
+            {assign}
+        END""",
+        f"""CREATE TRIGGER notes_fts_ad AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.{rowid_column}, old.title, old.content);
+        END""",
+        f"""CREATE TRIGGER notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+            INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.{rowid_column}, old.title, old.content);
+            INSERT INTO notes_fts(rowid, title, content) VALUES (new.{rowid_column}, new.title, new.content);
+        END""",
+        "INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')",
+    ]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for statement in FTS_OBJECTS: op.execute(statement)
+    op.add_column('notes', sa.Column('fts_rowid', sa.Integer(), nullable=True))
+    op.execute("UPDATE notes SET fts_rowid = rowid")
+    op.create_index('ix_notes_fts_rowid', 'notes', ['fts_rowid'], unique=True)
+    for statement in fulltext_ddl('fts_rowid', assign_rowid=True): op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for statement in FTS_OBJECTS: op.execute(statement)
+    op.drop_index('ix_notes_fts_rowid', table_name='notes')
+    with op.batch_alter_table('notes') as batch_op:
+        batch_op.drop_column('fts_rowid')
+    for statement in fulltext_ddl('rowid', assign_rowid=False): op.execute(statement)
@@ -0,0 +1,62 @@
+"""add_sync_jobs_tables
+
+Revision ID: e3b9f1a4c6d2
+Revises: c7e5a0d3f821
+Create Date: 2026-10-17 18:04:12.511230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3b9f1a4c6d2'
+down_revision: Union[str, Sequence[str], None] = 'c7e5a0d3f821'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sync_jobs',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('kind', sa.String(), server_default='drive', nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('full', sa.Boolean(), server_default=sa.text('0'), nullable=False),
+    sa.Column('owner', sa.String(), nullable=True),
+    sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('message', sa.String(), nullable=True),
+    sa.Column('processed_files', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('total_files', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed_files', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('checkpoint', sa.Text(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_sync_jobs_id'), 'sync_jobs', ['id'], unique=False)
+    # Un único trabajo activo: el INSERT de un segundo trabajo falla aunque venga de otro worker
+    op.create_index('uq_sync_jobs_active', 'sync_jobs', ['kind'], unique=True, sqlite_where=sa.text("status IN ('queued', 'running')"))
+    op.create_table('sync_job_files',
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.Column('file_id', sa.String(), nullable=False),
+    sa.Column('file_name', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['job_id'], ['sync_jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('job_id', 'file_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_job_files')
+    op.drop_index('uq_sync_jobs_active', table_name='sync_jobs')
+    op.drop_index(op.f('ix_sync_jobs_id'), table_name='sync_jobs')
+    op.drop_table('sync_jobs')
@@ -0,0 +1,29 @@
+"""add_notes_listing_index
+
+Revision ID: f2c8d4e6a9b1
+Revises: e3b9f1a4c6d2
+Create Date: 2026-10-17 18:40:27.504113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8d4e6a9b1'
+down_revision: Union[str, Sequence[str], None] = 'e3b9f1a4c6d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Mismo orden que ORDER BY drive_modified_time DESC, title, id: SQLite recorre el índice sin ordenar aparte
+    op.create_index('ix_notes_listing', 'notes', [sa.text('drive_modified_time DESC'), 'title', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_notes_listing', table_name='notes')
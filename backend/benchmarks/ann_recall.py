@@ -0,0 +1,88 @@
+"""Informe recall@k vs latencia de los índices aproximados frente al índice flat exacto.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.ann_recall --vectors 100000 --queries 200 --k 10
+    python -m backend.benchmarks.ann_recall --from-db --json resultados.json   # embeddings reales de notes.db
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from backend import vector_index as vi
+from backend.embeddings import EMBEDDING_DIMENSION
+
+
+def synthetic_vectors(n: int, dimension: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Vectores agrupados en `clusters` temas, más parecidos a embeddings reales que el ruido uniforme."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    assignments = rng.integers(0, clusters, size=n)
+    return centers[assignments] + 0.5 * rng.standard_normal((n, dimension), dtype=np.float32)
+
+def load_db_vectors() -> np.ndarray:
+    from backend.main import SessionLocal
+    from backend.vector_store import load_embedding_matrix
+    db = SessionLocal()
+    try: return load_embedding_matrix(db)[2]
+    finally: db.close()
+
+def measure(index: vi.NoteVectorIndex, queries: np.ndarray, k: int, ground_truth: list, **params) -> dict:
+    latencies, hits = [], 0
+    for query, expected in zip(queries, ground_truth):
+        start = time.perf_counter()
+        _, found = index.search(query, k, **params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(found) & expected)
+    return {"recall_at_k": hits / (k * len(queries)), "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara recall@k y latencia de flat, IVF-Flat, IVF-PQ y HNSW.")
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimension", type=int, default=EMBEDDING_DIMENSION)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--from-db", action="store_true", help="Usar los embeddings de la base de datos local.")
+    parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--json", dest="json_path", help="Escribir los resultados en este fichero JSON.")
+    args = parser.parse_args()
+
+    vectors = load_db_vectors() if args.from_db else synthetic_vectors(args.vectors, args.dimension, args.clusters)
+    dimension = vectors.shape[1]
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape, dtype=np.float32)
+    faiss.normalize_L2(queries)
+    ids = np.arange(len(vectors), dtype=np.int64); note_ids = [str(i) for i in ids]
+
+    start = time.perf_counter()
+    flat = vi.NoteVectorIndex.build(ids, note_ids, vectors, dimension=dimension, index_type="flat")
+    print(f"flat: construido en {time.perf_counter() - start:.2f}s con {flat.ntotal} vectores")
+    ground_truth = [set(flat.search(query, args.k)[1]) for query in queries]
+    results = [{"index_type": "flat", "params": {}, **measure(flat, queries, args.k, ground_truth)}]
+
+    sweeps = {"ivf_flat": [{"nprobe": n} for n in (1, 4, 16, 64)], "ivf_pq": [{"nprobe": n} for n in (1, 4, 16, 64)],
+              "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)]}
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        if vi.effective_index_type(index_type, len(vectors)) != index_type:
+            print(f"{index_type}: omitido, necesita {vi.min_training_vectors(index_type, len(vectors))} vectores"); continue
+        start = time.perf_counter()
+        index = vi.NoteVectorIndex.build(ids, note_ids, vectors, dimension=dimension, index_type=index_type)
+        print(f"{index_type}: construido en {time.perf_counter() - start:.2f}s")
+        for params in sweeps[index_type]:
+            results.append({"index_type": index_type, "params": params, **measure(index, queries, args.k, ground_truth, **params)})
+
+    print(f"\n{'índice':<10} {'parámetros':<18} {'recall@' + str(args.k):>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        params = ",".join(f"{key}={value}" for key, value in r["params"].items()) or "-"
+        print(f"{r['index_type']:<10} {params:<18} {r['recall_at_k']:>10.3f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"vectors": len(vectors), "dimension": dimension, "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
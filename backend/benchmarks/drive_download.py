@@ -0,0 +1,71 @@
+"""Benchmark offline de la etapa de descargas de Drive contra un servidor local falso.
+
+Levanta un servidor HTTP en localhost que responde a `GET /files/<id>?alt=media`
+con una latencia simulada y descarga todos los ficheros con `iter_downloads`
+usando distintos niveles de paralelismo.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.drive_download --files 500 --latency 0.05 --workers 1 4 8 16
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+from backend.drive_client import GoogleDriveClient, iter_downloads
+
+
+def start_fake_drive_server(contents: dict, latency_s: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive, para que el pool de conexiones cuente
+        disable_nagle_algorithm = True # cabeceras y cuerpo van en escrituras separadas
+
+        def do_GET(self):
+            file_id = urlparse(self.path).path.rsplit("/", 1)[-1]
+            body = contents.get(file_id)
+            if latency_s: time.sleep(latency_s)
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            if body: self.wfile.write(body)
+
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide las descargas concurrentes de Drive contra un servidor falso local.")
+    parser.add_argument("--files", type=int, default=500)
+    parser.add_argument("--size", type=int, default=8 * 1024, help="Bytes por fichero.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia simulada por descarga (s).")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--max-inflight-bytes", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    contents = {f"file-{i}": (f"# Nota {i}\n\n" + "x" * args.size).encode("utf-8")[:args.size] for i in range(args.files)}
+    metas = [{"id": file_id, "name": f"{file_id}.md", "size": str(len(body))} for file_id, body in contents.items()]
+    server = start_fake_drive_server(contents, args.latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        for workers in args.workers:
+            drive = GoogleDriveClient(service=None, session_factory=requests.Session, base_url=base_url, pool_size=workers)
+            start = time.perf_counter(); total_bytes = 0; errors = 0
+            for _, content, error in iter_downloads(drive, metas, max_workers=workers, max_inflight_bytes=args.max_inflight_bytes):
+                if error: errors += 1
+                else: total_bytes += len(content)
+            elapsed = time.perf_counter() - start
+            print(f"workers={workers:3d}  tiempo: {elapsed:.2f}s  {len(metas) / elapsed:.1f} ficheros/s  "
+                  f"{total_bytes / elapsed / 1e6:.2f} MB/s  errores: {errors}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Benchmark offline de la etapa de embeddings por lotes.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.embedding_throughput --notes 2000 --latency 0.2 --workers 4
+"""
+import argparse
+import time
+
+from backend.embeddings import FakeEmbedder, embed_many
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide el throughput de embed_many con un embedder falso.")
+    parser.add_argument("--notes", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=300, help="Palabras por nota sintética.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Latencia simulada por petición (s).")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-items", type=int, default=256)
+    parser.add_argument("--max-tokens", type=int, default=100000)
+    args = parser.parse_args()
+
+    items = [(f"note-{i}", " ".join(f"palabra{(i * 7 + j) % 997}" for j in range(args.words))) for i in range(args.notes)]
+
+    sequential_estimate = args.notes * args.latency
+    embedder = FakeEmbedder(latency_s=args.latency)
+    start = time.perf_counter()
+    vectors = embed_many(items, embedder=embedder, max_workers=args.workers, max_tokens=args.max_tokens, max_items=args.max_items)
+    elapsed = time.perf_counter() - start
+
+    print(f"Notas: {len(vectors)}  peticiones: {embedder.calls}  tiempo: {elapsed:.2f}s  ({len(vectors) / elapsed:.1f} notas/s)")
+    print(f"Estimación secuencial (1 nota por petición): {sequential_estimate:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
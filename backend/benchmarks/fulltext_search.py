@@ -0,0 +1,85 @@
+"""Benchmark de /api/simple_search: índice FTS5 frente a LIKE '%q%' sobre un corpus sintético.
+
+Crea una base SQLite temporal con `--notes` notas generadas, aplica el índice
+FTS5 (mismo DDL que la migración) y mide la latencia de ambas consultas.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.fulltext_search --notes 50000 --repeat 20
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, or_
+from sqlalchemy.orm import sessionmaker
+
+from backend.database_models import Base, Note
+from backend.fulltext import create_fulltext_index, search_fulltext
+
+VOCABULARY_SIZE = 20000
+QUERIES = ["proyecto", "reunión semanal", "obsidian", "pal12", "idea libro", "fgh", "receta", "viaje japón"]
+
+
+def synthetic_word(rng: random.Random) -> str:
+    # Distribución aproximadamente Zipf: pocas palabras muy frecuentes y una cola larga
+    return f"pal{min(VOCABULARY_SIZE - 1, int(rng.paretovariate(1.1)) - 1)}"
+
+def populate(session, notes: int, words: int, seed: int = 0):
+    rng = random.Random(seed); topics = [q.split() for q in QUERIES]
+    batch = []
+    for i in range(notes):
+        body = [synthetic_word(rng) for _ in range(words)]
+        if rng.random() < 0.02: body[rng.randrange(words)] = " ".join(rng.choice(topics))
+        batch.append({"id": f"note-{i}", "title": f"Nota {i} {synthetic_word(rng)}", "path": f"carpeta{i % 50}/nota-{i}.md", "content": " ".join(body)})
+        if len(batch) >= 5000: session.bulk_insert_mappings(Note, batch); session.commit(); batch = []
+    if batch: session.bulk_insert_mappings(Note, batch); session.commit()
+
+def time_queries(run, repeat: int) -> list:
+    timings = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter(); run(query); timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+def summary(timings: list) -> str:
+    ordered = sorted(timings)
+    return f"p50 {statistics.median(ordered):8.2f} ms  p95 {ordered[int(len(ordered) * 0.95) - 1]:8.2f} ms  max {ordered[-1]:8.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara la búsqueda FTS5 con LIKE en un corpus sintético.")
+    parser.add_argument("--notes", type=int, default=50000)
+    parser.add_argument("--words", type=int, default=250, help="Palabras por nota sintética.")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection: create_fulltext_index(connection) # Vacío: los triggers indexan al insertar
+        session = sessionmaker(bind=engine)()
+
+        start = time.perf_counter(); populate(session, args.notes, args.words)
+        print(f"Corpus: {args.notes} notas de {args.words} palabras, insertadas (con triggers FTS5) en {time.perf_counter() - start:.1f}s")
+
+        def like_search(query):
+            pattern = f"%{query}%"
+            return session.query(Note).filter(or_(Note.title.ilike(pattern), Note.content.ilike(pattern))) \
+                .order_by(Note.drive_modified_time.desc().nullslast(), Note.title).limit(args.limit).all()
+
+        def fts_search(query):
+            hits = search_fulltext(session, query, args.limit)
+            return session.query(Note).filter(Note.id.in_([hit.note_id for hit in hits])).all()
+
+        like_search(QUERIES[0]); fts_search(QUERIES[0]) # Calentar la caché de páginas
+        print(f"LIKE  {summary(time_queries(like_search, args.repeat))}")
+        print(f"FTS5  {summary(time_queries(fts_search, args.repeat))}")
+        session.close(); engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
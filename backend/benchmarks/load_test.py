@@ -0,0 +1,154 @@
+"""Prueba de carga del camino de peticiones contra un servidor OpenAI falso local.
+
+Levanta un servidor HTTP en localhost que imita `/v1/embeddings` y
+`/v1/chat/completions` con una latencia simulada, sincroniza una bóveda
+sintética (`FakeDriveClient`) en una base temporal, arranca el backend con
+uvicorn y lanza `--users` usuarios concurrentes contra /api/knowledge-search
+(y/o /api/chat). Informa de p50/p90/p99 y del throughput. El servidor falso
+corre en otro proceso para no competir por el GIL con el backend medido.
+
+Cada petición usa una consulta distinta para que la caché de embeddings no
+oculte la llamada a OpenAI; `--repeat-queries` mide el caso con caché.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.load_test --users 50 --requests 20 --latency 0.2
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from backend.embeddings import EMBEDDING_DIMENSION, FakeEmbedder
+
+
+def serve_fake_openai(port, latency_s, embedding_calls, chat_calls):
+    """Proceso del servidor falso. `latency_s` y los contadores son `multiprocessing.Value` compartidos."""
+    embedder = FakeEmbedder(dimension=EMBEDDING_DIMENSION)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.endswith("/embeddings"):
+                texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+                vectors = embedder.embed(texts)
+                if payload.get("encoding_format") == "base64": # Lo que pide el SDK por defecto
+                    vectors = [base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii") for vector in vectors]
+                body = {"object": "list", "model": payload.get("model"), "usage": {"prompt_tokens": 0, "total_tokens": 0},
+                        "data": [{"object": "embedding", "index": i, "embedding": vector} for i, vector in enumerate(vectors)]}
+                counter = embedding_calls
+            elif self.path.endswith("/chat/completions"):
+                body = {"id": "chatcmpl-load", "object": "chat.completion", "created": int(time.time()), "model": payload.get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Respuesta simulada."}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+                counter = chat_calls
+            else:
+                self.send_response(404); self.send_header("Content-Length", "0"); self.end_headers(); return
+            with counter.get_lock(): counter.value += 1
+            if latency_s.value: time.sleep(latency_s.value)
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json"); self.send_header("Content-Length", str(len(data)))
+            self.end_headers(); self.wfile.write(data)
+
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0)); return sock.getsockname()[1]
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, max(0, int(round(len(ordered) * fraction)) - 1))]
+
+
+async def run_load(base_url: str, users: int, requests_per_user: int, endpoint: str, repeat_queries: bool) -> tuple:
+    import httpx
+    latencies, errors = [], 0
+
+    async def user(client, user_id: int):
+        nonlocal errors
+        for i in range(requests_per_user):
+            query = "proyecto reunión" if repeat_queries else f"consulta {user_id}-{i} proyecto"
+            kind = endpoint if endpoint != "mixed" else ("chat" if i % 4 == 3 else "knowledge")
+            path, body = ("/api/chat", {"message": query}) if kind == "chat" else ("/api/knowledge-search", {"query": query, "k": 5, "projection": "compact"})
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                if response.status_code != 200: errors += 1
+            except httpx.HTTPError: errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(client, u) for u in range(users)))
+        return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del backend con un servidor OpenAI falso local.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20, help="Peticiones por usuario.")
+    parser.add_argument("--notes", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.2, help="Latencia simulada de OpenAI por petición (s).")
+    parser.add_argument("--endpoint", choices=["knowledge", "chat", "mixed"], default="knowledge")
+    parser.add_argument("--repeat-queries", action="store_true", help="Repite la misma consulta (mide el camino con caché).")
+    args = parser.parse_args()
+
+    latency_s, embedding_calls, chat_calls = multiprocessing.Value("d", 0.0), multiprocessing.Value("i", 0), multiprocessing.Value("i", 0)
+    openai_port = free_port()
+    openai_server = multiprocessing.Process(target=serve_fake_openai, args=(openai_port, latency_s, embedding_calls, chat_calls), daemon=True)
+    openai_server.start()
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name) # notes.db y los ficheros FAISS son relativos al directorio de trabajo
+    os.environ.update({"OPENAI_API_KEY": "load-test", "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+                       "OBSIDIAN_VAULT_FOLDER_ID": "root", "EMBEDDER_BACKEND": "openai", "API_BEARER_TOKEN": ""})
+    import uvicorn
+    import backend.main as backend_main
+    from backend.database_models import Base
+    from backend.drive_client import FakeDriveClient
+    from backend.fulltext import create_fulltext_index
+
+    Base.metadata.create_all(backend_main.engine)
+    with backend_main.engine.begin() as connection: create_fulltext_index(connection)
+    drive = FakeDriveClient()
+    for i in range(args.notes):
+        drive.put_file(f"note-{i}", f"Nota {i}.md", f"# Nota {i}\n\nproyecto {i % 17} reunión semanal sobre el tema {i % 31} #t{i % 7}\n\n" + "texto " * 80)
+    db = backend_main.SessionLocal()
+    try: backend_main.perform_drive_sync_and_reindex(db, drive=drive)
+    finally: db.close()
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(backend_main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started: time.sleep(0.05)
+    latency_s.value = args.latency; embedding_calls.value = chat_calls.value = 0
+    try:
+        latencies, errors, elapsed = asyncio.run(run_load(f"http://127.0.0.1:{port}", args.users, args.requests, args.endpoint, args.repeat_queries))
+    finally:
+        server.should_exit = True; openai_server.terminate()
+    ordered = sorted(latencies)
+    print(f"{args.users} usuarios x {args.requests} peticiones ({args.endpoint}), latencia OpenAI simulada {args.latency * 1000:.0f} ms")
+    print(f"p50 {statistics.median(ordered):8.1f} ms  p90 {percentile(ordered, 0.90):8.1f} ms  p99 {percentile(ordered, 0.99):8.1f} ms  "
+          f"max {ordered[-1]:8.1f} ms")
+    print(f"throughput: {len(ordered) / elapsed:.1f} req/s  errores: {errors}  llamadas a OpenAI: {embedding_calls.value} embeddings, {chat_calls.value} chat")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""Suite de benchmarks reproducible y sin red: bóveda sintética, Drive falso y OpenAI falso.
+
+Genera una bóveda de Obsidian sintética (número de notas, distribución de
+tamaños log-normal, densidad de tags y anidamiento de carpetas configurables,
+todo a partir de `--seed`) en un `FakeDriveClient`, levanta el servidor OpenAI
+falso de `load_test` (embeddings deterministas y chat con latencia simulada) y
+mide sobre una base temporal:
+
+- sync_full / sync_incremental: sincronización completa y, tras modificar,
+  añadir y borrar una fracción de notas, la incremental por el feed de cambios
+  (con el desglose por etapa de backend/metrics.py).
+- index_build / index_load: construcción del índice FAISS desde la BD y carga
+  del snapshot de disco.
+- index_update: cambio incremental de los vectores de una nota, el primero tras
+  cargar el snapshot (con mmap copia el índice a memoria) y los siguientes (en
+  el sitio, independientes del tamaño de la bóveda).
+- simple_search, knowledge_search, chat: latencia de los endpoints (con
+  consultas distintas en cada petición, para no medir las cachés).
+
+Los resultados se escriben en JSON (`--output`) con el commit y los parámetros;
+`--baseline` compara con un resultado anterior y, con `--max-regression`,
+termina con código 1 si alguna métrica empeora más de esa fracción.
+
+Uso (desde la raíz del proyecto):
+    python -m backend.benchmarks.suite --notes 2000 --output bench.json
+    python -m backend.benchmarks.suite --notes 2000 --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from backend.benchmarks.load_test import free_port, percentile, serve_fake_openai
+from backend.drive_client import FakeDriveClient
+
+BENCHMARK_API_TOKEN = "benchmark"
+# Métricas comparadas con --baseline (menor es mejor)
+COMPARED_METRICS = ("sync_full.seconds", "sync_incremental.seconds", "index_build.median_s", "index_load.median_s",
+                    "index_update.first_after_load_s", "index_update.median_s",
+                    "simple_search.p50_ms", "simple_search.p90_ms", "knowledge_search.p50_ms", "knowledge_search.p90_ms",
+                    "chat.p50_ms", "chat.p90_ms")
+
+
+# --- Bóveda sintética ---
+class SyntheticVault:
+    """Genera notas y carpetas deterministas a partir de una semilla."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.vocabulary = [f"pal{i}" for i in range(args.vocabulary)]
+        self.tags = [f"tema{i}" for i in range(args.tag_vocabulary)]
+        self.folders: List[str] = ["root"]
+        self.next_note = 0
+        self.base_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def word(self) -> str:
+        # Distribución aproximadamente Zipf: pocas palabras muy frecuentes y una cola larga
+        return self.vocabulary[min(len(self.vocabulary) - 1, int(self.rng.paretovariate(1.1)) - 1)]
+
+    def note_words(self) -> int:
+        return max(5, int(self.rng.lognormvariate(math.log(self.args.median_words), self.args.size_sigma)))
+
+    def note_tags(self) -> List[str]:
+        # Número de tags binomial con media `tags_per_note`; los tags también siguen una distribución Zipf
+        count = sum(1 for _ in range(self.args.max_tags) if self.rng.random() < min(1.0, self.args.tags_per_note / self.args.max_tags))
+        return list(dict.fromkeys(self.tags[min(len(self.tags) - 1, int(self.rng.paretovariate(0.8)) - 1)] for _ in range(count)))
+
+    def note_content(self, index: int) -> str:
+        words = self.note_words(); paragraphs = []
+        while words > 0:
+            size = min(words, self.rng.randint(30, 120)); words -= size
+            paragraphs.append(" ".join(self.word() for _ in range(size)))
+        sections = [f"## Sección {i}\n\n{paragraph}" if i % 3 == 0 else paragraph for i, paragraph in enumerate(paragraphs)]
+        tags = " ".join(f"#{tag}" for tag in self.note_tags())
+        return f"# Nota {index}\n\n{tags}\n\n" + "\n\n".join(sections)
+
+    def build_folders(self, drive: FakeDriveClient):
+        level = ["root"]
+        for depth in range(self.args.depth):
+            next_level = []
+            for parent in level:
+                for i in range(self.args.folders_per_level):
+                    folder_id = f"{parent}-{i}" if parent != "root" else f"f{i}"
+                    drive.put_folder(folder_id, f"Carpeta {depth}.{i}", parents=[parent]); next_level.append(folder_id)
+            level = next_level; self.folders.extend(level)
+
+    def modified_time(self) -> str:
+        return (self.base_time + timedelta(minutes=self.rng.randint(0, 365 * 24 * 60))).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+    def add_note(self, drive: FakeDriveClient) -> str:
+        index = self.next_note; self.next_note += 1
+        note_id = f"note-{index}"
+        drive.put_file(note_id, f"Nota {index}.md", self.note_content(index), parents=[self.rng.choice(self.folders)], modified_time=self.modified_time())
+        return note_id
+
+    def populate(self, drive: FakeDriveClient) -> List[str]:
+        self.build_folders(drive)
+        return [self.add_note(drive) for _ in range(self.args.notes)]
+
+    def mutate(self, drive: FakeDriveClient, note_ids: List[str]) -> Dict[str, int]:
+        """Cambios entre la sincronización completa y la incremental: modifica, añade y borra notas."""
+        changed = max(1, int(len(note_ids) * self.args.change_fraction))
+        modified = self.rng.sample(note_ids, min(changed, len(note_ids)))
+        for note_id in modified:
+            meta = drive.files[note_id]
+            content = drive.contents[note_id].decode("utf-8") + "\n\n" + " ".join(self.word() for _ in range(40))
+            drive.put_file(note_id, meta["name"], content, parents=meta["parents"], modified_time=self.modified_time())
+        added = [self.add_note(drive) for _ in range(max(1, changed // 2))]
+        deleted = [note_id for note_id in self.rng.sample(note_ids, min(max(1, changed // 4), len(note_ids))) if note_id not in modified]
+        for note_id in deleted: drive.delete_file(note_id)
+        return {"modified": len(modified), "added": len(added), "deleted": len(deleted)}
+
+    def query(self, i: int) -> str:
+        return f"{self.word()} {self.word()} {self.rng.choice(self.vocabulary)} consulta {i}"
+
+
+# --- Medición ---
+def latency_summary(latencies_ms: List[float], errors: int = 0) -> dict:
+    ordered = sorted(latencies_ms)
+    if not ordered: return {"n": 0, "errors": errors}
+    return {"n": len(ordered), "errors": errors, "mean_ms": round(statistics.fmean(ordered), 3), "p50_ms": round(statistics.median(ordered), 3),
+            "p90_ms": round(percentile(ordered, 0.90), 3), "p99_ms": round(percentile(ordered, 0.99), 3), "max_ms": round(ordered[-1], 3)}
+
+def repeated(function: Callable[[], object], repeat: int) -> dict:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter(); function(); runs.append(time.perf_counter() - start)
+    return {"runs_s": [round(run, 4) for run in runs], "median_s": round(statistics.median(runs), 4)}
+
+def stage_seconds_since(before: dict) -> Dict[str, float]:
+    from backend.metrics import STAGE_DURATION
+    stages = {}
+    for key, (count, total) in STAGE_DURATION.totals().items():
+        previous_count, previous_total = before.get(key, (0, 0.0))
+        if count > previous_count: stages[key[0]] = round(total - previous_total, 4)
+    return dict(sorted(stages.items()))
+
+def index_update_timings(backend_main, repeat: int) -> dict:
+    from backend.database_models import NoteChunk
+    from backend.vector_store import decode_vector
+    db = backend_main.SessionLocal()
+    try:
+        note_id = db.query(NoteChunk.note_id).order_by(NoteChunk.id).limit(1).scalar()
+        upserts = [(chunk_id, chunk_note_id, decode_vector(blob, dtype)) for chunk_id, chunk_note_id, blob, dtype in
+                   db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.vector, NoteChunk.vector_dtype).filter(NoteChunk.note_id == note_id)]
+    finally: db.close()
+    manager = backend_main.index_manager
+    snapshot = manager.load_from_disk()
+    mmapped = bool(snapshot and snapshot.vector_index.mmapped)
+    start = time.perf_counter(); manager.apply_updates(upserts, []); first = time.perf_counter() - start
+    return {"vectors": len(upserts), "mmapped_after_load": mmapped, "first_after_load_s": round(first, 4),
+            **repeated(lambda: manager.apply_updates(upserts, []), repeat)}
+
+def git_revision() -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError): return {"commit": None, "dirty": None}
+
+def endpoint_latencies(client, requests: int, make_request: Callable[[int], tuple]) -> dict:
+    latencies, errors = [], 0
+    for i in range(requests):
+        method, path, body = make_request(i)
+        start = time.perf_counter()
+        response = client.request(method, path, json=body)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200: errors += 1
+    return latency_summary(latencies, errors)
+
+
+def run_suite(args: argparse.Namespace, embedding_calls, chat_calls) -> dict:
+    import backend.main as backend_main
+    from fastapi.testclient import TestClient
+    from backend.database_models import Base
+    from backend.fulltext import create_fulltext_index
+    from backend.index_manager import SnapshotStore
+    from backend.metrics import STAGE_DURATION
+
+    Base.metadata.create_all(backend_main.engine)
+    with backend_main.engine.begin() as connection: create_fulltext_index(connection)
+    vault = SyntheticVault(args); drive = FakeDriveClient(latency_s=args.drive_latency)
+    note_ids = vault.populate(drive)
+    results: Dict[str, dict] = {}
+
+    def timed_sync(name: str, extra: dict):
+        before, calls_before, downloads_before = STAGE_DURATION.totals(), embedding_calls.value, drive.downloads
+        db = backend_main.SessionLocal(); start = time.perf_counter()
+        try: backend_main.perform_drive_sync_and_reindex(db, drive=drive)
+        finally: db.close()
+        backend_main.index_manager.wait_for_build() # La primera sincronización construye el índice en segundo plano
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": round(elapsed, 4), **extra, "drive_downloads": drive.downloads - downloads_before,
+                         "embedding_requests": embedding_calls.value - calls_before, "stages_s": stage_seconds_since(before)}
+        print(f"{name}: {elapsed:.2f}s")
+
+    print(f"Bóveda sintética: {len(note_ids)} notas en {len(vault.folders)} carpetas.")
+    timed_sync("sync_full", {"notes": len(note_ids)})
+    timed_sync("sync_incremental", vault.mutate(drive, note_ids))
+
+    results["index_build"] = repeated(backend_main.build_faiss_index_from_db, args.repeat)
+    results["index_load"] = repeated(lambda: SnapshotStore(".").load(), args.repeat)
+    results["index_update"] = index_update_timings(backend_main, args.repeat)
+    print(f"index_build: {results['index_build']['median_s']:.3f}s  index_load: {results['index_load']['median_s']:.3f}s  "
+          f"index_update: {results['index_update']['first_after_load_s'] * 1000:.1f} ms (primero tras cargar), {results['index_update']['median_s'] * 1000:.1f} ms")
+
+    client = TestClient(backend_main.app, headers={"X-API-Token": BENCHMARK_API_TOKEN})
+    results["simple_search"] = endpoint_latencies(client, args.requests, lambda i: ("POST", "/api/simple_search", {"query": vault.query(i), "limit": 10}))
+    results["knowledge_search"] = endpoint_latencies(client, args.requests, lambda i: ("POST", "/api/knowledge-search",
+                                                                                       {"query": vault.query(i), "k": 5, "projection": "compact"}))
+    chat_before = chat_calls.value
+    results["chat"] = endpoint_latencies(client, max(1, args.requests // 4), lambda i: ("POST", "/api/chat", {"message": vault.query(i)}))
+    results["chat"]["completion_requests"] = chat_calls.value - chat_before
+    for name in ("simple_search", "knowledge_search", "chat"):
+        summary = results[name]
+        print(f"{name}: p50 {summary.get('p50_ms', 0):.1f} ms  p90 {summary.get('p90_ms', 0):.1f} ms  errores {summary['errors']}")
+    return results
+
+
+# --- Comparación con un resultado anterior ---
+def metric_value(results: dict, path: str) -> Optional[float]:
+    value = results
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value: return None
+        value = value[part]
+    return float(value) if isinstance(value, (int, float)) else None
+
+def compare(current: dict, baseline: dict, max_regression: Optional[float]) -> bool:
+    """Imprime la variación de cada métrica frente a `baseline`. False si alguna empeora más de `max_regression`."""
+    ok = True
+    print(f"\nComparación con {baseline.get('meta', {}).get('commit') or 'la referencia'}:")
+    for path in COMPARED_METRICS:
+        new, old = metric_value(current["results"], path), metric_value(baseline.get("results", {}), path)
+        if new is None or old is None or old <= 0: continue
+        change = (new - old) / old
+        regression = max_regression is not None and change > max_regression
+        ok &= not regression
+        print(f"  {path:28s} {old:10.3f} -> {new:10.3f}  {change:+7.1%}{'  REGRESIÓN' if regression else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline del backend con una bóveda sintética y servicios falsos.")
+    parser.add_argument("--notes", type=int, default=1000)
+    parser.add_argument("--median-words", type=int, default=250, help="Mediana de palabras por nota (distribución log-normal).")
+    parser.add_argument("--size-sigma", type=float, default=0.8, help="Dispersión (sigma) del tamaño de las notas.")
+    parser.add_argument("--tags-per-note", type=float, default=2.0, help="Media de tags por nota.")
+    parser.add_argument("--max-tags", type=int, default=8, help="Máximo de tags por nota.")
+    parser.add_argument("--tag-vocabulary", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--depth", type=int, default=3, help="Niveles de carpetas anidadas.")
+    parser.add_argument("--folders-per-level", type=int, default=3, help="Subcarpetas por carpeta.")
+    parser.add_argument("--change-fraction", type=float, default=0.05, help="Fracción de notas modificadas antes de la sincronización incremental.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latencia simulada de OpenAI por petición (s).")
+    parser.add_argument("--drive-latency", type=float, default=0.0, help="Latencia simulada de cada descarga de Drive (s).")
+    parser.add_argument("--requests", type=int, default=100, help="Peticiones por endpoint de búsqueda (chat usa la cuarta parte).")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de construcción y carga del índice.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados.")
+    parser.add_argument("--baseline", help="Resultado JSON anterior con el que comparar.")
+    parser.add_argument("--max-regression", type=float, default=None, help="Con --baseline: fracción de empeoramiento tolerada (p. ej. 0.2).")
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)
+
+    latency_s, embedding_calls, chat_calls = multiprocessing.Value("d", args.latency), multiprocessing.Value("i", 0), multiprocessing.Value("i", 0)
+    openai_port = free_port()
+    openai_server = multiprocessing.Process(target=serve_fake_openai, args=(openai_port, latency_s, embedding_calls, chat_calls), daemon=True)
+    openai_server.start()
+    workdir = tempfile.TemporaryDirectory()
+    os.chdir(workdir.name) # notes.db y los ficheros FAISS son relativos al directorio de trabajo
+    os.environ.update({"OPENAI_API_KEY": "benchmark", "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+                       "OBSIDIAN_VAULT_FOLDER_ID": "root", "EMBEDDER_BACKEND": "openai", "API_BEARER_TOKEN": BENCHMARK_API_TOKEN})
+    started_at = datetime.now(timezone.utc)
+    try: results = run_suite(args, embedding_calls, chat_calls)
+    finally: openai_server.terminate()
+
+    report = {"suite": "obsidian-vault-gpt-backend", "format": 1,
+              "meta": {**git_revision(), "started_at": started_at.isoformat(), "python": sys.version.split()[0],
+                       "platform": platform.platform(), "cpu_count": os.cpu_count(), "params": vars(args)},
+              "results": results}
+    if output_path:
+        with open(output_path, "w") as f: json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {output_path}")
+    if baseline is not None and not compare(report, baseline, args.max_regression): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""División de notas Markdown en fragmentos (chunks) para los embeddings.
+
+Cada nota se separa primero por encabezados y después por párrafos; los
+párrafos se agrupan en fragmentos de hasta `CHUNK_MAX_TOKENS` tokens (medidos
+con tiktoken) y cada fragmento repite los últimos párrafos del anterior hasta
+`CHUNK_OVERLAP_TOKENS` para no cortar ideas por la mitad. Los offsets son
+posiciones de carácter en `Note.content`.
+"""
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from backend.embeddings import count_tokens
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+_HEADING_RE = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$", re.MULTILINE)
+_PARAGRAPH_BREAK_RE = re.compile(r"\n[ \t]*\n")
+_FENCE_RE = re.compile(r"```.*?```", re.DOTALL)
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: int
+    end: int
+    heading: Optional[str]
+    text: str
+    token_count: int
+
+    def embedding_text(self, title: str) -> str:
+        header = f"{title}\n{self.heading}" if self.heading else title
+        return f"{header}\n\n{self.text}"
+
+
+def _sections(content: str) -> List[Tuple[int, int, Optional[str]]]:
+    """(inicio, fin, ruta de encabezados) de cada sección. Ignora '#' dentro de bloques de código."""
+    fences = [(m.start(), m.end()) for m in _FENCE_RE.finditer(content)]
+    headings = [m for m in _HEADING_RE.finditer(content) if not any(start <= m.start() < end for start, end in fences)]
+    sections: List[Tuple[int, int, Optional[str]]] = []
+    path: List[Tuple[int, str]] = []
+    previous_start, previous_heading = 0, None
+    for match in headings:
+        if match.start() > previous_start: sections.append((previous_start, match.start(), previous_heading))
+        level = len(match.group(1))
+        path = [(lvl, name) for lvl, name in path if lvl < level] + [(level, match.group(2).strip())]
+        previous_start, previous_heading = match.start(), " > ".join(name for _, name in path)
+    sections.append((previous_start, len(content), previous_heading))
+    return sections
+
+def _split_oversized(content: str, start: int, end: int, max_tokens: int) -> List[Tuple[int, int, int]]:
+    """Corta un párrafo demasiado largo en trozos de palabras completas de hasta `max_tokens`."""
+    pieces: List[Tuple[int, int, int]] = []
+    piece_start, piece_tokens, last_end = None, 0, start
+    for word in re.finditer(r"\S+\s*", content[start:end]):
+        word_start, word_end = start + word.start(), start + word.end()
+        word_tokens = count_tokens(word.group())
+        if piece_start is not None and piece_tokens + word_tokens > max_tokens:
+            pieces.append((piece_start, last_end, piece_tokens)); piece_start, piece_tokens = None, 0
+        if piece_start is None: piece_start = word_start
+        piece_tokens += word_tokens; last_end = word_end
+    if piece_start is not None: pieces.append((piece_start, last_end, piece_tokens))
+    return pieces
+
+def _units(content: str, start: int, end: int, max_tokens: int, overlap_tokens: int) -> List[Tuple[int, int, int]]:
+    """Párrafos de la sección como (inicio, fin, tokens), sin espacios en los bordes.
+
+    Los párrafos que no caben en un fragmento se trocean al tamaño del solapamiento,
+    para que el fragmento siguiente pueda repetir el último trozo.
+    """
+    units: List[Tuple[int, int, int]] = []
+    cursor = start
+    for boundary in list(_PARAGRAPH_BREAK_RE.finditer(content, start, end)) + [None]:
+        paragraph_end = boundary.start() if boundary else end
+        raw = content[cursor:paragraph_end]
+        if raw.strip():
+            p_start = cursor + (len(raw) - len(raw.lstrip())); p_end = cursor + len(raw.rstrip())
+            tokens = count_tokens(content[p_start:p_end])
+            if tokens > max_tokens: units.extend(_split_oversized(content, p_start, p_end, overlap_tokens or max_tokens))
+            else: units.append((p_start, p_end, tokens))
+        if boundary: cursor = boundary.end()
+    return units
+
+def chunk_note(content: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Chunk]:
+    """Divide `content` en fragmentos solapados respetando encabezados y párrafos."""
+    if not content or not content.strip(): return []
+    chunks: List[Chunk] = []
+    for section_start, section_end, heading in _sections(content):
+        units = _units(content, section_start, section_end, max_tokens, min(overlap_tokens, max_tokens))
+        current: List[Tuple[int, int, int]] = []
+        has_new_content = False
+        for unit in units:
+            if current and sum(u[2] for u in current) + unit[2] > max_tokens:
+                chunks.append(_make_chunk(content, len(chunks), current, heading))
+                # Solapamiento: arrastrar los últimos párrafos que quepan en overlap_tokens
+                carried: List[Tuple[int, int, int]] = []
+                for previous in reversed(current):
+                    if sum(u[2] for u in carried) + previous[2] > overlap_tokens: break
+                    carried.insert(0, previous)
+                while carried and sum(u[2] for u in carried) + unit[2] > max_tokens: carried.pop(0)
+                current = carried; has_new_content = False
+            current.append(unit); has_new_content = True
+        if current and has_new_content: chunks.append(_make_chunk(content, len(chunks), current, heading))
+    return chunks
+
+def _make_chunk(content: str, index: int, units: List[Tuple[int, int, int]], heading: Optional[str]) -> Chunk:
+    start, end = units[0][0], units[-1][1]
+    return Chunk(index=index, start=start, end=end, heading=heading, text=content[start:end], token_count=sum(u[2] for u in units))
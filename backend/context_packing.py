@@ -0,0 +1,84 @@
+"""Contexto del chat: fragmentos recuperados empaquetados en un presupuesto de tokens.
+
+El backend recupera de FAISS los fragmentos más relevantes para la pregunta y
+aquí se preparan para el prompt:
+
+- Los fragmentos de una misma nota que se solapan (los chunks repiten los
+  últimos párrafos del anterior) o son contiguos se fusionan en un único
+  pasaje sin el texto repetido.
+- Los pasajes con el mismo texto en notas distintas (copias) se descartan.
+- Se añaden de mayor a menor puntuación mientras quepan en
+  `CHAT_CONTEXT_MAX_TOKENS` (medidos con tiktoken), así que el tamaño del
+  prompt queda acotado sea cual sea el número de notas.
+"""
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+from backend.embeddings import count_tokens
+
+CHAT_CONTEXT_MAX_TOKENS = int(os.getenv("CHAT_CONTEXT_MAX_TOKENS", "3000"))
+PASSAGE_SEPARATOR = "\n---\n"
+
+
+@dataclass
+class Passage:
+    note_id: str
+    text: str
+    score: float
+    title: Optional[str] = None
+    path: Optional[str] = None
+    heading: Optional[str] = None
+    start: int = 0 # Offsets de carácter en Note.content
+    end: int = 0
+
+    def formatted(self) -> str:
+        header = " > ".join(part for part in (self.title, self.heading) if part)
+        return f"[{header}]\n{self.text}" if header else self.text
+
+
+@dataclass
+class PackedContext:
+    text: str
+    passages: List[Passage] = field(default_factory=list) # Incluidos, en el orden del prompt
+    tokens: int = 0
+    dropped: int = 0 # Pasajes que no cupieron en el presupuesto
+
+
+def merge_overlapping(passages: Sequence[Passage]) -> List[Passage]:
+    """Fusiona los pasajes solapados o contiguos de cada nota (puntuación = la mejor)."""
+    by_note: Dict[str, List[Passage]] = {}
+    for passage in passages: by_note.setdefault(passage.note_id, []).append(passage)
+    merged: List[Passage] = []
+    for note_passages in by_note.values():
+        current: Optional[Passage] = None
+        for passage in sorted(note_passages, key=lambda p: (p.start, p.end)):
+            if current is not None and passage.end > passage.start and passage.start <= current.end:
+                if passage.end > current.end: current.text += passage.text[current.end - passage.start:]; current.end = passage.end
+                current.score = max(current.score, passage.score)
+                continue
+            if current is not None: merged.append(current)
+            current = Passage(**vars(passage))
+        if current is not None: merged.append(current)
+    return merged
+
+def _text_fingerprint(text: str) -> str:
+    return hashlib.sha1(" ".join(text.split()).casefold().encode("utf-8")).hexdigest()
+
+def pack_context(passages: Sequence[Passage], max_tokens: int = CHAT_CONTEXT_MAX_TOKENS) -> PackedContext:
+    """Elige los mejores pasajes (sin duplicados) que caben en `max_tokens` y los une en un solo texto."""
+    candidates = sorted(merge_overlapping(passages), key=lambda p: p.score, reverse=True)
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    selected: List[Passage] = []; seen = set(); used = 0; dropped = 0
+    for passage in candidates:
+        fingerprint = _text_fingerprint(passage.text)
+        if not passage.text.strip() or fingerprint in seen: continue
+        cost = count_tokens(passage.formatted()) + (separator_tokens if selected else 0)
+        if used + cost > max_tokens: dropped += 1; continue # Otro más corto puede caber todavía
+        seen.add(fingerprint); selected.append(passage); used += cost
+    # En el prompt, agrupados por nota (la mejor primero) y en el orden en que aparecen en ella
+    note_rank = {}
+    for passage in selected: note_rank.setdefault(passage.note_id, len(note_rank))
+    selected.sort(key=lambda p: (note_rank[p.note_id], p.start))
+    return PackedContext(text=PASSAGE_SEPARATOR.join(p.formatted() for p in selected), passages=selected, tokens=used, dropped=dropped)
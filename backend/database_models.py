@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Table
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Text, ForeignKey, Index, Table, LargeBinary, UniqueConstraint, text
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
 import datetime
@@ -16,15 +16,22 @@ class Note(Base):
 
     id = Column(String, primary_key=True, index=True) # Google Drive File ID
     title = Column(String, index=True)
+    path = Column(String, nullable=True, index=True) # Ruta relativa en la bóveda, p. ej. "Proyectos/2024/Nota.md"
     content = Column(Text)
     created_at = Column(DateTime, server_default=func.now())
     modified_at = Column(DateTime, server_default=func.now(), onupdate=func.now()) # Drive's modifiedTime
     drive_modified_time = Column(DateTime, nullable=True) # Explicitly store Google Drive's modifiedTime
     source_url = Column(String, nullable=True) # webViewLink from Drive
+    content_md5 = Column(String, nullable=True) # md5Checksum de Drive; si no cambia no se descarga ni se reindexa
+    word_count = Column(Integer, nullable=True) # Calculado al guardar el contenido: el listado no necesita leerlo
+    fts_rowid = Column(Integer, nullable=True) # Enlace estable con notes_fts (lo asigna un trigger; ver backend/fulltext.py)
 
     # Relación muchos a muchos con Tag
     tags = relationship("Tag", secondary=note_tags_table, back_populates="notes")
 
+    # Orden de la biblioteca (fecha de Drive descendente, título, id): la paginación por cursor de /api/notes es un rango sobre este índice
+    __table_args__ = (Index("ix_notes_listing", drive_modified_time.desc(), title, id), Index("ix_notes_fts_rowid", fts_rowid, unique=True))
+
     def __repr__(self):
         return f"<Note(id='{self.id}', title='{self.title}')>"
 
@@ -41,14 +48,15 @@ class Tag(Base):
         return f"<Tag(name='{self.name}')>"
 
 class Embedding(Base):
+    # Embedding de la nota completa. Sustituido por NoteChunk (un vector por fragmento); ya no se escribe.
     __tablename__ = "embeddings"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     # Foreign key a notes.id. unique=True asegura una relación uno a uno (o uno a cero) desde Note.
     # Si una nota se elimina, su embedding asociado también (ondelete='CASCADE').
     note_id = Column(String, ForeignKey("notes.id", ondelete='CASCADE'), unique=True, nullable=False, index=True)
-    vector = Column(Text, nullable=False) # Almacenará el vector como un string JSON. Para SQLite, Text es adecuado.
-                                        # Para otras BDs, JSON o tipos específicos de array/vector serían mejores.
+    vector = Column(LargeBinary, nullable=False) # Bytes crudos del vector (ver backend/vector_store.py), ~4x menos que JSON.
+    vector_dtype = Column(String, nullable=False, server_default="float32") # "float32" o "float16"
     model_name = Column(String, nullable=False) # Ej. "text-embedding-3-small"
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
@@ -60,3 +68,74 @@ class Embedding(Base):
 # uselist=False es clave para la relación uno-a-uno desde el lado "uno".
 # cascade="all, delete-orphan" asegura que si se elimina una Note, su Embedding también.
 Note.embedding = relationship("Embedding", uselist=False, back_populates="note", cascade="all, delete-orphan")
+
+class NoteChunk(Base):
+    """Fragmento de una nota con su embedding. Su id es el ID del vector en el índice FAISS."""
+    __tablename__ = "note_chunks"
+    # AUTOINCREMENT: un id borrado no se reutiliza, porque el índice FAISS podría aplicar el borrado del fragmento
+    # viejo sobre el nuevo que ocupase su id
+    __table_args__ = (UniqueConstraint("note_id", "chunk_index", name="uq_note_chunks_note_id_chunk_index"), {"sqlite_autoincrement": True})
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    note_id = Column(String, ForeignKey("notes.id", ondelete='CASCADE'), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False) # Posición del fragmento dentro de la nota
+    start_offset = Column(Integer, nullable=False) # Offsets de carácter en Note.content
+    end_offset = Column(Integer, nullable=False)
+    heading = Column(String, nullable=True) # Ruta de encabezados, ej. "Entrenamiento > Fuerza"
+    text = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=False)
+    text_hash = Column(String, nullable=True, index=True) # sha256 del texto enviado a embeddings (+ modelo), para reutilizar vectores
+    vector = Column(LargeBinary, nullable=False)
+    vector_dtype = Column(String, nullable=False, server_default="float32")
+    model_name = Column(String, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+    note = relationship("Note", back_populates="chunks")
+
+Note.chunks = relationship("NoteChunk", back_populates="note", cascade="all, delete-orphan", passive_deletes=True, order_by=NoteChunk.chunk_index)
+
+class SyncState(Base):
+    """Estado persistente de la sincronización (clave/valor), p. ej. el page token del feed de cambios de Drive."""
+    __tablename__ = "sync_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class SyncJob(Base):
+    """Una ejecución de la sincronización con Drive, compartida por todos los workers a través de la BD.
+
+    Solo puede haber un trabajo activo (queued/running) a la vez (índice único
+    parcial). Lo ejecuta el worker que tiene la lease (`owner`, renovada
+    periódicamente); si caduca, otro worker puede reanudarlo desde `checkpoint`.
+    """
+    __tablename__ = "sync_jobs"
+    __table_args__ = (Index("uq_sync_jobs_active", "kind", unique=True, sqlite_where=text("status IN ('queued', 'running')")),)
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    kind = Column(String, nullable=False, server_default="drive")
+    status = Column(String, nullable=False) # queued, running, success, error
+    full = Column(Boolean, nullable=False, server_default=text("0")) # Sincronización completa en lugar de incremental
+    owner = Column(String, nullable=True) # Worker que la ejecuta (host:pid:aleatorio)
+    lease_expires_at = Column(DateTime, nullable=True) # UTC
+    attempts = Column(Integer, nullable=False, server_default="0")
+    message = Column(String, nullable=True)
+    processed_files = Column(Integer, nullable=False, server_default="0")
+    total_files = Column(Integer, nullable=False, server_default="0")
+    failed_files = Column(Integer, nullable=False, server_default="0")
+    checkpoint = Column(Text, nullable=True) # JSON con el plan (ficheros, page token, árbol de carpetas) para reanudar
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+class SyncJobFile(Base):
+    """Fichero de un SyncJob ya terminado (`done`, sus embeddings guardados) o con error (`error`)."""
+    __tablename__ = "sync_job_files"
+
+    job_id = Column(Integer, ForeignKey("sync_jobs.id", ondelete='CASCADE'), primary_key=True)
+    file_id = Column(String, primary_key=True)
+    file_name = Column(String, nullable=True)
+    status = Column(String, nullable=False)
+    error = Column(Text, nullable=True)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
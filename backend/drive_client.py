@@ -0,0 +1,323 @@
+"""Acceso a Google Drive detrás de una interfaz mínima.
+
+`GoogleDriveClient` envuelve el servicio de googleapiclient; `FakeDriveClient`
+es una implementación en memoria (con su propio feed de cambios) para pruebas y
+benchmarks sin red. La sincronización solo usa los métodos de `DriveClient`.
+
+La bóveda se recorre de forma recursiva (`list_vault_files`): en cada nivel se
+consultan varias carpetas por petición (`'a' in parents or 'b' in parents ...`)
+y el árbol de carpetas (`FolderTree`) se guarda para calcular rutas y decidir
+qué cambios del feed pertenecen a la bóveda sin volver a listarla.
+
+`iter_downloads` descarga ficheros en paralelo con un pool de hilos acotado y
+un límite de bytes en vuelo, y entrega cada fichero en cuanto termina para que
+el parseo y los embeddings se solapen con la red.
+"""
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Protocol, Set, Tuple
+
+from backend.metrics import span
+
+FILE_FIELDS = "id, name, modifiedTime, webViewLink, mimeType, md5Checksum, size, parents, trashed"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+LIST_PAGE_SIZE = 1000 # Máximo admitido por files.list y changes.list
+DRIVE_PARENTS_PER_QUERY = int(os.getenv("DRIVE_PARENTS_PER_QUERY", "40")) # Carpetas por consulta files.list
+DRIVE_API_BASE_URL = os.getenv("DRIVE_API_BASE_URL", "https://www.googleapis.com/drive/v3")
+DRIVE_DOWNLOAD_WORKERS = int(os.getenv("DRIVE_DOWNLOAD_WORKERS", "8"))
+DRIVE_MAX_INFLIGHT_BYTES = int(os.getenv("DRIVE_MAX_INFLIGHT_BYTES", str(64 * 1024 * 1024)))
+DRIVE_DOWNLOAD_TIMEOUT_S = float(os.getenv("DRIVE_DOWNLOAD_TIMEOUT_S", "60"))
+
+
+def is_markdown_file(meta: dict) -> bool:
+    name = (meta.get("name") or "").lower()
+    return meta.get("mimeType") == "text/markdown" or name.endswith(".md")
+
+def is_folder(meta: dict) -> bool:
+    return meta.get("mimeType") == FOLDER_MIME_TYPE
+
+
+class FolderTree:
+    """Carpetas de la bóveda: {folder_id: (nombre, carpeta padre)}. La raíz no tiene nombre."""
+
+    def __init__(self, root_id: str, folders: Optional[Dict[str, Tuple[str, Optional[str]]]] = None):
+        self.root_id = root_id
+        self.folders: Dict[str, Tuple[str, Optional[str]]] = dict(folders or {root_id: ("", None)})
+        self._paths: Dict[str, str] = {}
+
+    def __contains__(self, folder_id: str) -> bool:
+        return folder_id in self.folders
+
+    def add(self, folder_id: str, name: str, parent_id: str):
+        self.folders[folder_id] = (name, parent_id); self._paths.pop(folder_id, None)
+
+    def path_of(self, folder_id: str) -> str:
+        """Ruta relativa a la raíz de la bóveda ('' para la raíz)."""
+        if folder_id not in self._paths:
+            name, parent_id = self.folders[folder_id]
+            parent_path = self.path_of(parent_id) if parent_id in self.folders else ""
+            self._paths[folder_id] = f"{parent_path}/{name}" if parent_path else name
+        return self._paths[folder_id]
+
+    def parent_in_tree(self, meta: dict) -> Optional[str]:
+        return next((parent for parent in meta.get("parents") or [] if parent in self.folders), None)
+
+    def file_path(self, meta: dict) -> Optional[str]:
+        """Ruta del fichero dentro de la bóveda, o None si no cuelga de ninguna carpeta del árbol."""
+        parent_id = self.parent_in_tree(meta)
+        if parent_id is None: return None
+        folder_path = self.path_of(parent_id)
+        return f"{folder_path}/{meta.get('name')}" if folder_path else meta.get("name")
+
+    def to_json(self) -> str:
+        return json.dumps({"root": self.root_id, "folders": self.folders})
+
+    @classmethod
+    def from_json(cls, data: str) -> "FolderTree":
+        parsed = json.loads(data)
+        return cls(parsed["root"], {folder_id: (name, parent) for folder_id, (name, parent) in parsed["folders"].items()})
+
+
+class DriveClient(Protocol):
+    def list_children(self, folder_ids: List[str]) -> List[dict]: ...
+    def download(self, file_id: str) -> bytes: ...
+    def get_start_page_token(self) -> str: ...
+    def list_changes(self, page_token: str) -> Tuple[List[dict], str]: ...
+
+
+class GoogleDriveClient:
+    """Cliente de Drive. Con `credentials` (o `session_factory`) las descargas van por
+    una sesión HTTP con pool de conexiones por hilo en lugar del httplib2 del servicio,
+    que no es seguro entre hilos."""
+
+    def __init__(self, service, credentials=None, session_factory: Optional[Callable[[], object]] = None,
+                 base_url: str = DRIVE_API_BASE_URL, pool_size: int = DRIVE_DOWNLOAD_WORKERS):
+        self.service = service
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        if session_factory is None and credentials is not None:
+            from google.auth.transport.requests import AuthorizedSession
+            session_factory = lambda: AuthorizedSession(credentials)
+        self._session_factory = session_factory
+        self._local = threading.local()
+        self._service_lock = threading.Lock()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            import requests
+            session = self._local.session = self._session_factory()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter); session.mount("http://", adapter)
+        return session
+
+    def list_children(self, folder_ids: List[str]) -> List[dict]:
+        """Subcarpetas y ficheros Markdown cuyo padre es alguna de `folder_ids` (una sola consulta paginada)."""
+        parents_clause = " or ".join(f"'{folder_id}' in parents" for folder_id in folder_ids)
+        query = (f"({parents_clause}) and (mimeType='{FOLDER_MIME_TYPE}' or mimeType='text/markdown' or name contains '.md' "
+                 f"or mimeType='application/octet-stream') and trashed=false")
+        files, page_token = [], None
+        while True:
+            results = self.service.files().list(q=query, pageSize=LIST_PAGE_SIZE, fields=f"nextPageToken, files({FILE_FIELDS})", pageToken=page_token).execute()
+            files.extend(f for f in results.get("files", []) if is_folder(f) or is_markdown_file(f))
+            page_token = results.get("nextPageToken")
+            if not page_token: return files
+
+    def download(self, file_id: str) -> bytes:
+        if self._session_factory is not None:
+            response = self._session().get(f"{self.base_url}/files/{file_id}", params={"alt": "media"}, timeout=DRIVE_DOWNLOAD_TIMEOUT_S)
+            response.raise_for_status()
+            return response.content
+        from googleapiclient.http import MediaIoBaseDownload
+        with self._service_lock:
+            request_content = self.service.files().get_media(fileId=file_id); fh = io.BytesIO()
+            downloader = MediaIoBaseDownload(fh, request_content); done = False
+            while not done: status, done = downloader.next_chunk()
+            return fh.getvalue()
+
+    def get_start_page_token(self) -> str:
+        return self.service.changes().getStartPageToken().execute()["startPageToken"]
+
+    def list_changes(self, page_token: str) -> Tuple[List[dict], str]:
+        """Todos los cambios desde `page_token`. Devuelve (cambios, token para la próxima vez)."""
+        changes = []
+        while True:
+            results = self.service.changes().list(pageToken=page_token, pageSize=LIST_PAGE_SIZE, includeRemoved=True, spaces="drive",
+                                                  fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))").execute()
+            changes.extend(results.get("changes", []))
+            if results.get("newStartPageToken"): return changes, results["newStartPageToken"]
+            page_token = results["nextPageToken"]
+
+
+class FakeDriveClient:
+    """Drive en memoria. Cada modificación se registra en un feed de cambios numerado."""
+
+    def __init__(self, latency_s: float = 0.0):
+        self.files: Dict[str, dict] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.changes: List[Tuple[str, bool]] = [] # (file_id, removed)
+        self.downloads = 0; self.list_calls = 0
+        self.latency_s = latency_s
+        self._lock = threading.Lock()
+
+    def put_folder(self, folder_id: str, name: str, parents: Iterable[str] = ("root",)):
+        with self._lock:
+            self.files[folder_id] = {"id": folder_id, "name": name, "mimeType": FOLDER_MIME_TYPE, "parents": list(parents), "trashed": False}
+            self.changes.append((folder_id, False))
+
+    def put_file(self, file_id: str, name: str, content: str, parents: Iterable[str] = ("root",),
+                 modified_time: Optional[str] = None, mime_type: str = "text/markdown"):
+        data = content.encode("utf-8")
+        with self._lock:
+            self.files[file_id] = {"id": file_id, "name": name, "mimeType": mime_type, "parents": list(parents), "trashed": False,
+                                   "modifiedTime": modified_time or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                                   "webViewLink": f"https://drive.fake/{file_id}", "md5Checksum": hashlib.md5(data).hexdigest(), "size": str(len(data))}
+            self.contents[file_id] = data
+            self.changes.append((file_id, False))
+
+    def trash_file(self, file_id: str):
+        with self._lock:
+            self.files[file_id]["trashed"] = True; self.changes.append((file_id, False))
+
+    def delete_file(self, file_id: str):
+        with self._lock:
+            self.files.pop(file_id, None); self.contents.pop(file_id, None); self.changes.append((file_id, True))
+
+    def list_children(self, folder_ids: List[str]) -> List[dict]:
+        wanted = set(folder_ids)
+        with self._lock:
+            self.list_calls += 1
+            return [dict(f) for f in self.files.values()
+                    if wanted.intersection(f["parents"]) and not f["trashed"] and (is_folder(f) or is_markdown_file(f))]
+
+    def download(self, file_id: str) -> bytes:
+        if self.latency_s: time.sleep(self.latency_s)
+        with self._lock:
+            self.downloads += 1
+            return self.contents[file_id]
+
+    def get_start_page_token(self) -> str:
+        with self._lock: return str(len(self.changes))
+
+    def list_changes(self, page_token: str) -> Tuple[List[dict], str]:
+        with self._lock:
+            changes = []
+            for file_id, removed in self.changes[int(page_token):]:
+                file_meta = self.files.get(file_id)
+                changes.append({"fileId": file_id, "removed": removed or file_meta is None, "file": dict(file_meta) if file_meta else None})
+            return changes, str(len(self.changes))
+
+
+def list_vault_files(drive: DriveClient, root_id: str, tree: Optional[FolderTree] = None, start_folder_ids: Optional[List[str]] = None,
+                     parents_per_query: int = DRIVE_PARENTS_PER_QUERY) -> Tuple[List[dict], FolderTree]:
+    """Recorre la bóveda en anchura. Devuelve los ficheros Markdown (con su ruta en `path`) y el árbol de carpetas.
+
+    Con `tree` y `start_folder_ids` solo se recorren esas carpetas (p. ej. carpetas
+    nuevas o movidas dentro de la bóveda) y se completa el árbol existente.
+    """
+    tree = tree or FolderTree(root_id); files: List[dict] = []
+    level = list(start_folder_ids or [root_id]); visited = set(level)
+    while level:
+        next_level: List[str] = []
+        for start in range(0, len(level), parents_per_query):
+            for meta in drive.list_children(level[start:start + parents_per_query]):
+                if is_folder(meta):
+                    tree.add(meta["id"], meta.get("name") or meta["id"], tree.parent_in_tree(meta))
+                    if meta["id"] not in visited: visited.add(meta["id"]); next_level.append(meta["id"])
+                else:
+                    files.append(meta)
+        level = next_level
+    for meta in files: meta["path"] = tree.file_path(meta)
+    return files, tree
+
+def classify_changes(changes: List[dict], tree: FolderTree) -> Tuple[Dict[str, dict], Set[str], List[str], bool]:
+    """Separa el feed de cambios en (ficheros a procesar por id, ids a eliminar, carpetas nuevas,
+    hay que volver a recorrer la bóveda).
+
+    Un fichero borrado, en la papelera, fuera del árbol de la bóveda o que ya no es
+    Markdown se trata como eliminación; si aparece varias veces manda su último estado.
+    Las carpetas nuevas dentro de la bóveda se añaden a `tree` y se devuelven para listar
+    su contenido (una carpeta movida desde fuera no trae cambios de sus ficheros); si una
+    carpeta conocida se renombra, se mueve o se borra, las rutas de todo su contenido
+    cambian y se pide un recorrido completo.
+    """
+    latest: Dict[str, dict] = {}
+    for change in changes: latest[change.get("fileId")] = change
+    pending_folders = {}
+    for file_id, change in latest.items():
+        file_meta = change.get("file") or {}
+        if file_id == tree.root_id:
+            continue # Renombrar o mover la raíz no cambia las rutas relativas
+        if file_id in tree:
+            if (change.get("removed") or file_meta.get("trashed") or not is_folder(file_meta)
+                    or (file_meta.get("name"), tree.parent_in_tree(file_meta)) != tree.folders[file_id]):
+                return {}, set(), [], True
+        elif is_folder(file_meta) and not change.get("removed") and not file_meta.get("trashed"):
+            pending_folders[file_id] = file_meta
+    # Carpetas nuevas: se añaden cuando su padre ya está en el árbol (pueden llegar en cualquier orden)
+    new_folder_ids: List[str] = []; added = True
+    while added:
+        added = False
+        for folder_id, file_meta in list(pending_folders.items()):
+            parent_id = tree.parent_in_tree(file_meta)
+            if parent_id is not None:
+                tree.add(folder_id, file_meta.get("name") or folder_id, parent_id); pending_folders.pop(folder_id)
+                new_folder_ids.append(folder_id); added = True
+
+    to_process: Dict[str, dict] = {}; removed: Set[str] = set()
+    for file_id, change in latest.items():
+        file_meta = change.get("file")
+        if file_meta and is_folder(file_meta): continue
+        path = tree.file_path(file_meta) if file_meta else None
+        if change.get("removed") or not file_meta or file_meta.get("trashed") or path is None or not is_markdown_file(file_meta):
+            removed.add(file_id)
+        else:
+            to_process[file_id] = dict(file_meta, path=path)
+    return to_process, removed, new_folder_ids, False
+
+def _size_hint(meta: dict) -> int:
+    try: return int(meta.get("size") or 0)
+    except (TypeError, ValueError): return 0
+
+def iter_downloads(drive: DriveClient, metas: List[dict], max_workers: int = DRIVE_DOWNLOAD_WORKERS,
+                   max_inflight_bytes: int = DRIVE_MAX_INFLIGHT_BYTES) -> Iterator[Tuple[dict, Optional[bytes], Optional[Exception]]]:
+    """Descarga `metas` en paralelo y produce (meta, contenido, error) en orden de llegada.
+
+    Los bytes de un fichero cuentan como "en vuelo" desde que empieza su descarga
+    hasta que el consumidor pide el siguiente; si se supera `max_inflight_bytes`,
+    las descargas nuevas esperan (un fichero mayor que el límite pasa solo).
+    """
+    if not metas: return
+    results: "queue.Queue[Tuple[dict, Optional[bytes], Optional[Exception], int]]" = queue.Queue()
+    budget = threading.Condition(); inflight = [0]; stop = threading.Event()
+
+    def fetch(meta: dict):
+        size = _size_hint(meta)
+        with budget:
+            budget.wait_for(lambda: stop.is_set() or inflight[0] == 0 or inflight[0] + size <= max_inflight_bytes)
+            if stop.is_set(): return
+            inflight[0] += size
+        try:
+            with span("drive_download"): content = drive.download(meta["id"])
+            results.put((meta, content, None, size))
+        except Exception as e: results.put((meta, None, e, size))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(metas))), thread_name_prefix="drive-download")
+    try:
+        for meta in metas: executor.submit(fetch, meta)
+        for _ in range(len(metas)):
+            meta, content, error, size = results.get()
+            try: yield meta, content, error
+            finally:
+                with budget: inflight[0] -= size; budget.notify_all()
+    finally:
+        stop.set()
+        with budget: budget.notify_all()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,254 @@
+"""Etapa de embeddings por lotes para la sincronización y las búsquedas.
+
+Agrupa los textos en lotes limitados por tokens, envía varios lotes en paralelo
+con un pool de hilos acotado, reutiliza un único cliente OpenAI y reintenta con
+backoff exponencial ante rate limits. `FakeEmbedder` permite medir el
+rendimiento sin red (`EMBEDDER_BACKEND=fake`).
+
+Las consultas de búsqueda usan la variante asíncrona (`get_embedding_async`),
+que comparte el cliente `AsyncOpenAI` y el limitador de `openai_client`.
+"""
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Hashable, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+from backend.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_ERRORS, EMBEDDING_REQUEST_DURATION, EMBEDDING_RETRIES, EMBEDDING_TOKENS, span
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSION = 1536
+MAX_EMBEDDING_CHARS = 20000
+
+# Límites de la API de embeddings: 8191 tokens por entrada y 2048 entradas por petición.
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))
+EMBEDDING_MAX_WORKERS = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+EMBEDDING_RETRY_BASE_DELAY = float(os.getenv("EMBEDDING_RETRY_BASE_DELAY", "1.0"))
+EMBEDDING_RETRY_MAX_DELAY = 30.0
+
+
+class Embedder(Protocol):
+    model_name: str
+    def embed(self, texts: List[str]) -> List[List[float]]: ...
+    # Opcional: `async def aembed(texts)`; si falta, embed() se ejecuta en un hilo.
+
+
+class OpenAIEmbedder:
+    """Embedder respaldado por la API de OpenAI con un cliente compartido entre hilos."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, client=None):
+        self.model_name = model
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import openai
+                    api_key = os.getenv("OPENAI_API_KEY")
+                    if not api_key: raise RuntimeError("OPENAI_API_KEY no configurada.")
+                    # El cliente usa un pool de conexiones httpx y es seguro entre hilos.
+                    # Los reintentos los gestionamos nosotros (embed_with_retry).
+                    self._client = openai.OpenAI(api_key=api_key, max_retries=0)
+        return self._client
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self._get_client().embeddings.create(input=texts, model=self.model_name)
+        if response.usage: EMBEDDING_TOKENS.inc(response.usage.total_tokens, mode="batch")
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        from backend.openai_client import get_async_openai_client
+        response = await get_async_openai_client().embeddings.create(input=texts, model=self.model_name)
+        if response.usage: EMBEDDING_TOKENS.inc(response.usage.total_tokens, mode="query")
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class FakeEmbedder:
+    """Embedder determinista sin red. `latency_s` simula el round-trip de cada petición."""
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION, latency_s: float = 0.0, model: str = "fake-embedding"):
+        self.model_name = model
+        self.dimension = dimension
+        self.latency_s = latency_s
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32).tolist()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        with self._lock: self.calls += 1
+        if self.latency_s: time.sleep(self.latency_s)
+        return [self._vector(text) for text in texts]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        with self._lock: self.calls += 1
+        if self.latency_s: await asyncio.sleep(self.latency_s)
+        return [self._vector(text) for text in texts]
+
+
+_default_embedder: Optional[Embedder] = None
+_default_embedder_lock = threading.Lock()
+
+def get_default_embedder() -> Embedder:
+    global _default_embedder
+    if _default_embedder is None:
+        with _default_embedder_lock:
+            if _default_embedder is None:
+                if os.getenv("EMBEDDER_BACKEND", "openai").lower() == "fake":
+                    _default_embedder = FakeEmbedder(latency_s=float(os.getenv("FAKE_EMBEDDER_LATENCY_S", "0")))
+                else:
+                    _default_embedder = OpenAIEmbedder()
+    return _default_embedder
+
+def set_default_embedder(embedder: Optional[Embedder]):
+    """Sustituye el embedder global (benchmarks, pruebas offline). `None` vuelve al de por defecto."""
+    global _default_embedder
+    with _default_embedder_lock: _default_embedder = embedder
+
+
+_tokenizer = None
+
+def count_tokens(text: str) -> int:
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken no disponible ({e}); se estimarán tokens por longitud.")
+            _tokenizer = False
+    if _tokenizer is False: return len(text) // 4 + 1
+    return len(_tokenizer.encode(text, disallowed_special=()))
+
+def prepare_embedding_text(text: str) -> Optional[str]:
+    if not text or not text.strip(): return None
+    text_to_embed = text.replace("\n", " ")
+    if len(text_to_embed) > MAX_EMBEDDING_CHARS: text_to_embed = text_to_embed[:MAX_EMBEDDING_CHARS]
+    return text_to_embed
+
+def embedding_text_hash(text: str, model_name: str) -> str:
+    """Huella del texto que se enviaría a la API; textos idénticos comparten embedding."""
+    return hashlib.sha256(f"{model_name}\0{prepare_embedding_text(text) or ''}".encode("utf-8")).hexdigest()
+
+def make_batches(items: Sequence[Tuple[Hashable, str]], max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                 max_items: int = EMBEDDING_BATCH_MAX_ITEMS) -> List[List[Tuple[Hashable, str]]]:
+    """Agrupa (clave, texto) en lotes que no superan `max_tokens` ni `max_items`."""
+    batches: List[List[Tuple[Hashable, str]]] = []
+    current: List[Tuple[Hashable, str]] = []; current_tokens = 0
+    for key, text in items:
+        tokens = count_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current); current = []; current_tokens = 0
+        current.append((key, text)); current_tokens += tokens
+    if current: batches.append(current)
+    return batches
+
+
+def _is_retryable(error: Exception) -> bool:
+    try:
+        import openai
+        if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+            return True
+    except ImportError:
+        pass
+    return getattr(error, "status_code", None) in (429, 500, 502, 503, 504)
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try: return float(headers.get("retry-after")) if headers.get("retry-after") else None
+    except (TypeError, ValueError): return None
+
+def embed_with_retry(embedder: Embedder, texts: List[str], max_retries: int = EMBEDDING_MAX_RETRIES,
+                     base_delay: float = EMBEDDING_RETRY_BASE_DELAY) -> List[List[float]]:
+    attempt = 0; EMBEDDING_BATCH_SIZE.observe(len(texts), mode="batch")
+    while True:
+        start = time.perf_counter()
+        try:
+            vectors = embedder.embed(texts)
+            EMBEDDING_REQUEST_DURATION.observe(time.perf_counter() - start, mode="batch"); return vectors
+        except Exception as e:
+            EMBEDDING_REQUEST_DURATION.observe(time.perf_counter() - start, mode="batch") # Sin la espera del reintento
+            if attempt >= max_retries or not _is_retryable(e): EMBEDDING_ERRORS.inc(mode="batch"); raise
+            EMBEDDING_RETRIES.inc(mode="batch")
+            delay = _retry_after_seconds(e) or min(EMBEDDING_RETRY_MAX_DELAY, base_delay * (2 ** attempt))
+            delay += random.uniform(0, delay * 0.25)
+            print(f"Embedding: reintento {attempt + 1}/{max_retries} en {delay:.1f}s tras error: {e}")
+            time.sleep(delay); attempt += 1
+
+
+async def aembed_with_retry(embedder: Embedder, texts: List[str], max_retries: int = EMBEDDING_MAX_RETRIES,
+                            base_delay: float = EMBEDDING_RETRY_BASE_DELAY) -> List[List[float]]:
+    """Como `embed_with_retry`, sin bloquear el event loop (ni en la llamada ni en las esperas)."""
+    attempt = 0; EMBEDDING_BATCH_SIZE.observe(len(texts), mode="query")
+    while True:
+        start = time.perf_counter()
+        try:
+            vectors = await embedder.aembed(texts) if hasattr(embedder, "aembed") else await asyncio.to_thread(embedder.embed, texts)
+            EMBEDDING_REQUEST_DURATION.observe(time.perf_counter() - start, mode="query"); return vectors
+        except Exception as e:
+            EMBEDDING_REQUEST_DURATION.observe(time.perf_counter() - start, mode="query")
+            if attempt >= max_retries or not _is_retryable(e): EMBEDDING_ERRORS.inc(mode="query"); raise
+            EMBEDDING_RETRIES.inc(mode="query")
+            delay = _retry_after_seconds(e) or min(EMBEDDING_RETRY_MAX_DELAY, base_delay * (2 ** attempt))
+            delay += random.uniform(0, delay * 0.25)
+            print(f"Embedding: reintento {attempt + 1}/{max_retries} en {delay:.1f}s tras error: {e}")
+            await asyncio.sleep(delay); attempt += 1
+
+
+def embed_many(items: Sequence[Tuple[Hashable, str]], embedder: Optional[Embedder] = None,
+               max_workers: int = EMBEDDING_MAX_WORKERS, max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+               max_items: int = EMBEDDING_BATCH_MAX_ITEMS) -> Dict[Hashable, List[float]]:
+    """Genera embeddings para (clave, texto) en lotes concurrentes.
+
+    Devuelve {clave: vector}. Las claves con texto vacío o cuyo lote falla tras
+    agotar los reintentos no aparecen en el resultado.
+    """
+    embedder = embedder or get_default_embedder()
+    prepared = [(key, text) for key, text in ((key, prepare_embedding_text(raw)) for key, raw in items) if text]
+    if not prepared: return {}
+    batches = make_batches(prepared, max_tokens=max_tokens, max_items=max_items)
+    results: Dict[Hashable, List[float]] = {}
+
+    def run_batch(batch):
+        vectors = embed_with_retry(embedder, [text for _, text in batch])
+        return [(key, vector) for (key, _), vector in zip(batch, vectors)]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = {executor.submit(run_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try: results.update(future.result())
+            except Exception as e: print(f"Error al generar embeddings para un lote de {len(futures[future])} textos: {e}")
+    return results
+
+async def get_embedding_async(text: str, embedder: Optional[Embedder] = None) -> Optional[List[float]]:
+    from backend.openai_client import openai_slot
+    text_to_embed = prepare_embedding_text(text)
+    if not text_to_embed: return None
+    try:
+        with span("embedding"):
+            async with openai_slot(): return (await aembed_with_retry(embedder or get_default_embedder(), [text_to_embed]))[0]
+    except Exception as e: print(f"Error al generar embedding: {e}"); return None
+
+async def get_embeddings_async(texts: Sequence[str], embedder: Optional[Embedder] = None) -> List[Optional[List[float]]]:
+    """Embeddings de varias consultas en una sola llamada. None en las posiciones sin texto o si la llamada falla."""
+    from backend.openai_client import openai_slot
+    prepared = [prepare_embedding_text(text) for text in texts]
+    to_embed = [text for text in prepared if text]
+    if not to_embed: return [None] * len(texts)
+    try:
+        with span("embedding"):
+            async with openai_slot(): vectors = iter(await aembed_with_retry(embedder or get_default_embedder(), to_embed))
+    except Exception as e: print(f"Error al generar embeddings de {len(to_embed)} consultas: {e}"); return [None] * len(texts)
+    return [next(vectors) if text else None for text in prepared]
@@ -0,0 +1,141 @@
+"""Índice en memoria de los filtros de búsqueda (tags, fecha y carpeta) por fragmento.
+
+Para filtrar la búsqueda semántica dentro de FAISS hace falta la lista de ids de
+fragmento (vectores) que cumplen los filtros. En lugar de un JOIN de
+NoteChunk/Note/note_tags en cada petición, se mantiene:
+
+- Los ids de fragmento ordenados, con la fecha de Drive y el rango de la ruta de
+  su nota en arrays paralelos (NumPy).
+- Por cada tag, las posiciones ordenadas de sus fragmentos en esos arrays (es
+  decir, sus ids de vector ordenados) y el número de notas que lo usan.
+
+Los filtros se resuelven intersecando arrays ordenados y con máscaras sobre las
+posiciones resultantes; las cuentas por tag (facetas) salen del mismo índice.
+El índice es inmutable: se reconstruye entero (tres consultas) la primera vez
+que se usa tras cambiar la versión de las notas, es decir, tras cada
+sincronización que modifica algo.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backend.database_models import Note, NoteChunk, Tag, note_tags_table
+
+NO_PATH_RANK = -1 # Notas sin ruta: no están en ninguna carpeta
+
+
+def _as_utc_naive(value: datetime) -> np.datetime64:
+    """Las fechas de la BD son UTC sin zona; las de la petición pueden llevarla."""
+    if value.tzinfo is not None: value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(value, "us")
+
+
+@dataclass
+class TagFacet:
+    name: str
+    count: int # Notas con el tag
+
+
+class NoteFilterIndex:
+    def __init__(self, chunk_ids: np.ndarray, chunk_modified: np.ndarray, chunk_path_rank: np.ndarray, paths: np.ndarray,
+                 tag_positions: Dict[str, np.ndarray], tag_note_counts: Dict[str, int], version: int = 0):
+        self.chunk_ids = chunk_ids # int64, ordenados
+        self.chunk_modified = chunk_modified # datetime64[us]; NaT si la nota no tiene fecha (no cumple ningún filtro de fecha)
+        self.chunk_path_rank = chunk_path_rank # Posición de la ruta de la nota en `paths` (NO_PATH_RANK si no tiene)
+        self.paths = paths # Rutas distintas, ordenadas: una carpeta es un rango contiguo
+        self.tag_positions = tag_positions # tag -> posiciones ordenadas en chunk_ids
+        self.tag_note_counts = tag_note_counts
+        self.version = version
+
+    @property
+    def size(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def build(cls, db: Session, version: int = 0) -> "NoteFilterIndex":
+        notes = db.query(Note.id, Note.path, Note.drive_modified_time).all()
+        paths = np.array(sorted({path for _, path, _ in notes if path}), dtype=str)
+        path_rank = {path: rank for rank, path in enumerate(paths.tolist())}
+        note_info = {note_id: (path_rank.get(path, NO_PATH_RANK), modified) for note_id, path, modified in notes}
+
+        chunk_rows = sorted(db.query(NoteChunk.id, NoteChunk.note_id).all())
+        chunk_ids = np.fromiter((chunk_id for chunk_id, _ in chunk_rows), dtype=np.int64, count=len(chunk_rows))
+        chunk_path_rank = np.fromiter((note_info.get(note_id, (NO_PATH_RANK, None))[0] for _, note_id in chunk_rows), dtype=np.int32, count=len(chunk_rows))
+        chunk_modified = np.array([note_info.get(note_id, (NO_PATH_RANK, None))[1] or np.datetime64("NaT") for _, note_id in chunk_rows], dtype="datetime64[us]")
+        positions_by_note: Dict[str, List[int]] = {}
+        for position, (_, note_id) in enumerate(chunk_rows): positions_by_note.setdefault(note_id, []).append(position)
+
+        tag_positions_lists: Dict[str, List[int]] = {}; tag_note_counts: Dict[str, int] = {}
+        for name, note_id in db.query(Tag.name, note_tags_table.c.note_id).join(note_tags_table, Tag.id == note_tags_table.c.tag_id):
+            tag_note_counts[name] = tag_note_counts.get(name, 0) + 1
+            tag_positions_lists.setdefault(name, []).extend(positions_by_note.get(note_id, ()))
+        tag_positions = {name: np.unique(np.array(positions, dtype=np.int64)) for name, positions in tag_positions_lists.items()}
+        return cls(chunk_ids, chunk_modified, chunk_path_rank, paths, tag_positions, tag_note_counts, version)
+
+    def allowed_chunk_ids(self, tags: Optional[Sequence[str]] = None, modified_after: Optional[datetime] = None,
+                          modified_before: Optional[datetime] = None, path_range: Optional[Tuple[str, str]] = None) -> Optional[np.ndarray]:
+        """Ids de fragmento (ordenados) que cumplen los filtros, o None si no hay ninguno que aplicar.
+
+        Mismo criterio que las condiciones SQL de la búsqueda: con varios tags la
+        nota debe tenerlos todos; `modified_before` es exclusivo; `path_range` es
+        el rango [desde, hasta) de rutas de la carpeta.
+        """
+        tag_names = sorted({tag.lstrip("#") for tag in tags or [] if tag.strip("# ")})
+        if not tag_names and modified_after is None and modified_before is None and path_range is None: return None
+        positions: Optional[np.ndarray] = None
+        if tag_names:
+            tag_arrays = sorted((self.tag_positions.get(name, np.empty(0, dtype=np.int64)) for name in tag_names), key=len) # La más corta primero
+            positions = tag_arrays[0]
+            for tag_array in tag_arrays[1:]:
+                if not len(positions): break
+                positions = np.intersect1d(positions, tag_array, assume_unique=True)
+        if path_range is not None:
+            rank_from, rank_to = np.searchsorted(self.paths, path_range[0], "left"), np.searchsorted(self.paths, path_range[1], "left")
+            ranks = self.chunk_path_rank if positions is None else self.chunk_path_rank[positions]
+            mask = (ranks >= rank_from) & (ranks < rank_to)
+            positions = np.flatnonzero(mask) if positions is None else positions[mask]
+        for bound, keep in ((modified_after, np.greater_equal), (modified_before, np.less)):
+            if bound is None: continue
+            modified = self.chunk_modified if positions is None else self.chunk_modified[positions]
+            mask = keep(modified, _as_utc_naive(bound)) # NaT nunca cumple la comparación
+            positions = np.flatnonzero(mask) if positions is None else positions[mask]
+        return self.chunk_ids[positions]
+
+    def tag_facets(self, prefix: Optional[str] = None, limit: Optional[int] = None) -> List[TagFacet]:
+        """Tags con su número de notas, de más a menos usados."""
+        prefix = (prefix or "").lstrip("#").casefold()
+        facets = [TagFacet(name, count) for name, count in self.tag_note_counts.items() if name.casefold().startswith(prefix)]
+        facets.sort(key=lambda facet: (-facet.count, facet.name))
+        return facets[:limit] if limit else facets
+
+
+class FilterIndexCache:
+    """Mantiene el índice de la versión actual de las notas y lo reconstruye cuando esta cambia."""
+
+    def __init__(self, session_factory: Callable[[], Session], current_version: Callable[[], int]):
+        self.session_factory = session_factory
+        self.current_version = current_version
+        self._index: Optional[NoteFilterIndex] = None
+        self._lock = threading.Lock()
+        self.builds = 0; self.last_build_ms: Optional[float] = None
+
+    def get(self) -> NoteFilterIndex:
+        index = self._index
+        if index is not None and index.version == self.current_version(): return index
+        with self._lock: # Una sola reconstrucción aunque lleguen varias peticiones a la vez
+            version = self.current_version() # Se lee antes de consultar la BD: un cambio posterior vuelve a invalidar
+            if self._index is None or self._index.version != version:
+                start = time.perf_counter()
+                with self.session_factory() as db: self._index = NoteFilterIndex.build(db, version)
+                self.builds += 1; self.last_build_ms = round((time.perf_counter() - start) * 1000, 2)
+            return self._index
+
+    def stats(self) -> dict:
+        index = self._index
+        return {"version": index.version if index else None, "chunks": index.size if index else 0, "tags": len(index.tag_note_counts) if index else 0,
+                "builds": self.builds, "last_build_ms": self.last_build_ms}
@@ -0,0 +1,96 @@
+"""Índice de texto completo (SQLite FTS5) para /api/simple_search.
+
+`notes_fts` es una tabla FTS5 de contenido externo sobre `notes` (title,
+content), enlazada por `notes.fts_rowid` y mantenida por triggers, así que
+cualquier escritura en `notes` (sincronización, borrados) la actualiza sin
+pasos extra. Las consultas se ordenan por BM25 (el título pesa más que el
+cuerpo), devuelven un fragmento con las coincidencias resaltadas y tratan cada
+palabra como prefijo para la búsqueda mientras se escribe.
+
+La clave primaria de `notes` es de texto, así que su rowid implícito puede
+renumerarse con un VACUUM; por eso el enlace es una columna entera explícita
+(`fts_rowid`, con índice único) que asigna el trigger de inserción y no cambia.
+"""
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from sqlalchemy import func, literal_column, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from backend.database_models import Note
+
+FTS_TABLE = "notes_fts"
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+SNIPPET_TOKENS = 16
+HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE = "<mark>", "</mark>"
+
+FULLTEXT_DDL = [
+    # Notas anteriores a fts_rowid: se numeran a continuación del mayor ya asignado
+    "UPDATE notes SET fts_rowid = (SELECT IFNULL(MAX(fts_rowid), 0) FROM notes) + rowid WHERE fts_rowid IS NULL",
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, content, content='notes', content_rowid='fts_rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS notes_fts_ai AFTER INSERT ON notes BEGIN
+        UPDATE notes SET fts_rowid = (SELECT IFNULL(MAX(fts_rowid), 0) + 1 FROM notes) WHERE id = new.id AND fts_rowid IS NULL;
+        INSERT INTO {FTS_TABLE}(rowid, title, content) SELECT fts_rowid, title, content FROM notes WHERE id = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS notes_fts_ad AFTER DELETE ON notes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.fts_rowid, old.title, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS notes_fts_au AFTER UPDATE OF title, content ON notes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.fts_rowid, old.title, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.fts_rowid, new.title, new.content);
+    END""",
+]
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class FullTextHit:
+    note_id: str
+    score: float # -bm25: mayor es mejor
+    title_highlight: str
+    snippet: str
+
+
+def create_fulltext_index(connection: Connection):
+    """Crea la tabla FTS5 y sus triggers (idempotente) e indexa las notas existentes."""
+    for statement in FULLTEXT_DDL: connection.execute(text(statement))
+    rebuild_fulltext_index(connection)
+
+def rebuild_fulltext_index(connection):
+    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def fulltext_available(db: Session) -> bool:
+    return db.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}).first() is not None
+
+def build_match_query(query: str) -> Optional[str]:
+    """Convierte texto libre en una expresión MATCH: todas las palabras, cada una como prefijo.
+
+    Las palabras van entre comillas para que operadores o signos del usuario
+    (AND, NEAR, *, ", -) no rompan la sintaxis de FTS5.
+    """
+    terms = _TERM_RE.findall(query)
+    if not terms: return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+def search_fulltext(db: Session, query: str, limit: int, conditions: Sequence = ()) -> List[FullTextHit]:
+    """Notas que contienen todas las palabras de `query`, ordenadas por BM25.
+
+    `conditions` son filtros SQLAlchemy sobre `Note` (carpeta, tags, fechas) que
+    se aplican en la misma consulta, antes de ordenar y limitar.
+    """
+    match = build_match_query(query)
+    if match is None: return []
+    fts = literal_column(FTS_TABLE)
+    rank = func.bm25(fts, TITLE_WEIGHT, CONTENT_WEIGHT).label("rank")
+    rows = (db.query(Note.id, rank, func.highlight(fts, 0, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE),
+                     func.snippet(fts, 1, HIGHLIGHT_OPEN, HIGHLIGHT_CLOSE, "…", SNIPPET_TOKENS))
+            .select_from(table(FTS_TABLE)).join(Note, Note.fts_rowid == literal_column(f"{FTS_TABLE}.rowid"))
+            .filter(fts.op("MATCH")(match), *conditions).order_by(rank).limit(limit))
+    return [FullTextHit(note_id=note_id, score=-rank_value, title_highlight=title_hl or "", snippet=snippet or "")
+            for note_id, rank_value, title_hl, snippet in rows]
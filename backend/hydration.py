@@ -0,0 +1,36 @@
+"""Carga de notas para las respuestas de búsqueda.
+
+Las búsquedas devuelven ids ordenados; aquí se cargan las notas en un número
+fijo de consultas (notas + tags con `selectinload`, sin cargas perezosas por
+nota) en un dict por id, que cada búsqueda recorre en el orden de sus
+resultados. Sin `with_content` el cuerpo de la nota no se lee de la BD (modo
+compacto).
+"""
+from typing import Dict, Iterable
+
+from sqlalchemy.orm import Query, Session, defer, selectinload
+
+from backend.database_models import Note
+
+HYDRATION_BATCH_SIZE = 500 # Límite de variables de SQLite en la cláusula IN
+
+
+def with_tags(query: Query, with_content: bool = True) -> Query:
+    """Añade a una consulta de Note la carga de tags en una sola consulta extra (y omite el contenido si no hace falta)."""
+    query = query.options(selectinload(Note.tags))
+    return query if with_content else query.options(defer(Note.content))
+
+def load_notes(db: Session, note_ids: Iterable[str], with_content: bool = True) -> Dict[str, Note]:
+    ids = list(dict.fromkeys(note_ids))
+    notes: Dict[str, Note] = {}
+    for start in range(0, len(ids), HYDRATION_BATCH_SIZE):
+        batch = ids[start:start + HYDRATION_BATCH_SIZE]
+        notes.update((note.id, note) for note in with_tags(db.query(Note), with_content).filter(Note.id.in_(batch)))
+    return notes
+
+def excerpt(text: str, max_chars: int) -> str:
+    """Recorta `text` a `max_chars` sin partir la última palabra."""
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars: return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + "…"
@@ -0,0 +1,305 @@
+"""Publicación versionada del índice FAISS y snapshots atómicos en disco.
+
+El índice y su mapa NoteChunk.id -> Note.id se publican juntos como un
+`IndexSnapshot`: cada búsqueda lee `manager.current` una sola vez y trabaja con
+esa versión hasta terminar, aunque entre tanto se publique otra. Las
+reconstrucciones completas se hacen en un hilo en segundo plano mientras se
+sigue sirviendo la versión anterior.
+
+Los cambios incrementales de una sincronización se aplican en el sitio, con el
+índice bloqueado para las búsquedas solo mientras dura el cambio (ver
+`NoteVectorIndex.exclusive`): copiar el índice entero por cada nota modificada
+costaría O(tamaño de la bóveda). La excepción es un índice mapeado desde disco,
+que es de solo lectura: la primera actualización lo copia a memoria (una vez)
+y las siguientes ya se aplican en el sitio. A cambio, un snapshot publicado ya
+no es inmutable: refleja los cambios incrementales posteriores (cada uno
+publica una versión nueva para invalidar las cachés).
+
+En disco cada snapshot lleva la versión en el nombre de sus ficheros
+(`faiss_index.<v>.idx`, `faiss_map.<v>.npy`, `faiss_delta.<v>.log`) y un
+manifiesto (`faiss_manifest.json`) con sus sumas SHA-256. Todo se escribe en un
+temporal + fsync + rename, y el manifiesto se sustituye el último: tras un
+fallo apunta siempre a un índice y un mapa completos de la misma versión.
+
+Al arrancar el snapshot se abre con mmap (ver `vector_index.FAISS_MMAP`) y se
+registra cuánto tarda cada fase de la carga.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from backend.vector_index import (FAISS_DELTA_LOG_PATH, FAISS_INDEX_PATH, FAISS_MAP_PATH, FAISS_MMAP, NoteVectorIndex,
+                                  append_delta_log, needs_compaction, replay_delta_log)
+
+FAISS_MANIFEST_PATH = "faiss_manifest.json"
+MANIFEST_FORMAT = 1
+# Leer el snapshot entero para comprobar las sumas cuesta tanto como cargarlo sin mmap; con 0 solo se comprueban los tamaños
+FAISS_VERIFY_CHECKSUMS = os.getenv("FAISS_VERIFY_CHECKSUMS", "1") == "1"
+
+Upserts = Sequence[Tuple[int, str, Sequence[float]]]
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    version: int # Versión en memoria: cambia con cada publicación
+    vector_index: NoteVectorIndex
+    published_at: float
+
+    @property
+    def ntotal(self) -> int:
+        return self.vector_index.ntotal
+
+
+def _fsync_directory(directory: str):
+    try: fd = os.open(directory, os.O_RDONLY)
+    except OSError: return # Sin soporte (p. ej. Windows)
+    try: os.fsync(fd)
+    except OSError: pass
+    finally: os.close(fd)
+
+def atomic_write(path: str, write: Callable[[str], None]):
+    """Genera `path` con `write(ruta_temporal)` + fsync + rename: queda el fichero anterior o el nuevo completo."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory); os.close(fd)
+    try:
+        write(tmp_path)
+        with open(tmp_path, "rb+") as f: os.fsync(f.fileno())
+        os.replace(tmp_path, path); _fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+        raise
+
+def _write_json(path: str, data: dict):
+    with open(path, "w") as f: json.dump(data, f)
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""): digest.update(block)
+    return digest.hexdigest()
+
+
+class SnapshotStore:
+    """Snapshots del índice en `directory`: ficheros versionados + manifiesto con checksums."""
+
+    def __init__(self, directory: str = "."):
+        self.directory = directory
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self.path(FAISS_MANIFEST_PATH)): return None
+        with open(self.path(FAISS_MANIFEST_PATH), "r") as f: return json.load(f)
+
+    def write(self, vector_index: NoteVectorIndex) -> dict:
+        """Escribe un snapshot nuevo y lo activa sustituyendo el manifiesto. Devuelve el manifiesto."""
+        previous = self.read_manifest()
+        version = (previous["version"] + 1) if previous else 1
+        files = {"index_file": f"faiss_index.{version}.idx", "map_file": f"faiss_map.{version}.npy"}
+        atomic_write(self.path(files["index_file"]), vector_index.write_index)
+        atomic_write(self.path(files["map_file"]), vector_index.write_map)
+        manifest = {"format": MANIFEST_FORMAT, "version": version, **files, "delta_log": f"faiss_delta.{version}.log",
+                    "index_sha256": file_sha256(self.path(files["index_file"])), "map_sha256": file_sha256(self.path(files["map_file"])),
+                    "index_bytes": os.path.getsize(self.path(files["index_file"])), "map_bytes": os.path.getsize(self.path(files["map_file"])),
+                    "ntotal": vector_index.ntotal, "index_type": vector_index.index_type, "created_at": time.time()}
+        atomic_write(self.path(FAISS_MANIFEST_PATH), lambda tmp: _write_json(tmp, manifest))
+        self._remove_stale(manifest)
+        return manifest
+
+    def load(self) -> Tuple[Optional[NoteVectorIndex], Optional[dict], int, Dict[str, float]]:
+        """(índice, manifiesto, entradas del delta log reaplicadas, ms por fase). Sin snapshot devuelve (None, None, 0, {}).
+
+        Lanza ValueError si un fichero no coincide con su checksum o el índice y el mapa no cuadran.
+        """
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        def lap(phase: str):
+            nonlocal start
+            now = time.perf_counter(); timings[phase] = round((now - start) * 1000, 1); start = now
+        manifest = self.read_manifest()
+        lap("manifest")
+        if manifest is None:
+            # Formato anterior (sin manifiesto): se carga una vez y el siguiente guardado lo migra
+            if not (os.path.exists(self.path(FAISS_INDEX_PATH)) and os.path.exists(self.path(FAISS_MAP_PATH))): return None, None, 0, {}
+            files = (self.path(FAISS_INDEX_PATH), self.path(FAISS_MAP_PATH), self.path(FAISS_DELTA_LOG_PATH))
+        else:
+            if manifest.get("format") != MANIFEST_FORMAT: raise ValueError(f"Formato de manifiesto FAISS desconocido: {manifest.get('format')}")
+            for file_key, checksum_key, size_key in (("index_file", "index_sha256", "index_bytes"), ("map_file", "map_sha256", "map_bytes")):
+                path = self.path(manifest[file_key])
+                if FAISS_VERIFY_CHECKSUMS: valid = file_sha256(path) == manifest[checksum_key]
+                else: valid = size_key not in manifest or os.path.getsize(path) == manifest[size_key]
+                if not valid: raise ValueError(f"{manifest[file_key]} no coincide con la suma del manifiesto")
+            lap("checksums")
+            files = (self.path(manifest["index_file"]), self.path(manifest["map_file"]), self.path(manifest["delta_log"]))
+        vector_index = NoteVectorIndex.load(files[0], files[1], mmap=FAISS_MMAP)
+        lap("index_and_map")
+        if vector_index.mmapped and os.path.exists(files[2]) and os.path.getsize(files[2]) > 0:
+            # El delta log modifica el índice: se aplica sobre una copia en memoria (el siguiente snapshot vuelve a mapearse)
+            vector_index = vector_index.copy()
+        replayed = replay_delta_log(vector_index, files[2])
+        lap("delta_log")
+        if vector_index.ntotal == 0 or len(vector_index.id_to_note_id) != vector_index.ntotal:
+            raise ValueError("Índice FAISS o mapa vacío o inconsistente")
+        return vector_index, manifest, replayed, timings
+
+    def append_delta(self, manifest: dict, upserts: Upserts, removed_ids: Sequence[int]) -> int:
+        return append_delta_log(upserts, removed_ids, self.path(manifest["delta_log"]))
+
+    def clear(self):
+        for path in [self.path(FAISS_MANIFEST_PATH)] + self._snapshot_files():
+            if os.path.exists(path): os.remove(path)
+
+    def _snapshot_files(self) -> List[str]:
+        patterns = ("faiss_index.*.idx", "faiss_map.*.npy", "faiss_map.*.json", "faiss_delta.*.log", FAISS_INDEX_PATH, FAISS_MAP_PATH, FAISS_DELTA_LOG_PATH)
+        return [path for pattern in patterns for path in glob.glob(self.path(pattern))]
+
+    def _remove_stale(self, manifest: dict):
+        keep = {self.path(manifest[key]) for key in ("index_file", "map_file", "delta_log")}
+        for path in self._snapshot_files():
+            if path not in keep:
+                try: os.remove(path)
+                except OSError as e: print(f"No se pudo borrar el snapshot FAISS antiguo {path}: {e}")
+
+
+class IndexManager:
+    """Publica versiones inmutables del índice. Los escritores se serializan; los lectores no esperan nunca."""
+
+    def __init__(self, store: SnapshotStore, on_publish: Optional[Callable[[], None]] = None):
+        self.store = store
+        self.on_publish = on_publish # p. ej. invalidar cachés de resultados
+        self._current: Optional[IndexSnapshot] = None
+        self._version = 0
+        self._write_lock = threading.RLock()
+        self._manifest: Optional[dict] = None # Snapshot en disco sobre el que se acumula el delta log
+        self._delta_entries = 0
+        self._build_thread: Optional[threading.Thread] = None
+        self._pending: Optional[List[Tuple[list, list]]] = None # Cambios llegados durante una reconstrucción
+        self.last_build_error: Optional[str] = None
+        self.load_timings_ms: Dict[str, float] = {} # Fases de la última carga desde disco
+
+    @property
+    def current(self) -> Optional[IndexSnapshot]:
+        return self._current
+
+    @property
+    def is_building(self) -> bool:
+        return self._build_thread is not None and self._build_thread.is_alive()
+
+    def _publish(self, vector_index: Optional[NoteVectorIndex]):
+        # Una única asignación: un lector ve la versión anterior completa o la nueva completa
+        self._version += 1
+        self._current = IndexSnapshot(self._version, vector_index, time.time()) if vector_index is not None else None
+        if self.on_publish: self.on_publish()
+
+    def _save(self, vector_index: NoteVectorIndex):
+        try:
+            self._manifest = self.store.write(vector_index); self._delta_entries = 0
+            print(f"Snapshot FAISS v{self._manifest['version']} guardado ({vector_index.ntotal} vectores).")
+        except Exception as e:
+            print(f"Error al guardar el snapshot FAISS: {e}")
+
+    def _clear(self):
+        self._publish(None); self._manifest = None; self._delta_entries = 0
+        self.store.clear()
+
+    def load_from_disk(self) -> Optional[IndexSnapshot]:
+        """Publica el snapshot guardado (más su delta log). None si no hay; excepción si está dañado."""
+        with self._write_lock:
+            start = time.perf_counter()
+            vector_index, manifest, replayed, timings = self.store.load()
+            if vector_index is None: return None
+            self._manifest, self._delta_entries = manifest, replayed
+            if manifest is None: self._save(vector_index) # Migra el formato anterior
+            self._publish(vector_index)
+            self.load_timings_ms = {**timings, "total": round((time.perf_counter() - start) * 1000, 1)}
+            print(f"Índice FAISS ({vector_index.index_type}{', mmap' if vector_index.mmapped else ''}) cargado desde disco con "
+                  f"{vector_index.ntotal} vectores ({replayed} cambios del delta log) en {self.load_timings_ms['total']:.0f} ms: "
+                  + ", ".join(f"{phase} {ms:.0f} ms" for phase, ms in timings.items()))
+            return self._current
+
+    def apply_updates(self, upserts: Upserts, removed_ids: Sequence[int]) -> Optional[IndexSnapshot]:
+        """Aplica cambios al índice actual (en el sitio; un índice mapeado se copia antes a memoria) y publica la versión nueva.
+
+        Durante una reconstrucción los cambios se guardan también para reaplicarlos
+        sobre el índice nuevo. Devuelve None si no hay índice que actualizar.
+        """
+        with self._write_lock:
+            if self._pending is not None: self._pending.append((list(upserts), list(removed_ids)))
+            current = self._current
+            if current is None: return None
+            updated = current.vector_index.copy() if current.vector_index.mmapped else current.vector_index
+            if not updated.supports_remove and (len(removed_ids) or any(u[0] in updated.id_to_note_id for u in upserts)):
+                # Se comprueba antes de tocar el índice publicado: a medias quedaría inconsistente hasta la reconstrucción
+                raise RuntimeError(f"El índice {updated.index_type} no admite borrar ni reemplazar vectores; es necesario reconstruirlo")
+            with updated.exclusive():
+                # Primero los borrados: si un id borrado vuelve en los upserts, su vector nuevo debe quedarse
+                updated.remove(removed_ids)
+                updated.upsert([u[0] for u in upserts], [u[1] for u in upserts], [u[2] for u in upserts])
+            if updated.ntotal == 0:
+                self._clear(); return None
+            self._publish(updated)
+            if self._manifest is None: self._save(updated)
+            else:
+                try: self._delta_entries += self.store.append_delta(self._manifest, upserts, removed_ids)
+                except Exception as e:
+                    print(f"Error escribiendo el delta log FAISS: {e}. Guardando snapshot completo..."); self._save(updated)
+                if needs_compaction(self._delta_entries, updated.ntotal): self._save(updated)
+            return self._current
+
+    def start_build(self, build: Callable[[], Optional[NoteVectorIndex]]) -> bool:
+        """Lanza `build` en un hilo y publica su resultado al terminar. False si ya hay una reconstrucción en marcha."""
+        with self._write_lock:
+            if self.is_building: return False
+            self._pending = []
+            self._build_thread = threading.Thread(target=self._run_build, args=(build,), name="faiss-index-build", daemon=True)
+            self._build_thread.start()
+            return True
+
+    def wait_for_build(self, timeout: Optional[float] = None) -> bool:
+        thread = self._build_thread
+        if thread is not None: thread.join(timeout)
+        return not self.is_building
+
+    def _run_build(self, build: Callable[[], Optional[NoteVectorIndex]]):
+        start = time.perf_counter()
+        try: vector_index = build()
+        except Exception as e:
+            print(f"Error reconstruyendo el índice FAISS: {e}. Se mantiene la versión actual.")
+            with self._write_lock: self._pending = None; self.last_build_error = str(e)
+            return
+        retry = False
+        with self._write_lock:
+            pending, self._pending = self._pending or [], None
+            try:
+                # Cambios aplicados al índice anterior mientras se construía este (las operaciones son idempotentes)
+                for upserts, removed_ids in pending:
+                    if vector_index is None: break
+                    vector_index.remove(removed_ids)
+                    vector_index.upsert([u[0] for u in upserts], [u[1] for u in upserts], [u[2] for u in upserts])
+            except Exception as e:
+                print(f"No se pudieron reaplicar los cambios recibidos durante la reconstrucción ({e}); se reconstruye de nuevo.")
+                retry = True
+            if not retry:
+                self.last_build_error = None
+                if vector_index is None or vector_index.ntotal == 0: self._clear()
+                else:
+                    self._publish(vector_index); self._save(vector_index)
+                    print(f"Índice FAISS v{self._version} ({vector_index.index_type}, {vector_index.ntotal} vectores) publicado "
+                          f"tras {time.perf_counter() - start:.1f}s de reconstrucción en segundo plano.")
+        if retry:
+            self._build_thread = None; self.start_build(build)
+
+    def status(self) -> dict:
+        snapshot = self._current
+        return {"version": snapshot.version if snapshot else None, "ntotal": snapshot.ntotal if snapshot else 0,
+                "index_type": snapshot.vector_index.index_type if snapshot else None, "building": self.is_building,
+                "last_build_error": self.last_build_error, "disk_snapshot_version": self._manifest["version"] if self._manifest else None,
+                "delta_log_entries": self._delta_entries, "mmapped": snapshot.vector_index.mmapped if snapshot else False,
+                "load_timings_ms": self.load_timings_ms}
@@ -1,18 +1,23 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, Header, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Header, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
+import anyio
+import asyncio
 import os
 from dotenv import load_dotenv
 import json
-import io
-from datetime import datetime, timezone
-from typing import List as TypingList, Optional, Dict, Any
+import hashlib
+import threading
+import time
+from datetime import datetime
+from typing import List as TypingList, Optional, Dict, Any, Union
 
 # SQLAlchemy y Modelos de BD
-from sqlalchemy import create_engine, or_ as sql_or_
+from sqlalchemy import and_ as sql_and_, create_engine, distinct, event as sqlalchemy_event, func, insert, or_ as sql_or_, select
 from sqlalchemy.orm import sessionmaker, Session
-from backend.database_models import Base, Note, Tag, Embedding
+from backend.database_models import Base, Embedding, Note, NoteChunk, SyncState, Tag, note_tags_table
 
 # Google OAuth y Drive API
 from google_auth_oauthlib.flow import Flow
@@ -20,14 +25,32 @@ from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleAuthRequest
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
+from backend.drive_client import DriveClient, FolderTree, GoogleDriveClient, classify_changes, iter_downloads, list_vault_files
 
 # OpenAI
-import openai
+from backend.embeddings import EMBEDDING_DIMENSION, embed_many, embedding_text_hash, get_default_embedder, get_embedding_async, get_embeddings_async
+from backend.openai_client import close_async_openai_client, get_async_openai_client, openai_slot
+from backend.chunking import chunk_note
+from backend.context_packing import CHAT_CONTEXT_MAX_TOKENS, PackedContext, Passage, pack_context
+from backend.filter_index import FilterIndexCache
+from backend.fulltext import build_match_query, fulltext_available, search_fulltext
+from backend.hydration import HYDRATION_BATCH_SIZE, excerpt, load_notes, with_tags
+from backend.metrics import (HTTP_REQUEST_DURATION, SYNC_FILES, finish_request_spans, record_span, render_prometheus, server_timing_header, span,
+                             start_profiler, start_request_spans, stop_profiler)
+from backend.query_cache import SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL_S, QueryEmbeddingCache, TTLLRUCache, normalize_query
 
 # FAISS y Numpy
 import faiss
 import numpy as np
+from backend.vector_store import EMBEDDING_STORAGE_DTYPE, decode_vector, encode_vector, load_embedding_matrix
+from backend.retrieval import (ChunkHit, aggregate_chunk_hits, dedupe_across_queries, l2_to_cosine, overfetch_sizes,
+                               reciprocal_rank_fusion, weighted_score_fusion)
+from backend.index_manager import IndexManager, SnapshotStore
+from backend.note_listing import InvalidCursor, decode_cursor, encode_cursor, keyset_page, parse_fields, project_rows, projected_query
+from backend.note_ingest import STALE_CONTENT_MD5, NoteBatchWriter, NoteWrite, load_note_contents, prefetch_notes
+from backend.sync_jobs import (SyncJobConflict, SyncJobRunner, SyncLeaseLost, active_job, enqueue_job, is_resumable, job_status,
+                               utcnow as sync_utcnow)
+from backend.vector_index import FAISS_INDEX_TYPE, NoteVectorIndex, effective_index_type
 
 # Pydantic
 from pydantic import BaseModel as PydanticBaseModel, ConfigDict, Field
@@ -48,7 +71,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"], # Paginación de /api/notes y tiempos por etapa
 )
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Mide cada petición: histograma por ruta, cabecera Server-Timing con las etapas (ver backend/metrics.py) y perfil si es lenta."""
+    start = time.perf_counter(); spans_token = start_request_spans(); profiler = start_profiler()
+    status = 500
+    try:
+        response = await call_next(request); status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start; spans = finish_request_spans(spans_token)
+        route = getattr(request.scope.get("route"), "path", "sin_ruta") # Plantilla de la ruta: acota la cardinalidad de las etiquetas
+        HTTP_REQUEST_DURATION.observe(elapsed, method=request.method, route=route, status=status)
+        if profiler is not None: stop_profiler(profiler, f"{request.method} {route}", elapsed)
+    response.headers["Server-Timing"] = server_timing_header(spans, elapsed)
+    return response
 # --- Fin Configuración FastAPI ---
 
 # --- Configuración OAuth (sin cambios) ---
@@ -83,7 +122,28 @@ def load_credentials() -> Credentials | None:
 
 # --- Configuración Base de Datos ---
 DATABASE_URL = "sqlite:///./notes.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# WAL: las lecturas de las peticiones no esperan a las escrituras de la sincronización y cada commit no
+# hace fsync de la BD entera; con synchronous=NORMAL un corte de luz puede perder el último commit, no corromper
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "wal")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "normal")
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = 10000 # Otro worker escribiendo: esperar en lugar de fallar con "database is locked"
+
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000})
+
+@sqlalchemy_event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_db():
@@ -93,103 +153,104 @@ def get_db():
 # --- Fin Configuración Base de Datos ---
 
 # --- Configuración FAISS ---
-FAISS_INDEX_PATH = "faiss_index.idx" # Guardado en el directorio backend/
-FAISS_MAP_PATH = "faiss_map.json"   # Guardado en el directorio backend/
-faiss_index: Optional[faiss.Index] = None
-faiss_id_to_note_id_map: list[str] = []
-EMBEDDING_DIMENSION = 1536
+faiss_index_version = 0 # Cambia con cada cambio del índice o de las notas; forma parte de la clave de la caché de resultados
+search_result_cache = TTLLRUCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL_S)
+query_embedding_cache = QueryEmbeddingCache()
+chat_context_cache = TTLLRUCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL_S) # Contexto empaquetado por turno de conversación
 
-def build_or_load_faiss_index(db: Session): # Renombrado y modificado
-    global faiss_index, faiss_id_to_note_id_map
+def invalidate_search_results():
+    """Llamar tras sustituir o modificar el índice (o las notas): los resultados cacheados dejan de valer."""
+    global faiss_index_version
+    faiss_index_version += 1; search_result_cache.clear(); chat_context_cache.clear()
 
-    # Intentar cargar desde disco primero
-    if os.path.exists(FAISS_INDEX_PATH) and os.path.exists(FAISS_MAP_PATH):
-        try:
-            print(f"Cargando índice FAISS desde {FAISS_INDEX_PATH}...")
-            loaded_index = faiss.read_index(FAISS_INDEX_PATH)
-            with open(FAISS_MAP_PATH, 'r') as f:
-                loaded_map = json.load(f)
-
-            if loaded_index.ntotal > 0 and len(loaded_map) == loaded_index.ntotal:
-                faiss_index = loaded_index
-                faiss_id_to_note_id_map = loaded_map
-                print(f"Índice FAISS cargado exitosamente desde disco con {faiss_index.ntotal} vectores.")
-                return # Salir si la carga fue exitosa
-            else:
-                print("Índice FAISS o mapa cargado desde disco está vacío o inconsistente. Reconstruyendo...")
-        except Exception as e:
-            print(f"Error al cargar índice FAISS desde disco: {e}. Reconstruyendo...")
-
-    # Si no se pudo cargar, construir desde BD
-    print("Construyendo índice FAISS desde la base de datos...")
-    db_embeddings = db.query(Embedding.note_id, Embedding.vector).all()
-
-    if not db_embeddings:
-        print("No hay embeddings en la BD para construir el índice FAISS.")
-        faiss_index = None; faiss_id_to_note_id_map = []
-        # Intentar eliminar archivos de índice viejos si no hay datos para evitar cargar un índice obsoleto la próxima vez
-        if os.path.exists(FAISS_INDEX_PATH): os.remove(FAISS_INDEX_PATH)
-        if os.path.exists(FAISS_MAP_PATH): os.remove(FAISS_MAP_PATH)
-        return
-
-    note_ids_temp = []
-    vectors_list_temp = []
-    for note_id, vector_json in db_embeddings:
-        try:
-            vector = json.loads(vector_json)
-            if len(vector) == EMBEDDING_DIMENSION:
-                note_ids_temp.append(note_id)
-                vectors_list_temp.append(vector)
-            else: print(f"Dimensión incorrecta para note_id {note_id}. Omitiendo.")
-        except json.JSONDecodeError: print(f"Error JSON decodificando vector para note_id {note_id}. Omitiendo.")
-
-    if not vectors_list_temp:
-        print("No hay vectores válidos para construir el índice FAISS.")
-        faiss_index = None; faiss_id_to_note_id_map = []
-        if os.path.exists(FAISS_INDEX_PATH): os.remove(FAISS_INDEX_PATH)
-        if os.path.exists(FAISS_MAP_PATH): os.remove(FAISS_MAP_PATH)
-        return
-
-    vectors_np = np.array(vectors_list_temp).astype('float32')
-    if vectors_np.shape[1] != EMBEDDING_DIMENSION: # Doble chequeo
-        print(f"Error crítico: Dimensiones inconsistentes en vectores NumPy.")
-        faiss_index = None; faiss_id_to_note_id_map = []
-        return
-
-    current_faiss_index = faiss.IndexFlatL2(EMBEDDING_DIMENSION)
-    faiss.normalize_L2(vectors_np)
-    current_faiss_index.add(vectors_np)
-
-    faiss_index = current_faiss_index
-    faiss_id_to_note_id_map = note_ids_temp
-    print(f"Índice FAISS construido con {faiss_index.ntotal} vectores.")
-
-    # Guardar en disco
+# Tags, fecha y carpeta de cada fragmento para filtrar dentro de FAISS; se reconstruye al cambiar faiss_index_version
+note_filter_index = FilterIndexCache(SessionLocal, lambda: faiss_index_version)
+
+# Índice + mapa NoteChunk.id -> Note.id publicados juntos como una versión inmutable (ver index_manager)
+index_manager = IndexManager(SnapshotStore("."), on_publish=invalidate_search_results)
+
+def current_vector_index() -> Optional[NoteVectorIndex]:
+    snapshot = index_manager.current
+    return snapshot.vector_index if snapshot is not None else None
+
+def build_faiss_index_from_db() -> Optional[NoteVectorIndex]:
+    db = SessionLocal()
     try:
-        print(f"Guardando índice FAISS en {FAISS_INDEX_PATH}...")
-        faiss.write_index(faiss_index, FAISS_INDEX_PATH)
-        with open(FAISS_MAP_PATH, 'w') as f:
-            json.dump(faiss_id_to_note_id_map, f)
-        print("Índice FAISS y mapa guardados exitosamente en disco.")
+        print("Construyendo índice FAISS desde la base de datos...")
+        embedding_ids, note_ids, vectors_np = load_embedding_matrix(db, EMBEDDING_DIMENSION)
+        if len(embedding_ids) == 0:
+            print("No hay vectores válidos en la BD para construir el índice FAISS."); return None
+        with span("faiss_build"): vector_index = NoteVectorIndex.build(embedding_ids, note_ids, vectors_np)
+        print(f"Índice FAISS ({vector_index.index_type}) construido con {vector_index.ntotal} vectores.")
+        return vector_index
+    finally: db.close()
+
+def rebuild_faiss_index_in_background(reason: str) -> bool:
+    """Reconstruye desde la BD en un hilo; hasta que termine se sigue sirviendo la versión publicada."""
+    started = index_manager.start_build(build_faiss_index_from_db)
+    if started: print(f"{reason} Reconstruyendo el índice FAISS en segundo plano...")
+    return started
+
+def load_or_build_faiss_index():
+    """Al arrancar: carga el snapshot de disco y, si no sirve, lo reconstruye en segundo plano."""
+    try:
+        with span("faiss_load"): snapshot = index_manager.load_from_disk()
+        if snapshot is None: rebuild_faiss_index_in_background("No hay índice FAISS en disco."); return
+        expected_type = effective_index_type(FAISS_INDEX_TYPE, snapshot.ntotal)
+        if snapshot.vector_index.index_type != expected_type:
+            # El índice cargado se sirve mientras se construye el del tipo configurado
+            rebuild_faiss_index_in_background(f"El índice en disco es {snapshot.vector_index.index_type} pero la configuración pide {expected_type}.")
+        elif snapshot.vector_index.has_ivf_id_map:
+            rebuild_faiss_index_in_background(f"El índice {expected_type} en disco usa el formato anterior (IVF dentro de un IndexIDMap), que no admite borrados.")
     except Exception as e:
-        print(f"Error al guardar índice FAISS en disco: {e}")
+        rebuild_faiss_index_in_background(f"Error al cargar índice FAISS desde disco: {e}.")
+
+def apply_faiss_index_updates(upserts: list[tuple[int, str, list[float]]], removed_ids: Optional[list[int]] = None):
+    """Aplica al índice solo los vectores tocados por una sincronización.
+
+    `upserts` son tuplas (NoteChunk.id, Note.id, vector). Se publica una copia
+    actualizada del índice y los cambios se añaden al delta log para que un
+    reinicio no tenga que reconstruir; el snapshot se reescribe solo cuando el log
+    crece demasiado.
+    """
+    removed_ids = removed_ids or []
+    if not upserts and not removed_ids: return
+    try:
+        with span("faiss_update"): snapshot = index_manager.apply_updates(upserts, removed_ids)
+    except Exception as e:
+        rebuild_faiss_index_in_background(f"Error aplicando cambios incrementales al índice FAISS: {e}."); return
+    if snapshot is None:
+        # Sin índice publicado: una reconstrucción en marcha ya incluirá estos cambios. La sincronización
+        # espera a que termine para que al acabar el índice esté disponible
+        if not index_manager.is_building and index_manager.current is None and upserts: rebuild_faiss_index_in_background("No hay índice FAISS publicado.")
+        index_manager.wait_for_build(); return
+    print(f"Índice FAISS actualizado: {len(upserts)} vectores añadidos/reemplazados, {len(removed_ids)} eliminados ({snapshot.ntotal} en total).")
+    if snapshot.vector_index.should_upgrade_to(FAISS_INDEX_TYPE):
+        rebuild_faiss_index_in_background(f"Hay vectores suficientes para entrenar un índice {FAISS_INDEX_TYPE}.")
+
+# Las búsquedas FAISS concurrentes ya se reparten entre los hilos del pool; limitar OpenMP evita la sobresuscripción
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", "0")) # 0 = valor por defecto de FAISS (todos los núcleos)
+THREADPOOL_WORKERS = int(os.getenv("THREADPOOL_WORKERS", "0")) # Hilos para trabajo bloqueante (BD, FAISS); 0 = 40 (anyio)
 
 @app.on_event("startup")
 async def startup_event():
-    db = SessionLocal()
-    try: build_or_load_faiss_index(db)
-    finally: db.close()
-# --- Fin Configuración FAISS ---
+    if FAISS_OMP_THREADS > 0: faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+    if THREADPOOL_WORKERS > 0: anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_WORKERS
+    start = time.perf_counter()
+    await run_in_threadpool(load_or_build_faiss_index)
+    print(f"Arranque: índice FAISS listo para servir en {(time.perf_counter() - start) * 1000:.0f} ms"
+          + ("" if index_manager.current else " (sin índice publicado todavía; reconstrucción en segundo plano)") + ".")
+    try: await run_in_threadpool(resume_interrupted_sync_job)
+    except Exception as e: print(f"No se pudo comprobar si hay sincronizaciones interrumpidas: {e}")
 
-# --- Estado de Sincronización (para tarea en segundo plano) ---
-sync_task_status: Dict[str, Any] = {"status": "idle", "message": "No iniciada", "last_error": None, "last_success_time": None, "processed_files": 0, "total_files": 0}
-# --- Fin Estado de Sincronización ---
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_async_openai_client()
+# --- Fin Configuración FAISS ---
 
 # --- Variables Globales y Helpers (sin cambios significativos, solo asegurar OpenAI key) ---
 OBSIDIAN_VAULT_FOLDER_ID = os.getenv("OBSIDIAN_VAULT_FOLDER_ID")
 API_BEARER_TOKEN = os.getenv("API_BEARER_TOKEN")
-EMBEDDING_MODEL = "text-embedding-3-small"
-
 def get_drive_service(credentials: Credentials): # ... (como estaba)
     if not credentials or not credentials.valid: raise ValueError("Credenciales de Google no válidas")
     return build("drive", "v3", credentials=credentials)
@@ -199,17 +260,6 @@ def extract_tags_from_content(content: str) -> list[str]: # ... (como estaba)
     content_no_code = re.sub(r"```.*?```", "", content, flags=re.DOTALL); content_no_code = re.sub(r"`.*?`", "", content_no_code)
     return list(set(re.findall(r"#([a-zA-Z0-9_.-]+)", content_no_code)))
 
-def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> list[float] | None: # ... (como estaba, asegurar API key)
-    if not text or not text.strip(): return None
-    try:
-        text_to_embed = text.replace("\n", " "); max_chars = 20000
-        if len(text_to_embed) > max_chars: text_to_embed = text_to_embed[:max_chars]
-        client = openai.OpenAI(); current_api_key = os.getenv("OPENAI_API_KEY")
-        if not current_api_key: print("Error: OPENAI_API_KEY no configurada."); return None
-        client.api_key = current_api_key
-        response = client.embeddings.create(input=[text_to_embed], model=model)
-        return response.data[0].embedding
-    except Exception as e: print(f"Error al generar embedding: {e}"); return None
 # --- Fin Variables Globales y Helpers ---
 
 # --- Endpoints Generales y OAuth (sin cambios) ---
@@ -245,177 +295,795 @@ async def auth_status(): # ...
     return {"authenticated": False}
 
 # --- Función de Sincronización en Segundo Plano ---
-def perform_drive_sync_and_reindex(db: Session):
-    global sync_task_status
-    sync_task_status = {"status": "syncing", "message": "Iniciando sincronización...", "last_error": None, "processed_files": 0, "total_files": 0}
+SQL_IN_BATCH_SIZE = 500 # Mantiene las cláusulas IN por debajo del límite de variables de SQLite
+SYNC_EMBED_FLUSH_NOTES = int(os.getenv("SYNC_EMBED_FLUSH_NOTES", "200")) # Notas por lote de embeddings durante la sincronización
+SYNC_DB_BATCH_SIZE = int(os.getenv("SYNC_DB_BATCH_SIZE", "500")) # Ficheros por transacción al escribir notas
+
+def _in_batches(values: list, size: int = SQL_IN_BATCH_SIZE):
+    for i in range(0, len(values), size): yield values[i:i + size]
+
+def store_note_chunks(db: Session, notes: list[tuple[str, str, str]]):
+    """Divide las notas en fragmentos, genera sus embeddings por lotes y reemplaza los fragmentos guardados.
+
+    `notes` son tuplas (Note.id, título, contenido). Los fragmentos cuyo texto de
+    embedding ya existe en la BD (mismo hash y modelo) reutilizan ese vector sin
+    llamar a la API. Si falla el embedding de algún fragmento de una nota, se
+    conservan sus fragmentos anteriores y su `content_md5` se marca como obsoleto, para
+    que la siguiente sincronización la vuelva a descargar e indexar. Devuelve (upserts,
+    ids eliminados, notas omitidas): los dos primeros para actualizar el índice
+    FAISS, donde cada upsert es (NoteChunk.id, Note.id, vector).
+    """
+    if not notes: return [], [], []
+    model_name = get_default_embedder().model_name
+    chunks_by_note = {note_id: (title, chunk_note(content or "")) for note_id, title, content in notes}
+    texts_by_hash: Dict[str, str] = {}; chunk_hashes: Dict[tuple[str, int], str] = {}
+    for note_id, (title, chunks) in chunks_by_note.items():
+        for chunk in chunks:
+            text = chunk.embedding_text(title); text_hash = embedding_text_hash(text, model_name)
+            chunk_hashes[(note_id, chunk.index)] = text_hash; texts_by_hash[text_hash] = text
+
+    stored_vectors: Dict[str, tuple[bytes, str]] = {} # text_hash -> (blob, dtype) ya guardados
+    for hashes in _in_batches(list(texts_by_hash)):
+        for text_hash, blob, dtype in db.query(NoteChunk.text_hash, NoteChunk.vector, NoteChunk.vector_dtype).filter(
+                NoteChunk.text_hash.in_(hashes), NoteChunk.model_name == model_name):
+            stored_vectors[text_hash] = (blob, dtype)
+    with span("sync_embedding"): new_vectors = embed_many([(text_hash, text) for text_hash, text in texts_by_hash.items() if text_hash not in stored_vectors])
+    print(f"Fragmentos: {len(chunk_hashes)} ({len(texts_by_hash)} textos distintos, {len(stored_vectors)} reutilizados, {len(new_vectors)} embeddings nuevos).")
+
+    old_chunks: Dict[str, list] = {}
+    for note_ids in _in_batches(list(chunks_by_note)):
+        for row in db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.text_hash, NoteChunk.start_offset, NoteChunk.end_offset).filter(
+                NoteChunk.note_id.in_(note_ids)).order_by(NoteChunk.note_id, NoteChunk.chunk_index):
+            old_chunks.setdefault(row.note_id, []).append(row)
+
+    removed_ids: list[int] = []; new_rows = []; skipped_note_ids: list[str] = []
+    for note_id, (title, chunks) in chunks_by_note.items():
+        hashes = [chunk_hashes[(note_id, chunk.index)] for chunk in chunks]
+        previous = old_chunks.get(note_id, [])
+        if [(r.text_hash, r.start_offset, r.end_offset) for r in previous] == [(h, c.start, c.end) for h, c in zip(hashes, chunks)]:
+            continue # Mismos fragmentos que ya están indexados
+        if any(h not in stored_vectors and h not in new_vectors for h in hashes):
+            print(f"Faltan embeddings para la nota {note_id}; se conservan sus fragmentos anteriores."); skipped_note_ids.append(note_id); continue
+        removed_ids.extend(r.id for r in previous)
+        for chunk, text_hash in zip(chunks, hashes):
+            if text_hash in stored_vectors:
+                blob, dtype = stored_vectors[text_hash]; vector = decode_vector(blob, dtype)
+            else:
+                vector = new_vectors[text_hash]; blob, dtype = encode_vector(vector), EMBEDDING_STORAGE_DTYPE
+            new_rows.append((dict(note_id=note_id, chunk_index=chunk.index, start_offset=chunk.start, end_offset=chunk.end,
+                                  heading=chunk.heading, text=chunk.text, token_count=chunk.token_count, text_hash=text_hash,
+                                  vector=blob, vector_dtype=dtype, model_name=model_name), vector))
+    chunk_write_start = time.perf_counter()
+    try:
+        for ids in _in_batches(removed_ids): db.query(NoteChunk).filter(NoteChunk.id.in_(ids)).delete(synchronize_session=False)
+        # Un executemany para todo el lote (el ORM haría un INSERT por fila para conocer cada id); los ids
+        # se leen después por (note_id, chunk_index), que es único
+        if new_rows: db.execute(insert(NoteChunk), [row for row, _ in new_rows])
+        new_ids: Dict[tuple[str, int], int] = {}
+        for note_ids in _in_batches(list({row["note_id"] for row, _ in new_rows})):
+            new_ids.update(((note_id, chunk_index), chunk_id) for chunk_id, note_id, chunk_index in
+                           db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.chunk_index).filter(NoteChunk.note_id.in_(note_ids)))
+        upserts = [(new_ids[(row["note_id"], row["chunk_index"])], row["note_id"], vector) for row, vector in new_rows]
+        upserted_ids = {chunk_id for chunk_id, _, _ in upserts}
+        removed_ids = [chunk_id for chunk_id in removed_ids if chunk_id not in upserted_ids] # Un id reutilizado no debe borrarse del índice
+        for ids in _in_batches(skipped_note_ids): db.query(Note).filter(Note.id.in_(ids)).update({Note.content_md5: STALE_CONTENT_MD5}, synchronize_session=False)
+        db.commit()
+    except Exception as e: db.rollback(); print(f"Error guardando fragmentos en la BD: {e}"); raise
+    finally: record_span("sync_chunk_write", time.perf_counter() - chunk_write_start)
+    return upserts, removed_ids, skipped_note_ids
+
+DRIVE_PAGE_TOKEN_KEY = "drive_changes_page_token"
+DRIVE_FOLDER_TREE_KEY = "drive_folder_tree"
+
+def get_sync_state(db: Session, key: str) -> Optional[str]:
+    state = db.get(SyncState, key)
+    return state.value if state else None
 
+def set_sync_state(db: Session, key: str, value: Optional[str]):
+    state = db.get(SyncState, key)
+    if state: state.value = value
+    else: db.add(SyncState(key=key, value=value))
+    db.commit()
+
+def delete_notes(db: Session, note_ids: list[str]) -> list[int]:
+    """Elimina notas, sus enlaces a tags y sus fragmentos. Devuelve los ids de fragmento a quitar del índice."""
+    removed_chunk_ids: list[int] = []
+    for ids in _in_batches(list(note_ids)):
+        removed_chunk_ids.extend(chunk_id for (chunk_id,) in db.query(NoteChunk.id).filter(NoteChunk.note_id.in_(ids)))
+        # Borrado explícito: SQLite no aplica ON DELETE CASCADE sin PRAGMA foreign_keys
+        db.query(NoteChunk).filter(NoteChunk.note_id.in_(ids)).delete(synchronize_session=False)
+        db.query(Embedding).filter(Embedding.note_id.in_(ids)).delete(synchronize_session=False)
+        db.execute(note_tags_table.delete().where(note_tags_table.c.note_id.in_(ids)))
+        db.query(Note).filter(Note.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return removed_chunk_ids
+
+def start_sync_job(db: Session, full: bool = False) -> SyncJobRunner:
+    """Crea (o retoma, si su worker murió) el trabajo de sincronización y lo toma para este worker."""
+    job, _ = enqueue_job(db, full)
+    runner = SyncJobRunner(SessionLocal, job.id)
+    if not runner.claim(): raise SyncJobConflict("Una sincronización ya está en progreso.")
+    return runner
+
+def perform_drive_sync_and_reindex(db: Session, drive: Optional[DriveClient] = None, full: bool = False, job: Optional[SyncJobRunner] = None):
+    """Sincroniza la carpeta de la bóveda y actualiza el índice.
+
+    Si hay un page token guardado (y no se pide `full`), solo se procesan los
+    ficheros del feed de cambios de Drive desde la última sincronización; si no,
+    se lista la carpeta completa. En ambos modos se eliminan las notas borradas.
+
+    El progreso se guarda en el trabajo `job` (ver backend/sync_jobs.py); sin él
+    se crea uno. Un trabajo reanudado usa el plan guardado y salta los ficheros
+    ya terminados.
+    """
+    if job is None: job = start_sync_job(db, full)
+    full = job.full or full
+    sync_start = time.perf_counter()
     try:
         if not OBSIDIAN_VAULT_FOLDER_ID:
             raise ValueError("OBSIDIAN_VAULT_FOLDER_ID no está configurado en el entorno.")
-        credentials = load_credentials()
-        if not credentials: raise ValueError("No autenticado para la tarea de sincronización.")
-        if not credentials.valid: raise ValueError("Credenciales inválidas para la tarea de sincronización.")
-
-        service = get_drive_service(credentials)
-        query = f"'{OBSIDIAN_VAULT_FOLDER_ID}' in parents and (mimeType='text/markdown' or name contains '.md' or mimeType='application/octet-stream') and trashed=false"
-        all_files_meta = []
-        page_token = None
-        sync_task_status["message"] = "Listando archivos de Google Drive..."
-        while True:
-            results = service.files().list(q=query, pageSize=100, fields="nextPageToken, files(id, name, modifiedTime, webViewLink, mimeType)", pageToken=page_token).execute()
-            all_files_meta.extend(results.get("files", []))
-            page_token = results.get("nextPageToken")
-            if not page_token: break
-
-        sync_task_status["total_files"] = len(all_files_meta)
-        if not all_files_meta:
-            sync_task_status = {"status": "success", "message": "No se encontraron archivos .md para sincronizar.", "last_success_time": datetime.now(timezone.utc).isoformat(), "processed_files": 0, "total_files": 0}
-            return
+        if drive is None:
+            credentials = load_credentials()
+            if not credentials: raise ValueError("No autenticado para la tarea de sincronización.")
+            if not credentials.valid: raise ValueError("Credenciales inválidas para la tarea de sincronización.")
+            drive = GoogleDriveClient(get_drive_service(credentials), credentials=credentials)
+
+        if job.resumed:
+            all_files_meta, deleted_note_ids = job.plan["files"], job.plan["deleted_note_ids"]
+            new_page_token, folder_tree = job.plan["new_page_token"], FolderTree.from_json(job.plan["folder_tree"])
+            print(f"Reanudando la sincronización {job.job_id}: {job.processed_files} de {len(all_files_meta)} archivos ya procesados.")
+        else:
+            with span("sync_plan"): all_files_meta, deleted_note_ids, new_page_token, folder_tree = plan_drive_sync(db, drive, job, full)
+            job.progress(total_files=len(all_files_meta))
+            job.save_plan({"files": all_files_meta, "deleted_note_ids": deleted_note_ids, "new_page_token": new_page_token,
+                           "folder_tree": folder_tree.to_json()})
 
+        done_file_ids = job.done_file_ids() if job.resumed else set()
         changed_notes_exist_in_sync = False
-        for i, item_meta in enumerate(all_files_meta):
-            sync_task_status["message"] = f"Procesando archivo {i+1} de {len(all_files_meta)}: {item_meta.get('name')}"
-            sync_task_status["processed_files"] = i + 1
+        batch: list[NoteWrite] = [] # Ficheros procesados desde el último checkpoint
+        reindex_in_batch = 0
+        chunk_upserts, removed_chunk_ids = [], []
+        notes_with_chunks = {note_id for (note_id,) in db.query(NoteChunk.note_id).distinct()}
 
-            file_id = item_meta.get("id"); file_name = item_meta.get("name"); mime_type = item_meta.get("mimeType")
-            modified_time_str = item_meta.get("modifiedTime"); source_url = item_meta.get("webViewLink")
+        # Si Drive informa el mismo md5 que tenemos guardado, el contenido no ha cambiado: no se descarga
+        with span("sync_prefetch"): stored_notes = prefetch_notes(db, [item_meta["id"] for item_meta in all_files_meta])
+        writer = NoteBatchWriter(db, stored_notes, extract_tags_from_content)
+        unchanged_metas, download_metas = [], []
+        for item_meta in all_files_meta:
+            if item_meta["id"] in done_file_ids: continue
+            drive_md5 = item_meta.get("md5Checksum"); stored = stored_notes.get(item_meta["id"])
+            (unchanged_metas if drive_md5 and stored is not None and stored.content_md5 == drive_md5 else download_metas).append(item_meta)
 
-            if mime_type == 'application/octet-stream' and not (file_name and file_name.lower().endswith('.md')): continue
+        def flush_batch():
+            # Una transacción para las notas del lote y, después, sus embeddings (generados en lotes mientras
+            # siguen llegando descargas, para solapar red y API)
+            nonlocal failed_files, changed_notes_exist_in_sync, reindex_in_batch
+            failed_ids = set()
+            with span("sync_db_write"): write_failures = writer.flush()
+            for write, error in write_failures:
+                failed_files += 1; failed_ids.add(write.file_id)
+                print(f"Error guardando el archivo {write.file_name} en tarea de fondo: {error}")
+                job.record_error(write.file_id, write.file_name, str(error))
+            written = [write for write in batch if write.file_id not in failed_ids]
+            to_index = [write for write in written if write.reindex]
+            if to_index:
+                changed_notes_exist_in_sync = True
+                job.progress(message=f"Generando embeddings para {len(to_index)} notas...")
+                stored_contents = load_note_contents(db, [write.file_id for write in to_index if write.content is None])
+                upserts, removed_ids, skipped_ids = store_note_chunks(db, [(write.file_id, write.title, write.content if write.content is not None else stored_contents.get(write.file_id))
+                                                                           for write in to_index])
+                chunk_upserts.extend(upserts); removed_chunk_ids.extend(removed_ids)
+                # Sin embeddings la nota conserva vectores de su texto anterior: cuenta como fallo para no avanzar el page token
+                for write in to_index:
+                    if write.file_id not in skipped_ids: continue
+                    failed_files += 1; failed_ids.add(write.file_id)
+                    job.record_error(write.file_id, write.file_name, "No se pudieron generar los embeddings de la nota.")
+            # Checkpoint: con los embeddings guardados, estos ficheros no se repiten si el trabajo se reanuda
+            job.mark_done([(write.file_id, write.file_name) for write in written if write.file_id not in failed_ids]); batch.clear(); reindex_in_batch = 0
 
-            request_content = service.files().get_media(fileId=file_id); fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request_content); done = False; content_str = ""
-            should_generate_embedding_for_this_note = False
+        def files_to_process():
+            for item_meta in unchanged_metas: yield item_meta, None, None
+            downloads = iter_downloads(drive, download_metas)
+            while True: # Tiempo que la sincronización espera a las descargas (cada descarga se mide aparte en drive_download)
+                wait_start = time.perf_counter(); item = next(downloads, None); record_span("sync_download_wait", time.perf_counter() - wait_start)
+                if item is None: return
+                yield item
 
+        failed_files = 0
+        processed_files = len(all_files_meta) - len(unchanged_metas) - len(download_metas)
+        for item_meta, content_bytes, download_error in files_to_process():
+            job.check()
+            processed_files += 1
+            job.progress(message=f"Procesando archivo {processed_files} de {len(all_files_meta)}: {item_meta.get('name')}", processed_files=processed_files)
             try:
-                while not done: status, done = downloader.next_chunk()
-                fh.seek(0); content_str = fh.read().decode("utf-8")
-                drive_mod_time_dt = datetime.fromisoformat(modified_time_str.replace("Z", "+00:00")) if modified_time_str else datetime.now(timezone.utc)
-                db_note = db.query(Note).filter(Note.id == file_id).first()
-
-                if db_note:
-                    if db_note.drive_modified_time is None or drive_mod_time_dt > db_note.drive_modified_time:
-                        db_note.title = (file_name.replace(".md", "") if file_name else f"Untitled_{file_id}")
-                        db_note.content = content_str; db_note.drive_modified_time = drive_mod_time_dt
-                        db_note.source_url = source_url; db_note.tags.clear(); should_generate_embedding_for_this_note = True; changed_notes_exist_in_sync = True
-                        extracted_tags = extract_tags_from_content(content_str)
-                        for tag_name in extracted_tags:
-                            db_tag = db.query(Tag).filter(Tag.name == tag_name).first()
-                            if not db_tag: db_tag = Tag(name=tag_name); db.add(db_tag)
-                            if db_tag not in db_note.tags: db_note.tags.append(db_tag)
-                else:
-                    db_note = Note(id=file_id, title=(file_name.replace(".md", "") if file_name else f"Untitled_{file_id}"), content=content_str, drive_modified_time=drive_mod_time_dt, source_url=source_url)
-                    extracted_tags = extract_tags_from_content(content_str)
-                    for tag_name in extracted_tags:
-                        db_tag = db.query(Tag).filter(Tag.name == tag_name).first()
-                        if not db_tag: db_tag = Tag(name=tag_name); db.add(db_tag)
-                        db_note.tags.append(db_tag)
-                    db.add(db_note); should_generate_embedding_for_this_note = True; changed_notes_exist_in_sync = True
-
-                if should_generate_embedding_for_this_note:
-                    note_content_for_embedding = f"{db_note.title}\n\n{content_str}"
-                    embedding_vector = get_embedding(note_content_for_embedding)
-                    if embedding_vector:
-                        existing_embedding = db.query(Embedding).filter(Embedding.note_id == db_note.id).first()
-                        if existing_embedding:
-                            existing_embedding.vector = json.dumps(embedding_vector); existing_embedding.model_name = EMBEDDING_MODEL
-                            existing_embedding.updated_at = datetime.now(timezone.utc)
-                        else: db.add(Embedding(note_id=db_note.id, vector=json.dumps(embedding_vector), model_name=EMBEDDING_MODEL))
-                db.commit()
+                if download_error: raise download_error
+                # Nota sin fragmentos (p. ej. sincronizada antes de existir note_chunks) o trabajo reanudado (el intento
+                # anterior pudo guardar la nota sin sus fragmentos): se indexa aunque el contenido no haya cambiado
+                force_reindex = job.resumed or item_meta["id"] not in notes_with_chunks
+                write = writer.add(item_meta, content_bytes, force_reindex=force_reindex)
+                batch.append(write); reindex_in_batch += write.reindex
             except Exception as e_file_process:
-                db.rollback()
-                print(f"Error procesando archivo {file_name} en tarea de fondo: {e_file_process}")
-                # Podríamos registrar este error específico de archivo, pero la tarea general continuará
+                failed_files += 1
+                print(f"Error procesando archivo {item_meta.get('name')} en tarea de fondo: {e_file_process}")
+                job.record_error(item_meta["id"], item_meta.get("name"), str(e_file_process))
+            if reindex_in_batch >= SYNC_EMBED_FLUSH_NOTES or len(writer) >= SYNC_DB_BATCH_SIZE: flush_batch()
+
+        print(f"Sincronización: {len(unchanged_metas)} de {len(all_files_meta)} archivos sin cambios de contenido (no descargados).")
+        flush_batch()
+        SYNC_FILES.inc(len(unchanged_metas), result="unchanged"); SYNC_FILES.inc(len(download_metas), result="downloaded")
+        SYNC_FILES.inc(failed_files, result="failed"); SYNC_FILES.inc(len(deleted_note_ids), result="deleted")
 
-        if changed_notes_exist_in_sync:
-            sync_task_status["message"] = "Reconstruyendo índice de búsqueda..."
-            build_or_load_faiss_index(db)
+        if deleted_note_ids:
+            job.progress(message="Eliminando notas borradas en Drive...")
+            with span("sync_delete"): deleted_chunk_ids = delete_notes(db, deleted_note_ids)
+            removed_chunk_ids = removed_chunk_ids + deleted_chunk_ids
+            changed_notes_exist_in_sync = changed_notes_exist_in_sync or bool(deleted_chunk_ids)
 
-        sync_task_status = {"status": "success", "message": "Sincronización completada.", "last_success_time": datetime.now(timezone.utc).isoformat(), "processed_files": len(all_files_meta), "total_files": len(all_files_meta)}
+        job.progress(message="Actualizando índice de búsqueda...")
+        if job.resumed:
+            # Los cambios del intento interrumpido están en la BD pero no en el índice: se reconstruye entero
+            index_manager.wait_for_build(); rebuild_faiss_index_in_background(f"Sincronización {job.job_id} reanudada tras una interrupción.")
+        elif changed_notes_exist_in_sync:
+            apply_faiss_index_updates(chunk_upserts, removed_chunk_ids)
+
+        # Con errores por archivo no se avanza el token: la próxima sincronización reintentará esos cambios.
+        # El árbol de carpetas se guarda junto al token para que ambos describan el mismo punto del feed.
+        if failed_files: print(f"{failed_files} archivos con errores; el page token de Drive no se actualiza.")
+        else: set_sync_state(db, DRIVE_FOLDER_TREE_KEY, folder_tree.to_json()); set_sync_state(db, DRIVE_PAGE_TOKEN_KEY, new_page_token)
+
+        invalidate_search_results() # Los resultados incluyen metadatos de notas que pueden haber cambiado sin tocar el índice
+        job.progress(processed_files=len(all_files_meta))
+        job.finish("success", "Sincronización completada." if not failed_files else f"Sincronización completada con {failed_files} archivos con errores.")
         print("Tarea de sincronización en segundo plano completada exitosamente.")
 
+    except SyncLeaseLost as e_lost:
+        print(f"{e_lost} Se abandona este intento."); job.abandon()
     except Exception as e_sync_task:
         print(f"Error en la tarea de sincronización en segundo plano: {e_sync_task}")
-        sync_task_status = {"status": "error", "message": f"Error en la sincronización: {e_sync_task}", "last_error": str(e_sync_task), "processed_files": sync_task_status.get("processed_files",0), "total_files": sync_task_status.get("total_files",0)}
+        job.finish("error", f"Error en la sincronización: {e_sync_task}", str(e_sync_task))
+    finally: record_span("sync_total", time.perf_counter() - sync_start)
 
-# --- Google Drive Sync Endpoint (ahora asíncrono) ---
-@app.post("/api/drive/sync", tags=["Google Drive"]) # Cambiado a POST para iniciar una acción
-async def trigger_drive_sync(background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    global sync_task_status
-    if sync_task_status.get("status") == "syncing":
-        raise HTTPException(status_code=409, detail="Una sincronización ya está en progreso.")
-
-    # Pasar una nueva sesión de BD a la tarea en segundo plano
-    # No se puede pasar directamente 'db' de Depends() porque la sesión se cierra.
-    # La tarea en segundo plano necesitará su propia sesión.
-    # Solución: perform_drive_sync_and_reindex ahora toma la sesión como argumento.
-    # Necesitamos asegurar que la sesión de BD usada por la tarea en segundo plano se maneje correctamente.
-    # FastAPI BackgroundTasks no maneja dependencias complejas como sesiones de BD directamente.
-    # Una forma es crear una nueva sesión dentro de la tarea.
-
-    def sync_with_new_db_session():
-        new_db = SessionLocal()
+def plan_drive_sync(db: Session, drive: DriveClient, job: SyncJobRunner, full: bool) -> tuple[list[dict], list[str], str, FolderTree]:
+    """Ficheros a procesar, notas borradas, page token nuevo y árbol de carpetas (feed de cambios o listado completo)."""
+    page_token = None if full else get_sync_state(db, DRIVE_PAGE_TOKEN_KEY)
+    stored_tree = get_sync_state(db, DRIVE_FOLDER_TREE_KEY)
+    folder_tree = FolderTree.from_json(stored_tree) if stored_tree else None
+    if folder_tree is not None and folder_tree.root_id != OBSIDIAN_VAULT_FOLDER_ID: folder_tree = None # Cambió la carpeta de la bóveda
+    if page_token and folder_tree is not None:
+        job.progress(message="Consultando cambios en Google Drive...")
         try:
-            perform_drive_sync_and_reindex(new_db)
-        finally:
-            new_db.close()
+            changes, new_page_token = drive.list_changes(page_token)
+            files_by_id, removed_file_ids, new_folder_ids, needs_rescan = classify_changes(changes, folder_tree)
+            if needs_rescan:
+                print("Se renombró, movió o eliminó una carpeta de la bóveda; se hará una sincronización completa.")
+            else:
+                if new_folder_ids:
+                    # Una carpeta movida desde fuera de la bóveda no trae cambios de sus ficheros: se lista su contenido
+                    new_folder_files, _ = list_vault_files(drive, OBSIDIAN_VAULT_FOLDER_ID, tree=folder_tree, start_folder_ids=new_folder_ids)
+                    for item_meta in new_folder_files: files_by_id[item_meta["id"]] = item_meta; removed_file_ids.discard(item_meta["id"])
+                print(f"Sincronización incremental: {len(changes)} cambios, {len(files_by_id)} archivos a procesar.")
+                return list(files_by_id.values()), list(removed_file_ids), new_page_token, folder_tree
+        except Exception as e_changes:
+            print(f"No se pudo leer el feed de cambios ({e_changes}); se hará una sincronización completa.")
+    # El token se pide antes de listar para no perder cambios hechos durante el listado
+    new_page_token = drive.get_start_page_token()
+    job.progress(message="Recorriendo las carpetas de la bóveda en Google Drive...")
+    all_files_meta, folder_tree = list_vault_files(drive, OBSIDIAN_VAULT_FOLDER_ID)
+    print(f"Bóveda: {len(all_files_meta)} archivos Markdown en {len(folder_tree.folders)} carpetas.")
+    listed_ids = {f["id"] for f in all_files_meta}
+    return all_files_meta, [note_id for (note_id,) in db.query(Note.id) if note_id not in listed_ids], new_page_token, folder_tree
 
-    background_tasks.add_task(sync_with_new_db_session)
-    return {"message": "Sincronización con Google Drive iniciada en segundo plano."}
+def run_sync_job(job_id: int, drive: Optional[DriveClient] = None):
+    """Ejecuta (o reanuda) un trabajo en este worker con su propia sesión. No hace nada si lo ha tomado otro."""
+    runner = SyncJobRunner(SessionLocal, job_id)
+    if not runner.claim(): print(f"El trabajo de sincronización {job_id} ya lo ejecuta otro worker."); return
+    db = SessionLocal()
+    try: perform_drive_sync_and_reindex(db, drive=drive, job=runner)
+    finally: db.close()
+
+def resume_interrupted_sync_job(retry: bool = True):
+    """Al arrancar: reanuda un trabajo cuyo worker murió. Si su lease aún no ha caducado, se vuelve a mirar cuando caduque."""
+    db = SessionLocal()
+    try: job = active_job(db)
+    finally: db.close()
+    if job is None: return
+    if is_resumable(job) or job.owner is None:
+        print(f"Reanudando la sincronización {job.id} interrumpida..."); threading.Thread(target=run_sync_job, args=(job.id,), daemon=True).start()
+    elif retry:
+        wait_s = max(0.0, (job.lease_expires_at - sync_utcnow()).total_seconds()) + 1
+        timer = threading.Timer(wait_s, resume_interrupted_sync_job, kwargs={"retry": False}); timer.daemon = True; timer.start()
+
+# --- Google Drive Sync Endpoint (ahora asíncrono) ---
+@app.post("/api/drive/sync", tags=["Google Drive"]) # Cambiado a POST para iniciar una acción
+def trigger_drive_sync(background_tasks: BackgroundTasks, full: bool = False, db: Session = Depends(get_db)):
+    # El trabajo se registra en la BD: el índice único de trabajos activos evita dos sincronizaciones aunque
+    # la petición llegue a otro worker. La tarea en segundo plano abre su propia sesión (esta se cierra al responder).
+    try: job, resumed = enqueue_job(db, full)
+    except SyncJobConflict as e: raise HTTPException(status_code=409, detail=str(e))
+    background_tasks.add_task(run_sync_job, job.id)
+    if resumed: return {"message": "Reanudando la sincronización interrumpida en segundo plano.", "job_id": job.id}
+    return {"message": "Sincronización con Google Drive iniciada en segundo plano.", "job_id": job.id}
 
 @app.get("/api/drive/sync_status", tags=["Google Drive"])
-async def get_sync_status():
-    global sync_task_status
-    return sync_task_status
+def get_sync_status(db: Session = Depends(get_db)):
+    return job_status(db)
 # --- Fin Google Drive Sync Endpoint ---
 
 
 # --- Endpoints /api/notes y /api/simple_search (sin cambios) ---
-@app.get("/api/notes", response_model=TypingList[NoteResponse], tags=["Notas"])
-async def get_notes_from_db(db: Session = Depends(get_db), skip: int = 0, limit: int = 100): # ...
-    notes = db.query(Note).order_by(Note.drive_modified_time.desc().nullslast(), Note.title).offset(skip).limit(limit).all(); return notes
-class SearchQuery(PydanticBaseModel): query: str; limit: Optional[int] = 10
-@app.post("/api/simple_search", response_model=TypingList[NoteResponse], tags=["Búsqueda"])
-async def simple_search_notes(search_query: SearchQuery, db: Session = Depends(get_db)): # ...
-    query_str = f"%{search_query.query}%"; notes = db.query(Note).filter(sql_or_(Note.title.ilike(query_str), Note.content.ilike(query_str))).order_by(Note.drive_modified_time.desc().nullslast(), Note.title).limit(search_query.limit).all(); return notes
+class TagResponse(PydanticBaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int; name: str
+class NoteResponse(PydanticBaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: str; title: Optional[str] = None; path: Optional[str] = None; content: Optional[str] = None
+    created_at: Optional[datetime] = None; modified_at: Optional[datetime] = None
+    drive_modified_time: Optional[datetime] = None; source_url: Optional[str] = None; word_count: Optional[int] = None
+    tags: TypingList[TagResponse] = []
+def folder_path_range(folder: str) -> tuple[str, str]:
+    """Rango de Note.path de las notas dentro de `folder` (y sus subcarpetas): desde 'carpeta/' hasta
+    'carpeta0' ('0' es el carácter siguiente a '/'). Como rango usa el índice; un LIKE 'prefijo%' no lo usaría en SQLite."""
+    prefix = folder.strip("/") + "/"
+    return prefix, prefix[:-1] + "0"
+def in_folder(folder: str):
+    path_from, path_to = folder_path_range(folder)
+    return sql_and_(Note.path >= path_from, Note.path < path_to)
+NOTES_PAGE_MAX_LIMIT = 500
+class NoteListItem(NoteResponse):
+    excerpt: Optional[str] = None # Principio del contenido (solo si se pide en `fields`)
+@app.get("/api/notes", response_model=TypingList[NoteListItem], response_model_exclude_unset=True, tags=["Notas"])
+def get_notes_from_db(response: Response, db: Session = Depends(get_db), skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                      fields: Optional[str] = None, folder: Optional[str] = None): # ...
+    """Notas de la más a la menos reciente. La página siguiente se pide con el cursor de la cabecera X-Next-Cursor
+    (`skip` sigue funcionando, pero con OFFSET). `fields` (p. ej. "title,excerpt,tags") limita los campos devueltos;
+    el contenido completo de una nota está en /api/notes/{id}."""
+    limit = max(1, min(limit, NOTES_PAGE_MAX_LIMIT))
+    try: selected_fields, page_cursor = parse_fields(fields), decode_cursor(cursor) if cursor else None
+    except (ValueError, InvalidCursor) as e: raise HTTPException(status_code=400, detail=str(e))
+    notes_query = projected_query(db, selected_fields) if selected_fields else with_tags(db.query(Note))
+    if folder and folder.strip("/"): notes_query = notes_query.filter(in_folder(folder))
+    if skip and page_cursor is None: rows = notes_query.order_by(Note.drive_modified_time.desc(), Note.title, Note.id).offset(skip).limit(limit).all()
+    else: rows = keyset_page(notes_query, page_cursor, limit)
+    if len(rows) == limit: response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].drive_modified_time, rows[-1].title, rows[-1].id)
+    return project_rows(db, rows, selected_fields) if selected_fields else rows
+@app.get("/api/notes/{note_id}", response_model=NoteResponse, tags=["Notas"])
+def get_note_detail(note_id: str, db: Session = Depends(get_db)):
+    """Nota completa (con contenido) para la vista de detalle."""
+    note = with_tags(db.query(Note)).filter(Note.id == note_id).first()
+    if note is None: raise HTTPException(status_code=404, detail="Nota no encontrada.")
+    return note
+class SearchQuery(PydanticBaseModel): query: str; limit: Optional[int] = 10; folder: Optional[str] = None
+class SimpleSearchResult(NoteResponse):
+    # Solo con el índice FTS5: relevancia BM25 (mayor es mejor) y coincidencias resaltadas con <mark>
+    score: Optional[float] = None; title_highlight: Optional[str] = None; snippet: Optional[str] = None
+fulltext_ready: Optional[bool] = None
+@app.post("/api/simple_search", response_model=TypingList[SimpleSearchResult], tags=["Búsqueda"])
+def simple_search_notes(search_query: SearchQuery, db: Session = Depends(get_db)): # ...
+    global fulltext_ready
+    if fulltext_ready is None:
+        fulltext_ready = fulltext_available(db)
+        if not fulltext_ready: print("Índice FTS5 no encontrado (ejecuta `alembic upgrade head`); la búsqueda simple usará LIKE.")
+    folder = search_query.folder if search_query.folder and search_query.folder.strip("/") else None
+    if fulltext_ready and build_match_query(search_query.query):
+        hits = search_fulltext(db, search_query.query, search_query.limit, [in_folder(folder)] if folder else [])
+        db_notes = load_notes(db, [hit.note_id for hit in hits])
+        return [SimpleSearchResult(**NoteResponse.model_validate(db_notes[hit.note_id]).model_dump(), score=hit.score,
+                                   title_highlight=hit.title_highlight, snippet=hit.snippet) for hit in hits if hit.note_id in db_notes]
+    query_str = f"%{search_query.query}%"; notes_query = with_tags(db.query(Note)).filter(sql_or_(Note.title.ilike(query_str), Note.content.ilike(query_str)))
+    if folder: notes_query = notes_query.filter(in_folder(folder))
+    notes = notes_query.order_by(Note.drive_modified_time.desc().nullslast(), Note.title).limit(search_query.limit).all(); return notes
+class TagFacetResponse(PydanticBaseModel):
+    name: str; count: int # Notas con el tag
+@app.get("/api/tags", response_model=TypingList[TagFacetResponse], tags=["Notas"])
+def get_tag_facets(prefix: Optional[str] = None, limit: Optional[int] = None):
+    """Tags con su número de notas, de más a menos usados. Las cuentas salen del índice de filtros en memoria, sin GROUP BY."""
+    return note_filter_index.get().tag_facets(prefix, limit)
 # --- Fin Endpoints /api/notes y /api/simple_search ---
 
 # --- Endpoint de Búsqueda de Conocimiento (FAISS) (sin cambios) ---
-class KnowledgeSearchQuery(PydanticBaseModel): query: str; k: Optional[int] = Field(default=5, gt=0, le=50)
+class KnowledgeSearchQuery(PydanticBaseModel):
+    query: str; k: Optional[int] = Field(default=5, gt=0, le=50)
+    # Ajustes de precisión/latencia por petición para índices aproximados (se ignoran en flat)
+    nprobe: Optional[int] = Field(default=None, gt=0, le=4096); ef_search: Optional[int] = Field(default=None, gt=0, le=4096)
+    folder: Optional[str] = None # Limita la búsqueda a una carpeta de la bóveda (incluye subcarpetas)
+    # Filtros aplicados dentro de FAISS; con varios tags la nota debe tenerlos todos
+    tags: Optional[TypingList[str]] = None; modified_after: Optional[datetime] = None; modified_before: Optional[datetime] = None
+    projection: str = Field(default="full", pattern="^(full|compact)$") # "compact": sin el contenido completo de cada nota
 async def verify_api_token(x_api_token: str = Header(None)): # ...
     if not API_BEARER_TOKEN: print("ADVERTENCIA: API_BEARER_TOKEN no configurado."); return
     if not x_api_token or x_api_token != API_BEARER_TOKEN: raise HTTPException(status_code=401, detail="Token API inválido o faltante.")
-@app.post("/api/knowledge-search", response_model=TypingList[NoteResponse], tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+class ChunkResponse(PydanticBaseModel):
+    chunk_index: int; heading: Optional[str] = None; text: str
+    start_offset: int; end_offset: int; score: float
+class KnowledgeSearchResult(NoteResponse):
+    score: float # Similitud coseno del mejor fragmento de la nota
+    chunks: TypingList[ChunkResponse] = []
+COMPACT_SNIPPET_CHARS = 300
+class CompactSearchResult(PydanticBaseModel):
+    """Proyección ligera de un resultado: sin el cuerpo de la nota ni la lista de fragmentos."""
+    id: str; title: Optional[str] = None; path: Optional[str] = None; source_url: Optional[str] = None
+    score: float; snippet: Optional[str] = None; tags: TypingList[str] = []
+def compact_result(note: Note, score: float, snippet: Optional[str]) -> CompactSearchResult:
+    return CompactSearchResult(id=note.id, title=note.title, path=note.path, source_url=note.source_url, score=score,
+                               snippet=snippet, tags=[tag.name for tag in note.tags])
+def note_filter_conditions(tags: Optional[TypingList[str]] = None, modified_after: Optional[datetime] = None,
+                           modified_before: Optional[datetime] = None, folder: Optional[str] = None) -> list:
+    """Condiciones SQLAlchemy sobre Note para los filtros de búsqueda. Con varios tags la nota debe tenerlos todos."""
+    conditions = []
+    tag_names = sorted({tag.lstrip("#") for tag in tags or [] if tag.strip("# ")})
+    if tag_names:
+        tagged_note_ids = (select(note_tags_table.c.note_id).join(Tag, Tag.id == note_tags_table.c.tag_id).where(Tag.name.in_(tag_names))
+                           .group_by(note_tags_table.c.note_id).having(func.count(distinct(Tag.id)) == len(tag_names)))
+        conditions.append(Note.id.in_(tagged_note_ids))
+    if modified_after: conditions.append(Note.drive_modified_time >= modified_after)
+    if modified_before: conditions.append(Note.drive_modified_time < modified_before)
+    if folder and folder.strip("/"): conditions.append(in_folder(folder))
+    return conditions
+def filtered_chunk_ids(tags: Optional[TypingList[str]] = None, modified_after: Optional[datetime] = None,
+                       modified_before: Optional[datetime] = None, folder: Optional[str] = None) -> Optional[np.ndarray]:
+    """Los mismos filtros que note_filter_conditions, resueltos con el índice en memoria (ids de fragmento; None = sin filtros)."""
+    path_range = folder_path_range(folder) if folder and folder.strip("/") else None
+    with span("filter_index"): return note_filter_index.get().allowed_chunk_ids(tags, modified_after, modified_before, path_range)
+
+async def get_query_embedding(query_text: str) -> Optional[TypingList[float]]:
+    """Embedding de una consulta de búsqueda, reutilizando el de consultas equivalentes ya vistas (sin bloquear el event loop)."""
+    return await query_embedding_cache.aget_or_compute(query_text, get_default_embedder().model_name, get_embedding_async)
+
+def ensure_faiss_index() -> bool:
+    """True si hay un índice publicado; si no, lanza su construcción (sin esperarla)."""
+    snapshot = index_manager.current
+    if snapshot is not None and snapshot.ntotal > 0: return True
+    if not index_manager.is_building: rebuild_faiss_index_in_background("Índice FAISS no disponible.")
+    return False
+
+def semantic_note_search(db: Session, query_vector: TypingList[float], k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                         conditions: Optional[list] = None, chunk_ids: Optional[np.ndarray] = None) -> tuple[TypingList[Any], Dict[int, Any]]:
+    """Busca en FAISS y agrupa por nota. Devuelve (NoteHits de mejor a peor, filas de NoteChunk por id).
+
+    Los filtros se traducen a un selector de ids de fragmento, de modo que FAISS solo
+    puntúa fragmentos de notas que los cumplen en lugar de filtrar después. Los ids
+    permitidos llegan ya resueltos (`chunk_ids`, de filtered_chunk_ids) o se obtienen
+    de la BD a partir de condiciones sobre Note (`conditions`).
+    """
+    note_hits, chunk_rows = semantic_note_search_batch(db, [query_vector], k, nprobe, ef_search, conditions, chunk_ids)
+    return note_hits[0], chunk_rows
+
+def semantic_note_search_batch(db: Session, query_vectors: TypingList[TypingList[float]], k: int, nprobe: Optional[int] = None,
+                               ef_search: Optional[int] = None, conditions: Optional[list] = None,
+                               chunk_ids: Optional[np.ndarray] = None) -> tuple[TypingList[TypingList[Any]], Dict[int, Any]]:
+    """Como semantic_note_search para varias consultas: una búsqueda matricial en FAISS y una sola lectura de fragmentos.
+
+    Devuelve los NoteHits de cada consulta (en el orden de `query_vectors`) y las filas de NoteChunk de todas.
+    """
+    empty = [[] for _ in query_vectors]
+    vector_index = current_vector_index() # Las publicaciones no le afectan; un cambio incremental en el sitio espera a que termine cada búsqueda
+    if vector_index is None or not query_vectors: return empty, {}
+    query_np = np.array(query_vectors).astype('float32'); faiss.normalize_L2(query_np)
+    selector, candidates = None, vector_index.ntotal
+    if chunk_ids is None and conditions:
+        chunk_ids = np.array([chunk_id for (chunk_id,) in db.query(NoteChunk.id).join(Note, Note.id == NoteChunk.note_id).filter(*conditions)], dtype=np.int64)
+    if chunk_ids is not None:
+        if not len(chunk_ids): return empty, {}
+        selector, candidates = vector_index.id_selector(chunk_ids), len(chunk_ids)
+    # Se piden más fragmentos que notas; las consultas que no cubren k notas distintas se repiten ampliando la búsqueda
+    searches: TypingList[tuple] = [([], [])] * len(query_vectors); pending = list(range(len(query_vectors)))
+    with span("faiss_search"):
+        for chunk_k, is_last in overfetch_sizes(k, candidates):
+            for row, found in zip(pending, vector_index.search_ids_batch(query_np[pending], chunk_k, nprobe=nprobe, ef_search=ef_search, selector=selector)):
+                searches[row] = found
+            pending = [row for row in pending if len({vector_index.id_to_note_id.get(i) for i in searches[row][1]}) < k]
+            if is_last or not pending: break
+    found_chunk_ids = list(dict.fromkeys(i for _, ids in searches for i in ids))
+    if not found_chunk_ids: return empty, {}
+    with span("db_chunks"):
+        chunk_rows = {row.id: row for start in range(0, len(found_chunk_ids), HYDRATION_BATCH_SIZE)
+                      for row in db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.chunk_index, NoteChunk.heading, NoteChunk.text, NoteChunk.start_offset,
+                                          NoteChunk.end_offset).filter(NoteChunk.id.in_(found_chunk_ids[start:start + HYDRATION_BATCH_SIZE]))}
+    note_hits = []
+    for distances, ids in searches:
+        hits = [ChunkHit(chunk_id=i, note_id=chunk_rows[i].note_id, score=l2_to_cosine(d), start=chunk_rows[i].start_offset, end=chunk_rows[i].end_offset)
+                for d, i in zip(distances, ids) if i in chunk_rows]
+        note_hits.append(aggregate_chunk_hits(hits, k))
+    return note_hits, chunk_rows
+
+def chunk_responses(note_hit, chunk_rows: Dict[int, Any]) -> TypingList[ChunkResponse]:
+    return [ChunkResponse(chunk_index=chunk_rows[h.chunk_id].chunk_index, heading=chunk_rows[h.chunk_id].heading, text=chunk_rows[h.chunk_id].text,
+                          start_offset=h.start, end_offset=h.end, score=h.score) for h in note_hit.chunks]
+
+def knowledge_search_results(db: Session, query: KnowledgeSearchQuery, query_vector: TypingList[float]) -> list:
+    """Parte bloqueante de /api/knowledge-search (FAISS + BD); se ejecuta en el pool de hilos."""
+    allowed_chunk_ids = filtered_chunk_ids(query.tags, query.modified_after, query.modified_before, query.folder)
+    note_hits, chunk_rows = semantic_note_search(db, query_vector, query.k, query.nprobe, query.ef_search, chunk_ids=allowed_chunk_ids)
+    compact = query.projection == "compact"
+    with span("db_hydration"): db_notes = load_notes(db, [h.note_id for h in note_hits], with_content=not compact)
+    return knowledge_results(note_hits, chunk_rows, db_notes, compact)
+
+def knowledge_results(note_hits, chunk_rows: Dict[int, Any], db_notes: Dict[str, Note], compact: bool) -> list:
+    results = []
+    for note_hit in note_hits: # note_hits ya viene ordenado por puntuación
+        note = db_notes.get(note_hit.note_id)
+        if note is None: continue
+        if compact: results.append(compact_result(note, note_hit.score, excerpt(chunk_rows[note_hit.chunks[0].chunk_id].text, COMPACT_SNIPPET_CHARS)))
+        else: results.append(KnowledgeSearchResult(**NoteResponse.model_validate(note).model_dump(), score=note_hit.score, chunks=chunk_responses(note_hit, chunk_rows)))
+    return results
+
+@app.post("/api/knowledge-search", response_model=TypingList[Union[KnowledgeSearchResult, CompactSearchResult]], tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
 async def knowledge_search(query: KnowledgeSearchQuery, db: Session = Depends(get_db)): # ...
-    global faiss_index, faiss_id_to_note_id_map
-    if faiss_index is None or faiss_index.ntotal == 0:
-        print("Índice FAISS no disponible/vacío, intentando reconstruir..."); build_or_load_faiss_index(db)
-        if faiss_index is None or faiss_index.ntotal == 0: raise HTTPException(status_code=503, detail="Índice de búsqueda no disponible.")
-    query_embedding_vector = get_embedding(query.query)
+    # El event loop solo espera: el embedding es una llamada asíncrona y FAISS/BD van al pool de hilos
+    if not ensure_faiss_index(): raise HTTPException(status_code=503, detail="Índice de búsqueda no disponible.")
+    cache_key = ("knowledge", normalize_query(query.query), query.k, query.nprobe, query.ef_search, query.folder, tuple(sorted(query.tags or [])),
+                 query.modified_after, query.modified_before, query.projection, faiss_index_version)
+    cached = search_result_cache.get(cache_key)
+    if cached is not None: return cached
+    query_embedding_vector = await get_query_embedding(query.query)
     if not query_embedding_vector: raise HTTPException(status_code=400, detail="No se pudo generar embedding para la consulta.")
-    query_np = np.array([query_embedding_vector]).astype('float32'); faiss.normalize_L2(query_np)
-    actual_k = min(query.k, faiss_index.ntotal);
-    if actual_k == 0: return []
-    distances, indices = faiss_index.search(query_np, actual_k)
-    found_note_ids = [faiss_id_to_note_id_map[i] for i in indices[0]]
-    if not found_note_ids: return []
-    db_notes = db.query(Note).filter(Note.id.in_(found_note_ids)).all()
-    ordered_notes = sorted(db_notes, key=lambda note: found_note_ids.index(note.id)); return ordered_notes
+    results = await run_in_threadpool(knowledge_search_results, db, query, query_embedding_vector)
+    search_result_cache.put(cache_key, results)
+    return results
+
+# --- Búsqueda de conocimiento por lotes ---
+KNOWLEDGE_BATCH_MAX_QUERIES = int(os.getenv("KNOWLEDGE_BATCH_MAX_QUERIES", "20"))
+class KnowledgeBatchQuery(PydanticBaseModel):
+    queries: TypingList[str] = Field(min_length=1, max_length=KNOWLEDGE_BATCH_MAX_QUERIES)
+    # El resto de parámetros es común a todas las consultas (mismo significado que en /api/knowledge-search)
+    k: Optional[int] = Field(default=5, gt=0, le=50)
+    nprobe: Optional[int] = Field(default=None, gt=0, le=4096); ef_search: Optional[int] = Field(default=None, gt=0, le=4096)
+    folder: Optional[str] = None
+    tags: Optional[TypingList[str]] = None; modified_after: Optional[datetime] = None; modified_before: Optional[datetime] = None
+    projection: str = Field(default="full", pattern="^(full|compact)$")
+    dedupe: bool = False # Cada nota aparece solo en la consulta en la que puntúa mejor
+class KnowledgeBatchResult(PydanticBaseModel):
+    query: str; results: TypingList[Union[KnowledgeSearchResult, CompactSearchResult]]
+
+async def get_query_embeddings(queries: TypingList[str]) -> TypingList[Optional[TypingList[float]]]:
+    """Embeddings de varias consultas: las que no están en caché se piden a OpenAI en una sola llamada."""
+    return await query_embedding_cache.aget_or_compute_many(queries, get_default_embedder().model_name, get_embeddings_async)
+
+def knowledge_search_batch_results(db: Session, query: KnowledgeBatchQuery, query_vectors: TypingList[TypingList[float]]) -> TypingList[KnowledgeBatchResult]:
+    """Parte bloqueante de /api/knowledge-search/batch: una búsqueda matricial en FAISS y una hidratación para la unión de notas."""
+    allowed_chunk_ids = filtered_chunk_ids(query.tags, query.modified_after, query.modified_before, query.folder)
+    # Con dedupe otra consulta puede quedarse con cualquiera de las notas de esta: se buscan las suficientes para seguir teniendo k
+    search_k = query.k * len(query.queries) if query.dedupe else query.k
+    note_hits, chunk_rows = semantic_note_search_batch(db, query_vectors, search_k, query.nprobe, query.ef_search, chunk_ids=allowed_chunk_ids)
+    note_hits = dedupe_across_queries(note_hits, query.k) if query.dedupe else note_hits
+    compact = query.projection == "compact"
+    with span("db_hydration"): db_notes = load_notes(db, [h.note_id for hits in note_hits for h in hits], with_content=not compact)
+    return [KnowledgeBatchResult(query=text, results=knowledge_results(hits, chunk_rows, db_notes, compact)) for text, hits in zip(query.queries, note_hits)]
+
+@app.post("/api/knowledge-search/batch", response_model=TypingList[KnowledgeBatchResult], tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+async def knowledge_search_batch(query: KnowledgeBatchQuery, db: Session = Depends(get_db)):
+    """Varias búsquedas semánticas con los mismos filtros en una sola petición; devuelve los resultados de cada consulta en orden."""
+    if not ensure_faiss_index(): raise HTTPException(status_code=503, detail="Índice de búsqueda no disponible.")
+    cache_key = ("knowledge_batch", tuple(normalize_query(text) for text in query.queries), query.k, query.nprobe, query.ef_search, query.folder,
+                 tuple(sorted(query.tags or [])), query.modified_after, query.modified_before, query.projection, query.dedupe, faiss_index_version)
+    cached = search_result_cache.get(cache_key)
+    if cached is not None: return cached
+    query_vectors = await get_query_embeddings(query.queries)
+    failed = [position for position, vector in enumerate(query_vectors) if not vector]
+    if failed: raise HTTPException(status_code=400, detail=f"No se pudo generar embedding para las consultas en las posiciones {failed}.")
+    results = await run_in_threadpool(knowledge_search_batch_results, db, query, query_vectors)
+    search_result_cache.put(cache_key, results)
+    return results
+
+# --- Búsqueda híbrida (léxica + semántica) ---
+HYBRID_STAGE_CANDIDATES = int(os.getenv("HYBRID_STAGE_CANDIDATES", "50")) # Resultados que aporta cada etapa antes de fusionar
+class HybridSearchQuery(PydanticBaseModel):
+    query: str; k: Optional[int] = Field(default=10, gt=0, le=50)
+    fusion: str = Field(default="rrf", pattern="^(rrf|weighted)$") # "rrf" (por posición) o "weighted" (puntuaciones normalizadas)
+    semantic_weight: float = Field(default=0.5, ge=0.0, le=1.0) # El peso léxico es 1 - semantic_weight
+    # Filtros aplicados en cada etapa antes de puntuar
+    tags: Optional[TypingList[str]] = None; modified_after: Optional[datetime] = None; modified_before: Optional[datetime] = None
+    folder: Optional[str] = None
+    nprobe: Optional[int] = Field(default=None, gt=0, le=4096); ef_search: Optional[int] = Field(default=None, gt=0, le=4096)
+    projection: str = Field(default="full", pattern="^(full|compact)$")
+class HybridSearchResult(NoteResponse):
+    score: float # Puntuación fusionada
+    semantic_score: Optional[float] = None; semantic_rank: Optional[int] = None
+    lexical_score: Optional[float] = None; lexical_rank: Optional[int] = None
+    snippet: Optional[str] = None; chunks: TypingList[ChunkResponse] = []
+class HybridSearchResponse(PydanticBaseModel):
+    results: TypingList[Union[HybridSearchResult, CompactSearchResult]]
+    timings_ms: Dict[str, float] # Tiempo de cada etapa; lexical y semantic se ejecutan en paralelo
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+@app.post("/api/hybrid-search", response_model=HybridSearchResponse, tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+async def hybrid_search(query: HybridSearchQuery): # ...
+    """Búsqueda léxica (FTS5) y semántica (FAISS) en paralelo, fusionadas en un único ranking."""
+    total_start = time.perf_counter(); timings: Dict[str, float] = {}
+    cache_key = ("hybrid", normalize_query(query.query), query.k, query.fusion, query.semantic_weight, tuple(sorted(query.tags or [])),
+                 query.modified_after, query.modified_before, query.folder, query.nprobe, query.ef_search, query.projection, faiss_index_version)
+    cached_results = search_result_cache.get(cache_key)
+    if cached_results is not None: return HybridSearchResponse(results=cached_results, timings_ms={"result_cache_ms": _elapsed_ms(total_start), "total_ms": _elapsed_ms(total_start)})
+    conditions = note_filter_conditions(query.tags, query.modified_after, query.modified_before, query.folder)
+    candidates = max(query.k, HYBRID_STAGE_CANDIDATES)
+
+    def lexical_stage():
+        start = time.perf_counter(); stage_db = SessionLocal()
+        try:
+            global fulltext_ready
+            if fulltext_ready is None: fulltext_ready = fulltext_available(stage_db)
+            if not fulltext_ready or not build_match_query(query.query): return []
+            with span("fts_search"): return search_fulltext(stage_db, query.query, candidates, conditions)
+        finally: stage_db.close(); timings["lexical_ms"] = _elapsed_ms(start)
+
+    def faiss_stage(query_vector: TypingList[float]):
+        search_start = time.perf_counter(); stage_db = SessionLocal()
+        try:
+            if not ensure_faiss_index(): return [], {}
+            allowed_chunk_ids = filtered_chunk_ids(query.tags, query.modified_after, query.modified_before, query.folder)
+            return semantic_note_search(stage_db, query_vector, candidates, query.nprobe, query.ef_search, chunk_ids=allowed_chunk_ids)
+        finally: stage_db.close(); timings["faiss_ms"] = _elapsed_ms(search_start)
+
+    async def semantic_stage():
+        start = time.perf_counter()
+        try:
+            query_vector = await get_query_embedding(query.query); timings["embedding_ms"] = _elapsed_ms(start)
+            if not query_vector: return [], {}
+            return await run_in_threadpool(faiss_stage, query_vector)
+        finally: timings["semantic_ms"] = _elapsed_ms(start)
+
+    lexical_hits, (note_hits, chunk_rows) = await asyncio.gather(run_in_threadpool(lexical_stage), semantic_stage())
+
+    fusion_start = time.perf_counter()
+    weights = {"semantic": query.semantic_weight, "lexical": 1.0 - query.semantic_weight}
+    if query.fusion == "rrf":
+        fused = reciprocal_rank_fusion({"semantic": [h.note_id for h in note_hits], "lexical": [h.note_id for h in lexical_hits]}, weights)
+    else:
+        fused = weighted_score_fusion({"semantic": {h.note_id: h.score for h in note_hits}, "lexical": {h.note_id: h.score for h in lexical_hits}}, weights)
+    fused = fused[:query.k]
+    timings["fusion_ms"] = _elapsed_ms(fusion_start)
+
+    def hydrate():
+        db = SessionLocal()
+        try:
+            with span("db_hydration"): db_notes = load_notes(db, [note_id for note_id, _ in fused], with_content=not compact)
+            semantic_by_id = {h.note_id: (rank, h) for rank, h in enumerate(note_hits, start=1)}
+            lexical_by_id = {h.note_id: (rank, h) for rank, h in enumerate(lexical_hits, start=1)}
+            results = []
+            for note_id, fused_score in fused:
+                note = db_notes.get(note_id)
+                if note is None: continue
+                semantic_rank, note_hit = semantic_by_id.get(note_id, (None, None))
+                lexical_rank, lexical_hit = lexical_by_id.get(note_id, (None, None))
+                if compact:
+                    snippet = lexical_hit.snippet if lexical_hit else excerpt(chunk_rows[note_hit.chunks[0].chunk_id].text, COMPACT_SNIPPET_CHARS)
+                    results.append(compact_result(note, fused_score, snippet)); continue
+                results.append(HybridSearchResult(**NoteResponse.model_validate(note).model_dump(), score=fused_score,
+                                                  semantic_score=note_hit.score if note_hit else None, semantic_rank=semantic_rank,
+                                                  lexical_score=lexical_hit.score if lexical_hit else None, lexical_rank=lexical_rank,
+                                                  snippet=lexical_hit.snippet if lexical_hit else None,
+                                                  chunks=chunk_responses(note_hit, chunk_rows) if note_hit else []))
+            return results
+        finally: db.close()
+
+    hydration_start = time.perf_counter(); compact = query.projection == "compact"
+    results = await run_in_threadpool(hydrate)
+    search_result_cache.put(cache_key, results)
+    timings["hydration_ms"] = _elapsed_ms(hydration_start); timings["total_ms"] = _elapsed_ms(total_start)
+    return HybridSearchResponse(results=results, timings_ms=timings)
+@app.get("/api/cache/stats", tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+async def get_cache_stats():
+    """Contadores de aciertos/fallos de la caché de embeddings de consultas y de la de resultados."""
+    return {"query_embeddings": query_embedding_cache.stats(), "search_results": search_result_cache.stats(), "filter_index": note_filter_index.stats(),
+            "faiss_index_version": faiss_index_version}
+@app.get("/api/metrics", response_class=PlainTextResponse, tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+async def get_metrics():
+    """Histogramas y contadores de este proceso en formato de texto de Prometheus."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+@app.get("/api/index/status", tags=["Búsqueda Avanzada"], dependencies=[Depends(verify_api_token)])
+async def get_index_status():
+    """Versión publicada del índice FAISS, reconstrucción en segundo plano en curso y snapshot en disco."""
+    return index_manager.status()
 # --- Fin Endpoint Búsqueda de Conocimiento ---
 
 # --- Chat AI Endpoint (sin cambios significativos) ---
-class ChatRequest(PydanticBaseModel): message: str; relevant_notes_content: Optional[TypingList[str]] = None
-class ChatMsgResponse(PydanticBaseModel): reply: str
+CHAT_MODEL = "gpt-3.5-turbo"
+CHAT_CONTEXT_NOTES = int(os.getenv("CHAT_CONTEXT_NOTES", "8")) # Notas recuperadas de FAISS como candidatas para el contexto
+class ChatRequest(PydanticBaseModel):
+    message: str
+    # El contexto se recupera en el servidor; `note_ids` limita la recuperación a esas notas
+    note_ids: Optional[TypingList[str]] = Field(default=None, max_length=100)
+    conversation_id: Optional[str] = None # Reutiliza el contexto empaquetado al repetir un turno (p. ej. reintentos)
+    relevant_notes_content: Optional[TypingList[str]] = None # Obsoleto: texto enviado por el cliente, también limitado por el presupuesto
+class ChatSource(PydanticBaseModel):
+    id: str; title: Optional[str] = None; path: Optional[str] = None; heading: Optional[str] = None; score: float
+class ChatMsgResponse(PydanticBaseModel):
+    reply: str; sources: TypingList[ChatSource] = []; context_tokens: int = 0
 if not os.getenv("OPENAI_API_KEY"): print("ADVERTENCIA: OPENAI_API_KEY no encontrada.")
+
+def retrieve_chat_passages(query_vector: TypingList[float], note_ids: Optional[TypingList[str]]) -> TypingList[Passage]:
+    """Mejores fragmentos de FAISS para la pregunta (bloqueante: se ejecuta en el pool de hilos)."""
+    db = SessionLocal()
+    try:
+        if not ensure_faiss_index(): return []
+        conditions = [Note.id.in_(note_ids)] if note_ids else None
+        note_hits, chunk_rows = semantic_note_search(db, query_vector, CHAT_CONTEXT_NOTES, conditions=conditions)
+        notes = {row.id: row for row in db.query(Note.id, Note.title, Note.path).filter(Note.id.in_([h.note_id for h in note_hits]))}
+        return [Passage(note_id=h.note_id, text=chunk_rows[c.chunk_id].text, score=c.score, title=notes[h.note_id].title, path=notes[h.note_id].path,
+                        heading=chunk_rows[c.chunk_id].heading, start=c.start, end=c.end)
+                for h in note_hits if h.note_id in notes for c in h.chunks]
+    finally: db.close()
+
+async def build_chat_context(request: ChatRequest) -> PackedContext:
+    note_ids = sorted(set(request.note_ids or []))
+    client_contents = [content for content in request.relevant_notes_content or [] if content and content.strip()]
+    cache_key = ("chat_context", request.conversation_id, normalize_query(request.message), tuple(note_ids),
+                 hashlib.sha1("\0".join(client_contents).encode("utf-8")).hexdigest() if client_contents else None, faiss_index_version)
+    packed = chat_context_cache.get(cache_key)
+    if packed is not None: return packed
+    passages: TypingList[Passage] = []
+    query_vector = await get_query_embedding(request.message)
+    if query_vector: passages = await run_in_threadpool(retrieve_chat_passages, query_vector, note_ids or None)
+    else: print("Chat: no se pudo generar el embedding de la pregunta; se responde sin contexto recuperado.")
+    passages += [Passage(note_id=f"cliente-{i}", text=content, score=0.0) for i, content in enumerate(client_contents)]
+    packed = pack_context(passages, CHAT_CONTEXT_MAX_TOKENS)
+    chat_context_cache.put(cache_key, packed)
+    return packed
+
+def chat_prompt_messages(request: ChatRequest, context: PackedContext) -> TypingList[Dict[str, str]]:
+    context_str = "\n\nContexto (fragmentos de mis notas):\n" + context.text if context.text else ""
+    return [{"role": "system", "content": "Eres un asistente útil. Usa el contexto de las notas del usuario cuando sea relevante."},
+            {"role": "user", "content": request.message + context_str}]
+
+def chat_sources(context: PackedContext) -> TypingList[ChatSource]:
+    sources: Dict[str, ChatSource] = {}
+    for passage in context.passages:
+        if passage.note_id.startswith("cliente-"): continue
+        source = sources.get(passage.note_id)
+        if source is None: sources[passage.note_id] = ChatSource(id=passage.note_id, title=passage.title, path=passage.path, heading=passage.heading, score=passage.score)
+        elif passage.score > source.score: source.score = passage.score
+    return sorted(sources.values(), key=lambda source: source.score, reverse=True)
 @app.post("/api/chat", response_model=ChatMsgResponse, tags=["Chat AI"])
 async def chat_with_ai(request: ChatRequest): # ...
-    current_api_key = os.getenv("OPENAI_API_KEY")
-    if not current_api_key: raise HTTPException(status_code=503, detail="OPENAI_API_KEY no configurada.")
-    client = openai.OpenAI(api_key=current_api_key)
-    user_message = request.message; context_str = ""
-    if request.relevant_notes_content: context_str = "\n\nContexto:\n" + "\n---\n".join(request.relevant_notes_content)
-    prompt_messages = [{"role": "system", "content": "Eres un asistente útil."}, {"role": "user", "content": user_message + context_str}]
-    try: completion = client.chat.completions.create(model="gpt-3.5-turbo", messages=prompt_messages); return ChatMsgResponse(reply=completion.choices[0].message.content.strip())
+    if not os.getenv("OPENAI_API_KEY"): raise HTTPException(status_code=503, detail="OPENAI_API_KEY no configurada.")
+    context = await build_chat_context(request)
+    prompt_messages = chat_prompt_messages(request, context)
+    try:
+        # Cliente compartido (pool de conexiones) y plaza en el limitador de concurrencia hacia OpenAI
+        async with openai_slot():
+            with span("chat_completion"): completion = await get_async_openai_client().with_options(max_retries=2).chat.completions.create(model=CHAT_MODEL, messages=prompt_messages)
+        return ChatMsgResponse(reply=completion.choices[0].message.content.strip(), sources=chat_sources(context), context_tokens=context.tokens)
     except Exception as e: print(f"Error OpenAI: {e}"); raise HTTPException(status_code=500, detail=f"Error IA: {str(e)}")
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/api/chat/stream", tags=["Chat AI"])
+async def chat_with_ai_stream(request: ChatRequest):
+    """Como /api/chat, pero reenvía los tokens por Server-Sent Events a medida que llegan.
+
+    Eventos: `sources` ({"sources", "context_tokens"}, antes del primer token), `token` ({"delta"}),
+    `done` ({"finish_reason"}) y `error` ({"detail"}). Si el
+    cliente se desconecta se cierra la petición a OpenAI y deja de generarse (y facturarse).
+    """
+    if not os.getenv("OPENAI_API_KEY"): raise HTTPException(status_code=503, detail="OPENAI_API_KEY no configurada.")
+    context = await build_chat_context(request)
+    prompt_messages = chat_prompt_messages(request, context)
+
+    async def events():
+        stream = None; finish_reason = None
+        try:
+            yield sse_event("sources", {"sources": [source.model_dump() for source in chat_sources(context)], "context_tokens": context.tokens})
+            async with openai_slot():
+                stream = await get_async_openai_client().with_options(max_retries=2).chat.completions.create(
+                    model=CHAT_MODEL, messages=prompt_messages, stream=True)
+                async for chunk in stream:
+                    if not chunk.choices: continue
+                    choice = chunk.choices[0]
+                    if choice.delta and choice.delta.content: yield sse_event("token", {"delta": choice.delta.content})
+                    finish_reason = choice.finish_reason or finish_reason
+            yield sse_event("done", {"finish_reason": finish_reason})
+        except asyncio.CancelledError:
+            print("Chat: cliente desconectado, generación cancelada."); raise
+        except Exception as e:
+            print(f"Error OpenAI (stream): {e}"); yield sse_event("error", {"detail": f"Error IA: {str(e)}"})
+        finally:
+            # Starlette cancela este generador cuando el cliente se desconecta; cerrar la respuesta HTTP aborta la generación en OpenAI
+            if stream is not None: await stream.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 # --- Fin Chat AI Endpoint ---
 
 if __name__ == "__main__":
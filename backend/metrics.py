@@ -0,0 +1,180 @@
+"""Instrumentación de rendimiento: tramos de tiempo, contadores y exposición Prometheus.
+
+- `span("faiss_search")` mide un tramo y lo observa en el histograma
+  `vault_stage_duration_seconds{stage="faiss_search"}`. Si se ejecuta dentro de
+  una petición HTTP (también en el pool de hilos: anyio copia el contexto),
+  se añade a su cabecera `Server-Timing`.
+- Histogramas y contadores propios en formato de texto de Prometheus
+  (`render_prometheus`, servido en /api/metrics), sin depender de
+  `prometheus_client`. Son por proceso: con varios workers cada uno expone los
+  suyos.
+- Perfilador de muestreo opcional (`pyinstrument`): con `PROFILE_SAMPLE_RATE`
+  > 0 se perfila esa fracción de peticiones y se guarda el informe de las que
+  tardan más de `PROFILE_SLOW_REQUEST_MS` en `PROFILE_DIR`.
+"""
+import contextvars
+import math
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) # 0 = perfilador desactivado
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "1000"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS_S = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+def _label_pairs(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if math.isinf(value): return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock: self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock: values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_pairs(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS_S):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {} # etiquetas -> [cuentas por bucket (no acumuladas), suma, número]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None: series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1; series[1] += value; series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def totals(self) -> Dict[Tuple[str, ...], Tuple[int, float]]:
+        """(número, suma) por combinación de etiquetas; restando dos llamadas se obtiene lo observado entre ambas."""
+        with self._lock: return {key: (n, total) for key, (_, total, n) in self._series.items()}
+
+    def render(self) -> List[str]:
+        with self._lock: series = sorted((key, (list(counts), total, n)) for key, (counts, total, n) in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, n) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_labels = _label_pairs(self.labelnames, key, 'le="%s"' % _format_value(bound))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_pairs(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_label_pairs(self.labelnames, key)} {n}")
+        return lines
+
+
+# --- Métricas ---
+STAGE_DURATION = Histogram("vault_stage_duration_seconds", "Duración de cada etapa instrumentada (sincronización, embeddings, FAISS, BD).", ["stage"])
+HTTP_REQUEST_DURATION = Histogram("vault_http_request_duration_seconds", "Duración de las peticiones HTTP por ruta.", ["method", "route", "status"])
+EMBEDDING_REQUEST_DURATION = Histogram("vault_embedding_request_duration_seconds", "Latencia de cada llamada a la API de embeddings (sin esperas de reintento).", ["mode"])
+EMBEDDING_BATCH_SIZE = Histogram("vault_embedding_batch_size", "Textos por llamada a la API de embeddings.", ["mode"], buckets=SIZE_BUCKETS)
+EMBEDDING_TOKENS = Counter("vault_embedding_tokens_total", "Tokens enviados a la API de embeddings (según `usage` de la respuesta).", ["mode"])
+EMBEDDING_RETRIES = Counter("vault_embedding_retries_total", "Reintentos de llamadas a la API de embeddings.", ["mode"])
+EMBEDDING_ERRORS = Counter("vault_embedding_errors_total", "Llamadas a la API de embeddings que fallaron sin más reintentos.", ["mode"])
+SYNC_FILES = Counter("vault_sync_files_total", "Ficheros procesados por las sincronizaciones, por resultado.", ["result"])
+SLOW_REQUEST_PROFILES = Counter("vault_slow_request_profiles_total", "Informes del perfilador guardados para peticiones lentas.")
+REGISTRY = [STAGE_DURATION, HTTP_REQUEST_DURATION, EMBEDDING_REQUEST_DURATION, EMBEDDING_BATCH_SIZE, EMBEDDING_TOKENS,
+            EMBEDDING_RETRIES, EMBEDDING_ERRORS, SYNC_FILES, SLOW_REQUEST_PROFILES]
+
+def render_prometheus() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# --- Tramos por petición (Server-Timing) ---
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_spans", default=None)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try: yield
+    finally: record_span(stage, time.perf_counter() - start)
+
+def record_span(stage: str, seconds: float):
+    STAGE_DURATION.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None: spans.append((stage, seconds)) # list.append es atómico: vale desde varios hilos de la misma petición
+
+def start_request_spans() -> contextvars.Token:
+    return _request_spans.set([])
+
+def finish_request_spans(token: contextvars.Token) -> List[Tuple[str, float]]:
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+def server_timing_header(spans: List[Tuple[str, float]], total_s: float) -> str:
+    """Cabecera Server-Timing: un tramo por etapa (los repetidos se suman) más el total, en milisegundos."""
+    totals: Dict[str, float] = {}
+    for stage, seconds in spans: totals[stage] = totals.get(stage, 0.0) + seconds
+    totals["total"] = total_s
+    return ", ".join(f"{re.sub(r'[^A-Za-z0-9_-]', '_', stage)};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+
+# --- Perfilador de peticiones lentas (opcional) ---
+_profiler_lock = threading.Lock() # Un solo perfil a la vez: pyinstrument no admite perfiles solapados en el mismo hilo
+_profiler_available: Optional[bool] = None
+
+def start_profiler():
+    """Empieza a perfilar la petición actual si toca según PROFILE_SAMPLE_RATE. Devuelve el perfilador o None."""
+    global _profiler_available
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE or _profiler_available is False: return None
+    try:
+        from pyinstrument import Profiler
+        _profiler_available = True
+    except ImportError:
+        print("PROFILE_SAMPLE_RATE está activo pero pyinstrument no está instalado; el perfilador queda desactivado.")
+        _profiler_available = False; return None
+    if not _profiler_lock.acquire(blocking=False): return None
+    try:
+        profiler = Profiler(async_mode="enabled"); profiler.start(); return profiler
+    except Exception as e:
+        _profiler_lock.release(); print(f"No se pudo iniciar el perfilador: {e}"); return None
+
+def stop_profiler(profiler, label: str, elapsed_s: float):
+    """Detiene el perfilador y guarda el informe HTML si la petición fue lenta."""
+    try:
+        profiler.stop()
+        if elapsed_s * 1000 < PROFILE_SLOW_REQUEST_MS: return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_-]+', '_', label).strip('_')}-{elapsed_s * 1000:.0f}ms.html")
+        with open(path, "w", encoding="utf-8") as report: report.write(profiler.output_html())
+        SLOW_REQUEST_PROFILES.inc()
+        print(f"Petición lenta ({elapsed_s * 1000:.0f} ms): perfil guardado en {path}")
+    except Exception as e: print(f"No se pudo guardar el perfil de la petición: {e}")
+    finally: _profiler_lock.release()
@@ -0,0 +1,182 @@
+"""Escritura por lotes de las notas durante la sincronización.
+
+En lugar de una consulta de `Note`, una de `Tag` por cada tag y un commit por
+fichero, la sincronización:
+
+- Carga de una vez (`prefetch_notes`, en lotes de IN) el estado guardado de
+  las notas listadas: título, md5, ruta, enlace y fecha de Drive.
+- Mantiene en memoria el mapa nombre de tag -> id (`TagCache`); los tags nuevos
+  se crean con un `INSERT ... ON CONFLICT DO NOTHING` por lote.
+- Acumula las escrituras en `NoteBatchWriter` y las aplica en una sola
+  transacción por lote: `INSERT ... ON CONFLICT(id) DO UPDATE` para las notas
+  con contenido nuevo (y sus enlaces a tags) y un UPDATE por clave primaria para
+  las que solo cambian metadatos. Los ficheros sin ningún cambio no se escriben.
+
+Si un lote falla se reintenta fichero a fichero para aislar el que da error.
+"""
+import hashlib
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from backend.database_models import Note, Tag, note_tags_table
+
+SQL_IN_BATCH_SIZE = 500 # Mantiene las cláusulas IN por debajo del límite de variables de SQLite
+STALE_CONTENT_MD5 = "" # Nunca coincide con el md5 de Drive (y prefetch_notes solo rellena los NULL): fuerza a descargar y reindexar
+
+
+def _in_batches(values: list, size: int = SQL_IN_BATCH_SIZE):
+    for i in range(0, len(values), size): yield values[i:i + size]
+
+def content_md5_of(content: str) -> str:
+    """md5 del contenido tal como lo calcula Drive (bytes UTF-8 del fichero)."""
+    return hashlib.md5(content.encode("utf-8")).hexdigest()
+
+def word_count_of(content: Optional[str]) -> int:
+    """Palabras separadas por espacios en blanco (el mismo criterio que usaba la interfaz)."""
+    return len((content or "").split())
+
+
+@dataclass
+class StoredNote:
+    title: Optional[str]
+    content_md5: Optional[str]
+    path: Optional[str] = None
+    source_url: Optional[str] = None
+    drive_modified_time: Optional[datetime] = None # UTC sin zona, como lo devuelve SQLite
+
+
+def prefetch_notes(db: Session, file_ids: List[str]) -> Dict[str, StoredNote]:
+    """Estado guardado de las notas existentes entre `file_ids`. Rellena content_md5 en notas sincronizadas antes de guardarlo."""
+    stored: Dict[str, StoredNote] = {}
+    for ids in _in_batches(file_ids):
+        for row in db.query(Note.id, Note.title, Note.content_md5, Note.path, Note.source_url, Note.drive_modified_time).filter(Note.id.in_(ids)):
+            stored[row.id] = StoredNote(row.title, row.content_md5, row.path, row.source_url, row.drive_modified_time)
+    legacy_ids = [note_id for note_id, note in stored.items() if note.content_md5 is None]
+    for ids in _in_batches(legacy_ids):
+        rows = [{"id": note_id, "content_md5": content_md5_of(content)} for note_id, content in db.query(Note.id, Note.content).filter(Note.id.in_(ids))
+                if content is not None]
+        if rows: db.execute(update(Note), rows)
+        for row in rows: stored[row["id"]].content_md5 = row["content_md5"]
+    if legacy_ids: db.commit()
+    return stored
+
+def load_note_contents(db: Session, note_ids: List[str]) -> Dict[str, str]:
+    contents: Dict[str, str] = {}
+    for ids in _in_batches(note_ids): contents.update(db.query(Note.id, Note.content).filter(Note.id.in_(ids)).all())
+    return contents
+
+
+class TagCache:
+    """Mapa nombre de tag -> id, cargado una vez por sincronización."""
+
+    def __init__(self, db: Session):
+        self.reload(db)
+
+    def reload(self, db: Session):
+        # Tras un rollback los ids creados en esa transacción ya no existen
+        self.ids: Dict[str, int] = dict(db.query(Tag.name, Tag.id).all())
+
+    def ids_for(self, db: Session, names: Iterable[str]) -> List[int]:
+        names = list(dict.fromkeys(names))
+        missing = [name for name in names if name not in self.ids]
+        for batch in _in_batches(missing):
+            db.execute(sqlite_insert(Tag).on_conflict_do_nothing(index_elements=["name"]), [{"name": name} for name in batch])
+            self.ids.update(db.query(Tag.name, Tag.id).filter(Tag.name.in_(batch)).all())
+        return [self.ids[name] for name in names]
+
+
+@dataclass
+class NoteWrite:
+    """Resultado de procesar un fichero: lo que hay que escribir (si algo) y si hay que regenerar sus fragmentos."""
+    file_id: str
+    file_name: Optional[str]
+    title: str
+    reindex: bool
+    content: Optional[str] = None # None si no se descargó (hay que leerlo de la BD para reindexar)
+    values: Optional[dict] = None # Columnas a escribir; None si no cambia nada
+    tags: Optional[List[str]] = None # Tags nuevos; None si el contenido no cambió
+
+
+class NoteBatchWriter:
+    def __init__(self, db: Session, stored: Dict[str, StoredNote], extract_tags: Callable[[str], List[str]]):
+        self.db = db
+        self.stored = stored
+        self.extract_tags = extract_tags
+        self.tags = TagCache(db)
+        self.pending: List[NoteWrite] = []
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, item_meta: dict, content_bytes: Optional[bytes], force_reindex: bool = False) -> NoteWrite:
+        """Prepara la escritura de `item_meta`. `content_bytes=None` indica que el contenido no ha cambiado y no se descargó.
+
+        Lanza la excepción del fichero (p. ej. UTF-8 inválido) sin tocar la BD.
+        """
+        file_id = item_meta.get("id"); file_name = item_meta.get("name")
+        modified_time_str = item_meta.get("modifiedTime")
+        drive_mod_time_dt = datetime.fromisoformat(modified_time_str.replace("Z", "+00:00")) if modified_time_str else datetime.now(timezone.utc)
+        drive_mod_time_dt = drive_mod_time_dt.astimezone(timezone.utc).replace(tzinfo=None)
+        note_title = (file_name.replace(".md", "") if file_name else f"Untitled_{file_id}")
+        metadata = {"path": item_meta.get("path"), "source_url": item_meta.get("webViewLink"), "drive_modified_time": drive_mod_time_dt}
+        stored = self.stored.get(file_id)
+        if content_bytes is None:
+            if stored is None: raise ValueError(f"La nota {file_id} no existe y su contenido no se descargó")
+            content_md5, content_str = stored.content_md5, None
+        else:
+            content_md5 = item_meta.get("md5Checksum") or hashlib.md5(content_bytes).hexdigest()
+            content_str = content_bytes.decode("utf-8")
+
+        if stored is not None and content_md5 == stored.content_md5:
+            # Contenido idéntico (p. ej. solo cambió modifiedTime): actualizar metadatos.
+            # El título forma parte del texto de los embeddings, así que renombrar sí obliga a reindexar.
+            changed = {key: value for key, value in metadata.items() if getattr(stored, key) != value}
+            if stored.title != note_title: changed["title"] = note_title # Solo si cambia: el UPDATE de title reindexa FTS
+            write = NoteWrite(file_id, file_name, note_title, reindex="title" in changed or force_reindex, content=content_str,
+                              values={"id": file_id, **changed} if changed else None)
+        else:
+            write = NoteWrite(file_id, file_name, note_title, reindex=True, content=content_str,
+                              values={"id": file_id, "title": note_title, "content": content_str, "content_md5": content_md5,
+                                      "word_count": word_count_of(content_str), **metadata},
+                              tags=self.extract_tags(content_str))
+        self.stored[file_id] = StoredNote(note_title, content_md5, **metadata)
+        if write.values is not None: self.pending.append(write)
+        return write
+
+    def flush(self) -> List[Tuple[NoteWrite, Exception]]:
+        """Escribe lo pendiente en una transacción. Devuelve los ficheros que fallaron y su error."""
+        writes, self.pending = self.pending, []
+        if not writes: return []
+        try:
+            self._write(writes); self.db.commit(); return []
+        except Exception as e:
+            self.db.rollback(); self.tags.reload(self.db)
+            if len(writes) == 1: return [(writes[0], e)]
+        failures = []
+        for write in writes: # Fichero a fichero para aislar el que falla
+            try: self._write([write]); self.db.commit()
+            except Exception as e: self.db.rollback(); self.tags.reload(self.db); failures.append((write, e))
+        return failures
+
+    def _write(self, writes: List[NoteWrite]):
+        content_rows = [write.values for write in writes if write.tags is not None]
+        if content_rows:
+            insert = sqlite_insert(Note)
+            self.db.execute(insert.on_conflict_do_update(index_elements=["id"], set_={
+                **{column: insert.excluded[column] for column in ("title", "content", "content_md5", "word_count", "path", "source_url", "drive_modified_time")},
+                "modified_at": func.now()}), content_rows)
+            note_ids = [row["id"] for row in content_rows]
+            for ids in _in_batches(note_ids): self.db.execute(note_tags_table.delete().where(note_tags_table.c.note_id.in_(ids)))
+            self.tags.ids_for(self.db, [name for write in writes if write.tags for name in write.tags]) # Crea los nuevos de todo el lote a la vez
+            links = [{"note_id": write.file_id, "tag_id": self.tags.ids[name]} for write in writes if write.tags for name in set(write.tags)]
+            if links: self.db.execute(sqlite_insert(note_tags_table).on_conflict_do_nothing(), links)
+        # UPDATE por clave primaria agrupado por columnas (un executemany por combinación)
+        metadata_groups: Dict[tuple, List[dict]] = {}
+        for write in writes:
+            if write.tags is None: metadata_groups.setdefault(tuple(sorted(write.values)), []).append(write.values)
+        for rows in metadata_groups.values(): self.db.execute(update(Note), rows)
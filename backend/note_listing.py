@@ -0,0 +1,112 @@
+"""Listado paginado de notas (`GET /api/notes`).
+
+Paginación por cursor (keyset) en el orden de la biblioteca: fecha de Drive
+descendente (sin fecha al final), título e id. El cursor es la clave de la
+última nota devuelta y la página siguiente empieza con un rango sobre el índice
+compuesto `ix_notes_listing` (drive_modified_time DESC, title, id), así que
+pedir la página 100 cuesta lo mismo que la primera (con OFFSET SQLite recorre
+y descarta todas las filas anteriores).
+
+SQLite ordena NULL como el menor valor, de modo que en orden descendente las
+notas sin fecha quedan al final sin `NULLS LAST`. Se leen en dos tramos con su
+propio rango: primero las que tienen fecha y, cuando se acaban, las que no.
+
+Con `fields` solo se leen las columnas pedidas; `excerpt` se calcula en el
+servidor a partir del principio del contenido, sin enviar la nota entera, y
+`word_count` se guarda al sincronizar la nota, sin leer su contenido.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Query, Session
+
+from backend.database_models import Note, Tag, note_tags_table
+from backend.hydration import HYDRATION_BATCH_SIZE, excerpt
+
+NOTE_EXCERPT_CHARS = 280
+LIST_FIELDS = ("id", "title", "path", "created_at", "modified_at", "drive_modified_time", "source_url", "word_count", "tags", "excerpt", "content")
+_COLUMN_FIELDS = ("title", "path", "created_at", "modified_at", "drive_modified_time", "source_url", "word_count")
+
+Cursor = Tuple[Optional[datetime], Optional[str], str] # (drive_modified_time, title, id) de la última nota de la página
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(drive_modified_time: Optional[datetime], title: Optional[str], note_id: str) -> str:
+    payload = json.dumps([drive_modified_time.isoformat() if drive_modified_time else None, title, note_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Cursor:
+    try:
+        modified, title, note_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return (datetime.fromisoformat(modified) if modified else None), title, str(note_id)
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Cursor de paginación inválido: {e}") from e
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """`fields` de la petición ("title,excerpt,tags") validado; None = nota completa. El id siempre se incluye."""
+    if not fields: return None
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = sorted(set(requested) - set(LIST_FIELDS))
+    if unknown: raise ValueError(f"Campos desconocidos: {', '.join(unknown)}. Disponibles: {', '.join(LIST_FIELDS)}")
+    return tuple(dict.fromkeys(["id", *requested]))
+
+
+def _after_title_id(title: Optional[str], note_id: str):
+    """(title, id) posterior al del cursor en orden ascendente (NULL primero, como lo ordena SQLite)."""
+    if title is None: return or_(Note.title.isnot(None), and_(Note.title.is_(None), Note.id > note_id))
+    return or_(Note.title > title, and_(Note.title == title, Note.id > note_id))
+
+def _dated_page(query: Query, cursor: Optional[Cursor]) -> Query:
+    query = query.filter(Note.drive_modified_time.isnot(None))
+    if cursor is not None:
+        modified, title, note_id = cursor
+        # El primer término acota el rango del índice; el OR resuelve el desempate dentro de la misma fecha
+        query = query.filter(Note.drive_modified_time <= modified,
+                             or_(Note.drive_modified_time < modified, _after_title_id(title, note_id)))
+    return query.order_by(Note.drive_modified_time.desc(), Note.title, Note.id)
+
+def _undated_page(query: Query, cursor: Optional[Cursor]) -> Query:
+    query = query.filter(Note.drive_modified_time.is_(None))
+    if cursor is not None and cursor[0] is None: query = query.filter(_after_title_id(cursor[1], cursor[2]))
+    return query.order_by(Note.title, Note.id)
+
+def keyset_page(base_query: Query, cursor: Optional[Cursor], limit: int) -> list:
+    """Hasta `limit` filas de `base_query` a continuación del cursor, en el orden de la biblioteca."""
+    rows = [] if cursor is not None and cursor[0] is None else _dated_page(base_query, cursor).limit(limit).all()
+    if len(rows) < limit: rows += _undated_page(base_query, cursor).limit(limit - len(rows)).all()
+    return rows
+
+
+def tags_by_note(db: Session, note_ids: Sequence[str]) -> Dict[str, List[dict]]:
+    tags: Dict[str, List[dict]] = {note_id: [] for note_id in note_ids}
+    for start in range(0, len(note_ids), HYDRATION_BATCH_SIZE):
+        batch = note_ids[start:start + HYDRATION_BATCH_SIZE]
+        for note_id, tag_id, name in (db.query(note_tags_table.c.note_id, Tag.id, Tag.name).join(Tag, Tag.id == note_tags_table.c.tag_id)
+                                      .filter(note_tags_table.c.note_id.in_(batch)).order_by(Tag.name)):
+            tags[note_id].append({"id": tag_id, "name": name})
+    return tags
+
+def projected_query(db: Session, fields: Iterable[str]) -> Query:
+    """Consulta de solo las columnas necesarias para `fields` (más las de la clave del cursor)."""
+    columns = [Note.id, Note.title, Note.drive_modified_time] + [getattr(Note, field) for field in _COLUMN_FIELDS
+                                                                  if field in fields and field not in ("title", "drive_modified_time")]
+    if "content" in fields: columns.append(Note.content)
+    elif "excerpt" in fields: columns.append(func.substr(Note.content, 1, NOTE_EXCERPT_CHARS * 2).label("content")) # Margen para los espacios que colapsa excerpt
+    return db.query(*columns)
+
+def project_rows(db: Session, rows: list, fields: Sequence[str]) -> List[dict]:
+    tags = tags_by_note(db, [row.id for row in rows]) if "tags" in fields else {}
+    items = []
+    for row in rows:
+        item = {field: getattr(row, field) for field in fields if field in ("id", "content") or field in _COLUMN_FIELDS}
+        if "excerpt" in fields: item["excerpt"] = excerpt(row.content, NOTE_EXCERPT_CHARS)
+        if "tags" in fields: item["tags"] = tags[row.id]
+        items.append(item)
+    return items
@@ -0,0 +1,50 @@
+"""Cliente OpenAI asíncrono compartido y limitador de concurrencia.
+
+Todas las llamadas a OpenAI del camino de peticiones (embeddings de consultas,
+chat) usan un único `AsyncOpenAI` con un pool de conexiones httpx acotado y
+pasan por un semáforo (`OPENAI_MAX_CONCURRENCY`), de modo que un pico de
+usuarios no abre cientos de conexiones ni bloquea el event loop de uvicorn.
+
+El cliente y el semáforo están ligados a un event loop; se crean una vez por
+loop (en producción, uno solo).
+"""
+import asyncio
+import os
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16")) # Peticiones simultáneas a OpenAI
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_TIMEOUT_S = float(os.getenv("OPENAI_TIMEOUT_S", "60"))
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def get_async_openai_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        import httpx
+        import openai
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key: raise RuntimeError("OPENAI_API_KEY no configurada.")
+        limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS)
+        # Los reintentos de embeddings los gestiona embeddings.aembed_with_retry
+        client = _clients[loop] = openai.AsyncOpenAI(api_key=api_key, http_client=openai.DefaultAsyncHttpxClient(limits=limits),
+                                                     timeout=OPENAI_TIMEOUT_S, max_retries=0)
+    return client
+
+@asynccontextmanager
+async def openai_slot() -> AsyncIterator[None]:
+    """Reserva una de las `OPENAI_MAX_CONCURRENCY` plazas para una llamada a OpenAI."""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None: limiter = _limiters[loop] = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+    async with limiter:
+        yield
+
+async def close_async_openai_client():
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None: await client.close()
@@ -0,0 +1,180 @@
+"""Cachés de consultas de búsqueda.
+
+- `QueryEmbeddingCache`: embedding de cada consulta normalizada (LRU con TTL en
+  memoria y, opcionalmente, una segunda capa SQLite en disco que sobrevive a
+  reinicios). Evita el round-trip a OpenAI en consultas repetidas.
+- `TTLLRUCache` también sirve para la caché de resultados, cuya clave incluye
+  la versión del índice FAISS; al cambiar el índice se vacía.
+
+Todas las cachés llevan contadores de aciertos/fallos consultables con `stats()`.
+"""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "2048"))
+QUERY_EMBEDDING_CACHE_TTL_S = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL_S", str(7 * 24 * 3600)))
+QUERY_EMBEDDING_CACHE_DB = os.getenv("QUERY_EMBEDDING_CACHE_DB", "") # Vacío = sin capa en disco
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "512"))
+SEARCH_RESULT_CACHE_TTL_S = float(os.getenv("SEARCH_RESULT_CACHE_TTL_S", "600"))
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    """Forma canónica de una consulta: NFKC, sin distinguir mayúsculas y con los espacios colapsados."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+class TTLLRUCache:
+    """Diccionario acotado: expulsa la entrada usada hace más tiempo y caduca entradas tras `ttl_s` segundos."""
+
+    def __init__(self, max_entries: int, ttl_s: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict() # clave -> (valor, instante de inserción)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and self.ttl_s is not None and self._clock() - entry[1] > self.ttl_s:
+                del self._entries[key]; self.expirations += 1; entry = _MISSING
+            if entry is _MISSING:
+                self.misses += 1; return default
+            self._entries.move_to_end(key); self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0: return
+        with self._lock:
+            self._entries[key] = (value, self._clock()); self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False); self.evictions += 1
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl_s": self.ttl_s, "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0, "evictions": self.evictions, "expirations": self.expirations}
+
+
+class SQLiteVectorStore:
+    """Capa en disco: vectores float32 por clave en un fichero SQLite propio (no en notes.db)."""
+
+    def __init__(self, path: str, ttl_s: Optional[float] = None):
+        self.path = path
+        self.ttl_s = ttl_s
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS query_embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._connection.execute("SELECT vector, created_at FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        if self.ttl_s is not None and time.time() - row[1] > self.ttl_s: return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, key: str, vector: List[float]):
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                                     (key, np.asarray(vector, dtype=np.float32).tobytes(), time.time()))
+            self._connection.commit()
+
+    def purge_expired(self) -> int:
+        if self.ttl_s is None: return 0
+        with self._lock:
+            deleted = self._connection.execute("DELETE FROM query_embeddings WHERE created_at < ?", (time.time() - self.ttl_s,)).rowcount
+            self._connection.commit()
+        return deleted
+
+    def count(self) -> int:
+        with self._lock: return self._connection.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+
+class QueryEmbeddingCache:
+    """Embeddings de consultas por (modelo, consulta normalizada): memoria primero, después disco."""
+
+    def __init__(self, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE, ttl_s: Optional[float] = QUERY_EMBEDDING_CACHE_TTL_S,
+                 disk_path: Optional[str] = QUERY_EMBEDDING_CACHE_DB or None):
+        self.memory = TTLLRUCache(max_entries, ttl_s)
+        self.disk: Optional[SQLiteVectorStore] = None
+        if disk_path:
+            try:
+                self.disk = SQLiteVectorStore(disk_path, ttl_s); self.disk.purge_expired()
+            except Exception as e:
+                print(f"No se pudo abrir la caché de embeddings en disco '{disk_path}': {e}. Solo se usará memoria.")
+        self.disk_hits = 0; self.computed = 0
+
+    @staticmethod
+    def key_for(query: str, model_name: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    async def aget_or_compute(self, query: str, model_name: str,
+                              compute: Callable[[str], Awaitable[Optional[List[float]]]]) -> Optional[List[float]]:
+        """Vector de `query`; si no está en caché lo calcula `compute` (los fallos, None, no se guardan).
+
+        La capa en disco se consulta en un hilo para no bloquear el bucle de eventos.
+        """
+        key = self.key_for(query, model_name)
+        vector = self.memory.get(key)
+        if vector is not None: return vector
+        if self.disk is not None:
+            vector = await asyncio.to_thread(self.disk.get, key)
+            if vector is not None:
+                self.disk_hits += 1; self.memory.put(key, vector); return vector
+        vector = await compute(query)
+        if vector is None: return None
+        self.computed += 1; self.memory.put(key, vector)
+        if self.disk is not None:
+            try: await asyncio.to_thread(self.disk.put, key, vector)
+            except Exception as e: print(f"Error guardando embedding de consulta en disco: {e}")
+        return vector
+
+    async def aget_or_compute_many(self, queries: Sequence[str], model_name: str,
+                                   compute_many: Callable[[List[str]], Awaitable[List[Optional[List[float]]]]]) -> List[Optional[List[float]]]:
+        """Como `aget_or_compute` para varias consultas: las que faltan en caché se calculan en una sola llamada."""
+        keys = [self.key_for(query, model_name) for query in queries]
+        found: Dict[str, List[float]] = {}
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is not None: found[key] = vector
+        if self.disk is not None:
+            for key in dict.fromkeys(key for key in keys if key not in found):
+                vector = await asyncio.to_thread(self.disk.get, key)
+                if vector is not None: self.disk_hits += 1; self.memory.put(key, vector); found[key] = vector
+        missing = {key: query for key, query in zip(keys, queries) if key not in found} # Consultas equivalentes se calculan una vez
+        if missing:
+            for key, vector in zip(missing, await compute_many(list(missing.values()))):
+                if vector is None: continue
+                self.computed += 1; self.memory.put(key, vector); found[key] = vector
+                if self.disk is not None:
+                    try: await asyncio.to_thread(self.disk.put, key, vector)
+                    except Exception as e: print(f"Error guardando embedding de consulta en disco: {e}")
+        return [found.get(key) for key in keys]
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"memory": self.memory.stats(), "disk_enabled": self.disk is not None, "disk_hits": self.disk_hits, "computed": self.computed}
+        if self.disk is not None: stats["disk_entries"] = self.disk.count()
+        return stats
@@ -0,0 +1,104 @@
+"""Agregación de resultados de búsqueda por fragmentos.
+
+El índice FAISS devuelve fragmentos (`NoteChunk`); aquí se agrupan por nota
+(puntuación = mejor fragmento), se descartan fragmentos que se solapan con
+otro mejor de la misma nota y se limita el número de fragmentos por nota.
+
+También se fusionan rankings de distintas etapas (léxica y semántica) para la
+búsqueda híbrida: por posición (reciprocal rank fusion) o por puntuación
+normalizada.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+CHUNK_OVERFETCH = int(os.getenv("CHUNK_OVERFETCH", "4")) # Fragmentos pedidos a FAISS por cada nota solicitada
+MAX_CHUNKS_PER_NOTE = int(os.getenv("MAX_CHUNKS_PER_NOTE", "3"))
+MAX_CHUNK_OVERLAP_RATIO = 0.5
+RRF_K = int(os.getenv("RRF_K", "60")) # Constante de suavizado de RRF (valor habitual en la literatura)
+
+
+def l2_to_cosine(distance: float) -> float:
+    """Similitud coseno a partir de la distancia L2 al cuadrado entre vectores normalizados."""
+    return 1.0 - distance / 2.0
+
+
+@dataclass
+class ChunkHit:
+    chunk_id: int
+    note_id: str
+    score: float
+    start: int = 0
+    end: int = 0
+
+
+@dataclass
+class NoteHit:
+    note_id: str
+    score: float
+    chunks: List[ChunkHit] = field(default_factory=list)
+
+
+def _overlap_ratio(a: ChunkHit, b: ChunkHit) -> float:
+    overlap = min(a.end, b.end) - max(a.start, b.start)
+    if overlap <= 0: return 0.0
+    return overlap / max(1, min(a.end - a.start, b.end - b.start))
+
+def aggregate_chunk_hits(hits: List[ChunkHit], k: int, max_chunks_per_note: int = MAX_CHUNKS_PER_NOTE) -> List[NoteHit]:
+    """Agrupa `hits` (ordenados de mejor a peor) en como mucho `k` notas."""
+    notes: Dict[str, NoteHit] = {}
+    for hit in sorted(hits, key=lambda h: h.score, reverse=True):
+        note_hit = notes.get(hit.note_id)
+        if note_hit is None:
+            if len(notes) >= k: continue
+            note_hit = notes[hit.note_id] = NoteHit(note_id=hit.note_id, score=hit.score)
+        if len(note_hit.chunks) >= max_chunks_per_note: continue
+        if any(_overlap_ratio(hit, kept) > MAX_CHUNK_OVERLAP_RATIO for kept in note_hit.chunks): continue
+        note_hit.chunks.append(hit)
+    return sorted(notes.values(), key=lambda n: n.score, reverse=True)
+
+def dedupe_across_queries(note_hits_per_query: Sequence[List[NoteHit]], k: int) -> List[List[NoteHit]]:
+    """Asigna cada nota a la consulta en la que puntúa mejor (en empate, la primera) y deja como mucho `k` notas por consulta."""
+    owner: Dict[str, Tuple[float, int]] = {}
+    for position, note_hits in enumerate(note_hits_per_query):
+        for note_hit in note_hits:
+            best = owner.get(note_hit.note_id)
+            if best is None or note_hit.score > best[0]: owner[note_hit.note_id] = (note_hit.score, position)
+    return [[note_hit for note_hit in note_hits if owner[note_hit.note_id][1] == position][:k] for position, note_hits in enumerate(note_hits_per_query)]
+
+def overfetch_sizes(k: int, ntotal: int) -> List[Tuple[int, bool]]:
+    """Tamaños de búsqueda crecientes: (k_fragmentos, es_el_último_intento)."""
+    sizes, size = [], max(k, k * CHUNK_OVERFETCH)
+    while True:
+        size = min(size, ntotal)
+        sizes.append(size)
+        if size >= ntotal or len(sizes) >= 3: break
+        size *= 4
+    return [(size, i == len(sizes) - 1) for i, size in enumerate(sizes)]
+
+def reciprocal_rank_fusion(rankings: Mapping[str, Sequence[str]], weights: Optional[Mapping[str, float]] = None,
+                           rrf_k: int = RRF_K) -> List[Tuple[str, float]]:
+    """Fusiona rankings {etapa: [ids de mejor a peor]} con RRF: sum(peso / (rrf_k + posición)).
+
+    Solo usa posiciones, así que no importa que cada etapa puntúe en escalas distintas.
+    """
+    fused: Dict[str, float] = {}
+    for stage, ranked_ids in rankings.items():
+        weight = 1.0 if weights is None else weights.get(stage, 1.0)
+        for position, item_id in enumerate(ranked_ids, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + weight / (rrf_k + position)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+def weighted_score_fusion(scores: Mapping[str, Mapping[str, float]], weights: Mapping[str, float]) -> List[Tuple[str, float]]:
+    """Fusiona {etapa: {id: puntuación}} normalizando cada etapa a [0, 1] (min-max) y sumando con `weights`.
+
+    Un id ausente en una etapa aporta 0 en ella.
+    """
+    fused: Dict[str, float] = {}
+    for stage, stage_scores in scores.items():
+        if not stage_scores: continue
+        low, high = min(stage_scores.values()), max(stage_scores.values())
+        for item_id, score in stage_scores.items():
+            normalized = (score - low) / (high - low) if high > low else 1.0
+            fused[item_id] = fused.get(item_id, 0.0) + weights.get(stage, 1.0) * normalized
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
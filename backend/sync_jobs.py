@@ -0,0 +1,207 @@
+"""Trabajos de sincronización guardados en la BD (seguros con varios workers).
+
+Cada sincronización es una fila de `sync_jobs`. Un índice único parcial impide
+que haya dos trabajos activos aunque se pidan desde workers distintos, y el
+worker que ejecuta el trabajo mantiene una lease que renueva un hilo de
+heartbeat. Si el proceso muere, la lease caduca y otro worker (o el mismo al
+reiniciar) lo reanuda:
+
+- El plan (ficheros a procesar, notas borradas, page token y árbol de carpetas)
+  se guarda en `sync_jobs.checkpoint` antes de empezar a procesar ficheros.
+- Cada fichero cuyos embeddings ya están guardados se marca `done` en
+  `sync_job_files`; al reanudar se salta. Los errores por fichero se guardan
+  en la misma tabla con estado `error`.
+
+El progreso (mensaje, contadores) se guarda en memoria y lo escribe el
+heartbeat, así que /api/drive/sync_status lo ve desde cualquier worker con un
+retraso de unos segundos y sin una escritura por fichero.
+"""
+import json
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import or_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from backend.database_models import SyncJob, SyncJobFile
+
+SYNC_JOB_LEASE_S = float(os.getenv("SYNC_JOB_LEASE_S", "60")) # Sin heartbeat durante este tiempo, el trabajo se puede reanudar
+SYNC_JOB_HEARTBEAT_S = max(1.0, SYNC_JOB_LEASE_S / 6)
+SYNC_STATUS_ERROR_LIMIT = 50 # Errores por fichero incluidos en /api/drive/sync_status
+ACTIVE_STATUSES = ("queued", "running")
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class SyncJobConflict(Exception):
+    """Ya hay una sincronización activa con la lease vigente."""
+
+class SyncLeaseLost(Exception):
+    """Otro worker ha tomado el trabajo (la lease caducó): este debe dejar de escribir."""
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) # Las columnas DateTime de SQLite no guardan zona horaria
+
+def active_job(db: Session) -> Optional[SyncJob]:
+    return db.query(SyncJob).filter(SyncJob.status.in_(ACTIVE_STATUSES)).first()
+
+def is_resumable(job: SyncJob) -> bool:
+    return job.status in ACTIVE_STATUSES and job.lease_expires_at is not None and job.lease_expires_at < utcnow()
+
+def enqueue_job(db: Session, full: bool = False) -> Tuple[SyncJob, bool]:
+    """Crea un trabajo en cola. Devuelve (trabajo, reanudado).
+
+    Si ya hay uno activo cuya lease caducó (su worker murió) se devuelve ese para
+    reanudarlo; si sigue vivo se lanza SyncJobConflict.
+    """
+    job = SyncJob(status="queued", full=full, message="En cola...", lease_expires_at=utcnow() + timedelta(seconds=SYNC_JOB_LEASE_S))
+    db.add(job)
+    try:
+        db.commit(); return job, False
+    except IntegrityError:
+        db.rollback()
+    existing = active_job(db)
+    if existing is not None and is_resumable(existing): return existing, True
+    raise SyncJobConflict("Una sincronización ya está en progreso.")
+
+def claim_job(db: Session, job_id: int, owner: str = WORKER_ID) -> bool:
+    """Toma el trabajo si está en cola sin dueño o su lease caducó (un único UPDATE: solo un worker lo consigue)."""
+    now = utcnow()
+    result = db.execute(update(SyncJob).where(SyncJob.id == job_id, SyncJob.status.in_(ACTIVE_STATUSES),
+                                              or_(SyncJob.owner.is_(None), SyncJob.lease_expires_at < now))
+                        .values(status="running", owner=owner, lease_expires_at=now + timedelta(seconds=SYNC_JOB_LEASE_S),
+                                attempts=SyncJob.attempts + 1, started_at=now, message="Iniciando sincronización..."))
+    db.commit()
+    return result.rowcount == 1
+
+
+class SyncJobRunner:
+    """Lado del worker que ejecuta un trabajo: lease, progreso, checkpoints y errores por fichero.
+
+    Usa sus propias sesiones (`session_factory`) para no mezclar sus escrituras
+    con las transacciones de la sincronización.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], job_id: int, owner: str = WORKER_ID):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.owner = owner
+        self.full = False
+        self.plan: Optional[dict] = None # Plan guardado por un intento anterior (solo al reanudar)
+        self.message = "Iniciando sincronización..."
+        self.processed_files = 0
+        self.total_files = 0
+        self.failed_files = 0
+        self._lost = threading.Event()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @property
+    def resumed(self) -> bool:
+        return self.plan is not None
+
+    def claim(self) -> bool:
+        """Toma el trabajo, carga su checkpoint y arranca el heartbeat. False si lo tiene otro worker."""
+        with self.session_factory() as db:
+            if not claim_job(db, self.job_id, self.owner): return False
+            job = db.get(SyncJob, self.job_id)
+            self.full = bool(job.full)
+            self.plan = json.loads(job.checkpoint) if job.checkpoint else None
+            if self.plan is not None:
+                self.total_files = job.total_files
+                self.processed_files = db.query(SyncJobFile).filter(SyncJobFile.job_id == self.job_id, SyncJobFile.status == "done").count()
+                # Los ficheros con error no están `done`: se reintentan y se vuelven a contar si fallan otra vez
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name=f"sync-job-{self.job_id}-heartbeat", daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _update(self, **values) -> bool:
+        """UPDATE de la fila condicionado a seguir siendo el dueño. False si se perdió la lease."""
+        with self.session_factory() as db:
+            result = db.execute(update(SyncJob).where(SyncJob.id == self.job_id, SyncJob.owner == self.owner, SyncJob.status == "running")
+                                .values(**values))
+            db.commit()
+        if result.rowcount != 1: self._lost.set()
+        return result.rowcount == 1
+
+    def _progress_values(self) -> dict:
+        return {"message": self.message, "processed_files": self.processed_files, "total_files": self.total_files, "failed_files": self.failed_files}
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(SYNC_JOB_HEARTBEAT_S):
+            try:
+                if not self._update(lease_expires_at=utcnow() + timedelta(seconds=SYNC_JOB_LEASE_S), **self._progress_values()):
+                    print(f"El trabajo de sincronización {self.job_id} lo ha tomado otro worker; este se detendrá."); return
+            except OperationalError as e:
+                print(f"No se pudo renovar la lease del trabajo de sincronización {self.job_id}: {e}") # BD bloqueada: se reintenta
+
+    def check(self):
+        """Lanza SyncLeaseLost si otro worker ha tomado el trabajo. Se llama entre ficheros."""
+        if self._lost.is_set(): raise SyncLeaseLost(f"El trabajo de sincronización {self.job_id} lo ha tomado otro worker.")
+
+    def progress(self, message: Optional[str] = None, processed_files: Optional[int] = None, total_files: Optional[int] = None):
+        if message is not None: self.message = message
+        if processed_files is not None: self.processed_files = processed_files
+        if total_files is not None: self.total_files = total_files
+
+    def save_plan(self, plan: dict):
+        self.check()
+        if not self._update(checkpoint=json.dumps(plan), **self._progress_values()): self.check()
+
+    def done_file_ids(self) -> Set[str]:
+        with self.session_factory() as db:
+            return {file_id for (file_id,) in db.query(SyncJobFile.file_id).filter(SyncJobFile.job_id == self.job_id, SyncJobFile.status == "done")}
+
+    def _record_files(self, rows: list):
+        if not rows: return
+        self.check()
+        statement = sqlite_insert(SyncJobFile).values(rows)
+        statement = statement.on_conflict_do_update(index_elements=["job_id", "file_id"],
+                                                    set_={"status": statement.excluded.status, "error": statement.excluded.error, "updated_at": utcnow()})
+        with self.session_factory() as db:
+            db.execute(statement); db.commit()
+
+    def mark_done(self, files: Iterable[Tuple[str, Optional[str]]]):
+        """Checkpoint: los ficheros (id, nombre) cuyos embeddings ya están guardados no se repiten al reanudar."""
+        self._record_files([{"job_id": self.job_id, "file_id": file_id, "file_name": name, "status": "done", "error": None} for file_id, name in files])
+
+    def record_error(self, file_id: str, file_name: Optional[str], error: str):
+        self.failed_files += 1
+        self._record_files([{"job_id": self.job_id, "file_id": file_id, "file_name": file_name, "status": "error", "error": error}])
+
+    def finish(self, status: str, message: str, error: Optional[str] = None):
+        self._stop.set()
+        if self._heartbeat is not None: self._heartbeat.join()
+        self.message = message
+        self._update(status=status, last_error=error, finished_at=utcnow(), lease_expires_at=None, **self._progress_values())
+
+    def abandon(self):
+        """Detiene el heartbeat sin tocar la fila (otro worker la tiene)."""
+        self._stop.set()
+
+
+def job_status(db: Session) -> dict:
+    """Estado del último trabajo para /api/drive/sync_status (mismo formato que el estado en memoria anterior)."""
+    job = db.query(SyncJob).order_by(SyncJob.id.desc()).first()
+    last_success = db.query(SyncJob.finished_at).filter(SyncJob.status == "success").order_by(SyncJob.id.desc()).first()
+    last_success_time = last_success[0].replace(tzinfo=timezone.utc).isoformat() if last_success and last_success[0] else None
+    if job is None:
+        return {"status": "idle", "message": "No iniciada", "last_error": None, "last_success_time": None, "processed_files": 0, "total_files": 0}
+    status, message = ("syncing" if job.status in ACTIVE_STATUSES else job.status), job.message
+    if is_resumable(job):
+        status, message = "error", "La sincronización se interrumpió (el worker dejó de responder); se reanudará en la próxima sincronización."
+    errors = (db.query(SyncJobFile).filter(SyncJobFile.job_id == job.id, SyncJobFile.status == "error")
+              .order_by(SyncJobFile.updated_at.desc()).limit(SYNC_STATUS_ERROR_LIMIT).all())
+    return {"status": status, "message": message, "last_error": job.last_error, "last_success_time": last_success_time,
+            "processed_files": job.processed_files, "total_files": job.total_files, "failed_files": job.failed_files,
+            "job_id": job.id, "attempts": job.attempts, "full": bool(job.full),
+            "started_at": job.started_at.replace(tzinfo=timezone.utc).isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.replace(tzinfo=timezone.utc).isoformat() if job.finished_at else None,
+            "file_errors": [{"file_id": e.file_id, "file_name": e.file_name, "error": e.error} for e in errors]}
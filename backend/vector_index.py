@@ -0,0 +1,449 @@
+"""Índice vectorial FAISS con actualizaciones incrementales.
+
+Los vectores se guardan usando como ID estable el `NoteChunk.id` (entero) de
+cada fragmento (en un `IndexIDMap2`, salvo los IVF, que guardan el id de cada
+vector en sus listas), de modo que una sincronización solo añade,
+reemplaza o elimina los vectores que ha tocado. Los cambios posteriores al
+último snapshot se registran en un delta log (JSON lines) que se reaplica al
+arrancar; cuando el log crece demasiado se compacta en un snapshot nuevo.
+
+El tipo de índice interno se elige con `FAISS_INDEX_TYPE` (flat, ivf_flat,
+ivf_pq, hnsw). Los tipos IVF necesitan entrenamiento: mientras no haya
+suficientes vectores se usa un índice flat exacto.
+
+Para arrancar rápido el snapshot se abre con mmap (`FAISS_MMAP`): los códigos
+del índice y el mapa de ids (un array NumPy ordenado, `ChunkIdMap`) se leen de
+la caché de páginas del sistema, compartida entre varios procesos worker, en
+lugar de copiarse a la memoria de cada uno.
+
+Las búsquedas y los cambios de un índice en memoria se coordinan con un cerrojo
+de lectura/escritura (`ReadWriteLock`): varias búsquedas a la vez, o un cambio
+incremental en el sitio sin copiar el índice entero.
+"""
+import base64
+import json
+import os
+import threading
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+
+from backend.embeddings import EMBEDDING_DIMENSION
+
+FAISS_INDEX_PATH = "faiss_index.idx" # Guardado en el directorio backend/
+FAISS_MAP_PATH = "faiss_map.json"   # Formato anterior; los snapshots nuevos usan un .npy (ver ChunkIdMap)
+FAISS_DELTA_LOG_PATH = "faiss_delta.log"
+# Compactar cuando el log supere este número de entradas o esta fracción del índice.
+DELTA_LOG_COMPACT_MIN_ENTRIES = 1000
+DELTA_LOG_COMPACT_RATIO = 0.2
+# Tabla de la que salen los IDs del índice; un snapshot con otra fuente se descarta.
+INDEX_ID_SOURCE = "note_chunks"
+
+# --- Tipos de índice ---
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+if FAISS_INDEX_TYPE not in INDEX_TYPES:
+    print(f"FAISS_INDEX_TYPE '{FAISS_INDEX_TYPE}' no soportado; se usará flat.")
+    FAISS_INDEX_TYPE = "flat"
+FAISS_IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0")) # 0 = automático (~4*sqrt(n))
+FAISS_IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64")) # Subcuantizadores; debe dividir la dimensión
+FAISS_PQ_NBITS = 8
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv("FAISS_HNSW_EF_CONSTRUCTION", "200"))
+FAISS_HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+MIN_TRAINING_POINTS_PER_CENTROID = 39 # Por debajo de esto FAISS avisa de que el clustering es poco fiable
+# IO_FLAG_MMAP_IFC mapea los códigos de flat/HNSW/IVF sin copiarlos; IO_FLAG_MMAP solo cubre las listas IVF
+# y deja un índice que no se puede copiar. Sin soporte en la versión de FAISS instalada se lee normalmente.
+FAISS_MMAP = os.getenv("FAISS_MMAP", "1") == "1"
+FAISS_MMAP_IO_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+
+MIN_IVF_NLIST = 16 # Con menos listas un índice IVF no aporta nada frente a flat
+
+
+def ivf_nlist_for(n_vectors: int) -> int:
+    if FAISS_IVF_NLIST > 0: return FAISS_IVF_NLIST
+    return max(1, min(65536, int(4 * np.sqrt(max(n_vectors, 1))), n_vectors // MIN_TRAINING_POINTS_PER_CENTROID))
+
+def min_training_vectors(index_type: str, n_vectors: int) -> int:
+    """Número de vectores necesario para entrenar `index_type` (0 si no requiere entrenamiento)."""
+    if index_type == "ivf_flat": return max(ivf_nlist_for(n_vectors), MIN_IVF_NLIST) * MIN_TRAINING_POINTS_PER_CENTROID
+    if index_type == "ivf_pq":
+        return max(ivf_nlist_for(n_vectors), 2 ** FAISS_PQ_NBITS) * MIN_TRAINING_POINTS_PER_CENTROID
+    return 0
+
+def effective_index_type(index_type: str, n_vectors: int) -> str:
+    """Tipo que se puede construir realmente con `n_vectors` (flat si aún no se puede entrenar)."""
+    return index_type if n_vectors >= min_training_vectors(index_type, n_vectors) else "flat"
+
+def create_faiss_index(index_type: str, dimension: int, training_vectors: Optional[np.ndarray] = None) -> faiss.Index:
+    """Crea (y entrena si hace falta) el índice: IVF tal cual y el resto envuelto en un IndexIDMap2."""
+    if index_type == "flat":
+        inner = faiss.IndexFlatL2(dimension)
+    elif index_type == "hnsw":
+        inner = faiss.IndexHNSWFlat(dimension, FAISS_HNSW_M)
+        inner.hnsw.efConstruction = FAISS_HNSW_EF_CONSTRUCTION; inner.hnsw.efSearch = FAISS_HNSW_EF_SEARCH
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        if training_vectors is None or len(training_vectors) == 0: raise ValueError(f"El índice {index_type} necesita vectores de entrenamiento.")
+        nlist = min(ivf_nlist_for(len(training_vectors)), len(training_vectors))
+        quantizer = faiss.IndexFlatL2(dimension)
+        if index_type == "ivf_flat": inner = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+        else: inner = faiss.IndexIVFPQ(quantizer, dimension, nlist, FAISS_PQ_M, FAISS_PQ_NBITS)
+        inner.train(training_vectors); inner.nprobe = min(FAISS_IVF_NPROBE, nlist)
+        # Sin IndexIDMap: IVF ya admite ids propios, y al borrar no renumera sus ids internos como supone el wrapper
+        return inner
+    else:
+        raise ValueError(f"Tipo de índice FAISS desconocido: {index_type}")
+    return faiss.IndexIDMap2(inner) # El wrapper de Python mantiene vivas las referencias internas
+
+def index_type_of(index: faiss.Index) -> str:
+    inner = faiss.downcast_index(index.index) if hasattr(index, "index") else faiss.downcast_index(index)
+    if isinstance(inner, faiss.IndexIVFPQ): return "ivf_pq"
+    if isinstance(inner, faiss.IndexIVFFlat): return "ivf_flat"
+    if isinstance(inner, faiss.IndexHNSW): return "hnsw"
+    return "flat"
+
+
+def _as_float32_matrix(vectors) -> np.ndarray:
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    if matrix.ndim == 1: matrix = matrix.reshape(1, -1)
+    return matrix
+
+def _as_id_array(ids: Iterable[int]) -> np.ndarray:
+    return np.ascontiguousarray(np.fromiter((int(i) for i in ids), dtype=np.int64))
+
+def _normalized_copy(vectors, dimension: int) -> np.ndarray:
+    matrix = _as_float32_matrix(vectors).copy()
+    if matrix.shape[1] != dimension: raise ValueError(f"Dimensión {matrix.shape[1]} distinta de {dimension}.")
+    faiss.normalize_L2(matrix)
+    return matrix
+
+
+class ChunkIdMap(MutableMapping):
+    """Mapa NoteChunk.id -> Note.id sobre un array ordenado (de solo lectura, mmap) más los cambios posteriores.
+
+    El array base es el del snapshot (`id` int64, `note_id` bytes) y se consulta
+    con búsqueda binaria; los cambios aplicados en memoria van a `_overlay` y
+    `_removed` hasta que el siguiente snapshot los integra en un array nuevo.
+    """
+
+    def __init__(self, base: Optional[np.ndarray] = None):
+        self._base = base if base is not None else np.empty(0, dtype=[("id", "<i8"), ("note_id", "S1")])
+        self._base_ids = self._base["id"]
+        self._overlay: Dict[int, str] = {}
+        self._removed: set = set()
+        self._size = len(self._base)
+
+    @classmethod
+    def from_items(cls, items: Iterable[Tuple[int, str]]) -> "ChunkIdMap":
+        id_map = cls(); id_map.update(items)
+        return id_map
+
+    def _base_get(self, vector_id: int) -> Optional[str]:
+        position = int(np.searchsorted(self._base_ids, vector_id))
+        if position < len(self._base_ids) and self._base_ids[position] == vector_id: return self._base["note_id"][position].decode("utf-8")
+        return None
+
+    def __getitem__(self, vector_id: int) -> str:
+        vector_id = int(vector_id)
+        if vector_id in self._overlay: return self._overlay[vector_id]
+        note_id = self._base_get(vector_id) if vector_id not in self._removed else None
+        if note_id is None: raise KeyError(vector_id)
+        return note_id
+
+    def __contains__(self, vector_id) -> bool:
+        try: self[vector_id]
+        except (KeyError, TypeError, ValueError): return False
+        return True
+
+    def __setitem__(self, vector_id: int, note_id: str):
+        vector_id = int(vector_id)
+        if vector_id not in self: self._size += 1
+        self._overlay[vector_id] = note_id; self._removed.discard(vector_id)
+
+    def __delitem__(self, vector_id: int):
+        vector_id = int(vector_id)
+        if vector_id not in self: raise KeyError(vector_id)
+        self._overlay.pop(vector_id, None)
+        if self._base_get(vector_id) is not None: self._removed.add(vector_id)
+        self._size -= 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[int]:
+        for vector_id in self._base_ids.tolist():
+            if vector_id not in self._removed and vector_id not in self._overlay: yield vector_id
+        yield from list(self._overlay)
+
+    def copy(self) -> "ChunkIdMap":
+        """Copia que comparte el array base (inmutable) y duplica solo los cambios."""
+        copied = ChunkIdMap(self._base)
+        copied._overlay, copied._removed, copied._size = dict(self._overlay), set(self._removed), self._size
+        return copied
+
+    def to_array(self) -> np.ndarray:
+        """Array ordenado por id con el contenido actual (base + cambios), listo para `np.save`."""
+        keep = np.ones(len(self._base), dtype=bool)
+        changed = np.fromiter(set(self._overlay) | self._removed, dtype=np.int64)
+        if len(changed): keep &= ~np.isin(self._base_ids, changed)
+        overlay = [(vector_id, note_id.encode("utf-8")) for vector_id, note_id in self._overlay.items()]
+        width = max([self._base.dtype["note_id"].itemsize] + [len(note_id) for _, note_id in overlay])
+        array = np.empty(int(keep.sum()) + len(overlay), dtype=[("id", "<i8"), ("note_id", f"S{width}")])
+        array[:int(keep.sum())] = self._base[keep]
+        if overlay: array[int(keep.sum()):] = overlay
+        return array[np.argsort(array["id"], kind="stable")]
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "ChunkIdMap":
+        array = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+        if array.dtype.names != ("id", "note_id"): raise ValueError(f"Formato de mapa FAISS desconocido en {path}")
+        return cls(array)
+
+
+class ReadWriteLock:
+    """Varios lectores a la vez o un solo escritor. Los escritores tienen preferencia para que un flujo continuo de búsquedas no los deje esperando."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0; self._writer = False; self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writer or self._waiting_writers: self._condition.wait()
+            self._readers += 1
+        try: yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers: self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers: self._condition.wait()
+            finally: self._waiting_writers -= 1
+            self._writer = True
+        try: yield
+        finally:
+            with self._condition: self._writer = False; self._condition.notify_all()
+
+
+class NoteVectorIndex:
+    """Índice FAISS direccionado por `NoteChunk.id` con el mapa a `Note.id` incluido.
+
+    `search_ids*` toman el cerrojo en modo lectura; quien modifica un índice que
+    ya se está sirviendo debe hacerlo dentro de `exclusive()`.
+    """
+
+    def __init__(self, index: Optional[faiss.Index] = None, id_to_note_id: Optional[Mapping[int, str]] = None,
+                 dimension: int = EMBEDDING_DIMENSION, mmapped: bool = False):
+        self.dimension = dimension
+        self.index = index if index is not None else create_faiss_index("flat", dimension)
+        self.index_type = index_type_of(self.index)
+        if isinstance(id_to_note_id, ChunkIdMap): self.id_to_note_id = id_to_note_id.copy()
+        else: self.id_to_note_id = ChunkIdMap.from_items((id_to_note_id or {}).items())
+        self.mmapped = mmapped # Códigos en un fichero mapeado: el índice no se puede modificar en el sitio
+        self._lock = ReadWriteLock()
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    @property
+    def supports_remove(self) -> bool:
+        # HNSW no admite borrado, y un IVF envuelto en IndexIDMap (snapshots anteriores) se desalinea al borrar:
+        # los cambios obligan a reconstruir
+        return self.index_type != "hnsw" and not self.has_ivf_id_map
+
+    @property
+    def has_ivf_id_map(self) -> bool:
+        """True si es un IVF dentro de un IndexIDMap, formato anterior que hay que reconstruir."""
+        return self.index_type in ("ivf_flat", "ivf_pq") and hasattr(self.index, "id_map")
+
+    @classmethod
+    def build(cls, ids: Sequence[int], note_ids: Sequence[str], vectors, dimension: int = EMBEDDING_DIMENSION,
+              index_type: str = FAISS_INDEX_TYPE) -> "NoteVectorIndex":
+        matrix = _normalized_copy(vectors, dimension)
+        built_type = effective_index_type(index_type, len(matrix))
+        if built_type != index_type:
+            print(f"Solo {len(matrix)} vectores: se usa un índice flat hasta poder entrenar {index_type} ({min_training_vectors(index_type, len(matrix))} necesarios).")
+        vector_index = cls(index=create_faiss_index(built_type, dimension, matrix), dimension=dimension)
+        vector_index._add_normalized(_as_id_array(ids), note_ids, matrix)
+        return vector_index
+
+    def copy(self) -> "NoteVectorIndex":
+        """Copia independiente (índice y mapa) para aplicar cambios sin tocar una versión que se está sirviendo.
+
+        `clone_index` comparte los códigos de un índice mapeado y FAISS aborta al
+        ampliarlos, así que en ese caso la copia se hace serializando.
+        """
+        index = faiss.deserialize_index(faiss.serialize_index(self.index)) if self.mmapped else faiss.clone_index(self.index)
+        return NoteVectorIndex(index=index, id_to_note_id=self.id_to_note_id, dimension=self.dimension)
+
+    def exclusive(self):
+        """Excluye las búsquedas mientras se modifica en el sitio un índice publicado."""
+        return self._lock.write()
+
+    def should_upgrade_to(self, index_type: str = FAISS_INDEX_TYPE) -> bool:
+        """True si el tipo configurado difiere del actual y ya puede construirse con los vectores presentes."""
+        return self.index_type != index_type and effective_index_type(index_type, self.ntotal) == index_type
+
+    def upsert(self, ids: Sequence[int], note_ids: Sequence[str], vectors):
+        """Añade o reemplaza los vectores de `ids`. Los vectores se normalizan (L2) aquí."""
+        if len(ids) == 0: return
+        if self.mmapped: raise RuntimeError("El índice está mapeado desde disco; los cambios se aplican sobre copy()")
+        matrix = _normalized_copy(vectors, self.dimension)
+        id_array = _as_id_array(ids)
+        if self.supports_remove: self.index.remove_ids(id_array)
+        elif any(vector_id in self.id_to_note_id for vector_id in id_array.tolist()):
+            raise RuntimeError(f"El índice {self.index_type} no admite reemplazar vectores; es necesario reconstruirlo")
+        self._add_normalized(id_array, note_ids, matrix)
+
+    def _add_normalized(self, id_array: np.ndarray, note_ids: Sequence[str], matrix: np.ndarray):
+        self.index.add_with_ids(matrix, id_array)
+        for vector_id, note_id in zip(id_array.tolist(), note_ids): self.id_to_note_id[vector_id] = note_id
+
+    def remove(self, ids: Sequence[int]) -> int:
+        if len(ids) == 0: return 0
+        if self.mmapped: raise RuntimeError("El índice está mapeado desde disco; los cambios se aplican sobre copy()")
+        if not self.supports_remove: raise RuntimeError(f"El índice {self.index_type} no admite borrado; es necesario reconstruirlo")
+        id_array = _as_id_array(ids)
+        removed = self.index.remove_ids(id_array)
+        for vector_id in id_array.tolist(): self.id_to_note_id.pop(vector_id, None)
+        return removed
+
+    @staticmethod
+    def id_selector(ids: Iterable[int]) -> faiss.IDSelector:
+        """Selector que restringe la búsqueda a estos ids de vector (se evalúa durante la búsqueda, no después)."""
+        id_array = _as_id_array(ids)
+        selector = faiss.IDSelectorBatch(len(id_array), faiss.swig_ptr(id_array))
+        selector.referenced_ids = id_array # IDSelectorBatch copia los ids, pero así no depende de ello
+        return selector
+
+    def search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None, selector: Optional[faiss.IDSelector] = None):
+        """Parámetros de búsqueda por petición (no modifican el índice compartido).
+
+        Al fijar un selector hay que rellenar también nprobe/efSearch: si no, los
+        parámetros por petición pisarían los del índice con los valores por defecto de FAISS.
+        """
+        if self.index_type in ("ivf_flat", "ivf_pq") and (nprobe or selector is not None):
+            params = faiss.SearchParametersIVF(nprobe=nprobe or faiss.extract_index_ivf(self.index).nprobe)
+        elif self.index_type == "hnsw" and (ef_search or selector is not None):
+            params = faiss.SearchParametersHNSW(efSearch=ef_search or faiss.downcast_index(self.index.index).hnsw.efSearch)
+        elif selector is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if selector is not None: params.sel = selector
+        return params
+
+    def search_ids(self, query_np: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                   selector: Optional[faiss.IDSelector] = None) -> Tuple[List[float], List[int]]:
+        """Busca un vector de consulta (ya normalizado). Devuelve (distancias, ids de vector) ordenados.
+
+        Con `selector` solo se consideran los vectores que acepta (ver `id_selector`).
+        """
+        return self.search_ids_batch(query_np, k, nprobe, ef_search, selector)[0]
+
+    def search_ids_batch(self, query_np: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                         selector: Optional[faiss.IDSelector] = None) -> List[Tuple[List[float], List[int]]]:
+        """Como `search_ids` para una matriz de consultas (una por fila) en una sola llamada a FAISS."""
+        with self._lock.read():
+            params = self.search_params(nprobe, ef_search, selector)
+            if params is not None: distances, labels = self.index.search(_as_float32_matrix(query_np), k, params=params)
+            else: distances, labels = self.index.search(_as_float32_matrix(query_np), k)
+            results = []
+            for row_distances, row_labels in zip(distances.tolist(), labels.tolist()):
+                found_distances, found_ids = [], []
+                for distance, label in zip(row_distances, row_labels):
+                    if label == -1 or label not in self.id_to_note_id: continue
+                    found_distances.append(distance); found_ids.append(label)
+                results.append((found_distances, found_ids))
+            return results
+
+    def search(self, query_np: np.ndarray, k: int, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> Tuple[List[float], List[str]]:
+        """Como `search_ids`, pero devuelve los `Note.id` de cada vector encontrado."""
+        distances, ids = self.search_ids(query_np, k, nprobe, ef_search)
+        # Un cambio en el sitio posterior a la búsqueda puede haber quitado alguno del mapa
+        found = [(distance, note_id) for distance, note_id in zip(distances, (self.id_to_note_id.get(vector_id) for vector_id in ids)) if note_id is not None]
+        return [distance for distance, _ in found], [note_id for _, note_id in found]
+
+    # --- Persistencia ---
+    def write_index(self, index_path: str):
+        faiss.write_index(self.index, index_path)
+
+    def write_map(self, map_path: str):
+        """Guarda el mapa como array NumPy ordenado (.npy); `map_path` puede no acabar en .npy (temporales)."""
+        with open(map_path, 'wb') as f: np.save(f, self.id_to_note_id.to_array(), allow_pickle=False)
+
+    def save(self, index_path: str = FAISS_INDEX_PATH, map_path: str = FAISS_MAP_PATH):
+        self.write_index(index_path); self.write_map(map_path)
+
+    @classmethod
+    def load(cls, index_path: str = FAISS_INDEX_PATH, map_path: str = FAISS_MAP_PATH, mmap: bool = False) -> "NoteVectorIndex":
+        """Carga un snapshot. Con `mmap` el índice y el mapa se leen de ficheros mapeados (solo lectura)."""
+        mmap = mmap and FAISS_MMAP_IO_FLAG is not None
+        index = faiss.read_index(index_path, FAISS_MMAP_IO_FLAG if mmap else 0)
+        if map_path.endswith(".json"): id_map = cls._load_json_map(map_path)
+        else: id_map = ChunkIdMap.load(map_path, mmap=mmap)
+        return cls(index=index, id_to_note_id=id_map, dimension=index.d, mmapped=mmap)
+
+    @staticmethod
+    def _load_json_map(map_path: str) -> ChunkIdMap:
+        with open(map_path, 'r') as f:
+            loaded_map = json.load(f)
+        # Los snapshots antiguos guardaban una lista (posicional o por Embedding.id) en lugar de este objeto.
+        if not isinstance(loaded_map, dict) or loaded_map.get("source") != INDEX_ID_SOURCE:
+            raise ValueError("Formato de mapa FAISS antiguo; es necesario reconstruir el índice.")
+        return ChunkIdMap.from_items((int(vector_id), note_id) for vector_id, note_id in loaded_map["ids"])
+
+
+def needs_compaction(delta_entries: int, ntotal: int) -> bool:
+    """True si el delta log ha crecido lo bastante como para reescribir el snapshot."""
+    return delta_entries >= max(DELTA_LOG_COMPACT_MIN_ENTRIES, int(ntotal * DELTA_LOG_COMPACT_RATIO))
+
+
+# --- Delta log ---
+def _encode_vector(vector) -> str:
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+def _decode_vector(encoded: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32)
+
+def append_delta_log(upserts: Sequence[Tuple[int, str, Sequence[float]]], removed_ids: Sequence[int] = (),
+                     path: str = FAISS_DELTA_LOG_PATH) -> int:
+    """Añade al log las operaciones aplicadas al índice desde el último snapshot, en el mismo orden: borrados y después upserts."""
+    entries = 0
+    with open(path, 'a') as f:
+        for vector_id in removed_ids:
+            f.write(json.dumps({"op": "remove", "id": int(vector_id)}) + "\n"); entries += 1
+        for vector_id, note_id, vector in upserts:
+            f.write(json.dumps({"op": "upsert", "id": int(vector_id), "note_id": note_id, "vector": _encode_vector(vector)}) + "\n"); entries += 1
+        f.flush(); os.fsync(f.fileno())
+    return entries
+
+def replay_delta_log(vector_index: NoteVectorIndex, path: str = FAISS_DELTA_LOG_PATH) -> int:
+    """Reaplica el log, en orden, sobre un índice cargado del snapshot. Las operaciones son idempotentes."""
+    if not os.path.exists(path): return 0
+    entries = 0
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try: entry = json.loads(line)
+            except json.JSONDecodeError: print("Entrada incompleta al final del delta log FAISS; se ignora."); break
+            if entry["op"] == "upsert": vector_index.upsert([entry["id"]], [entry["note_id"]], _decode_vector(entry["vector"]))
+            elif entry["op"] == "remove": vector_index.remove([entry["id"]])
+            entries += 1
+    return entries
+
+def clear_delta_log(path: str = FAISS_DELTA_LOG_PATH):
+    if os.path.exists(path): os.remove(path)
@@ -0,0 +1,50 @@
+"""Almacenamiento binario de embeddings en la base de datos.
+
+Los vectores se guardan como BLOB con los bytes crudos del array (float32 por
+defecto, float16 opcional vía `EMBEDDING_STORAGE_DTYPE`). El loader lee todas
+las filas directamente en una matriz NumPy preasignada con `np.frombuffer`,
+sin pasar por listas de Python.
+"""
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.database_models import NoteChunk
+from backend.embeddings import EMBEDDING_DIMENSION
+
+SUPPORTED_STORAGE_DTYPES = ("float32", "float16")
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32")
+if EMBEDDING_STORAGE_DTYPE not in SUPPORTED_STORAGE_DTYPES:
+    print(f"EMBEDDING_STORAGE_DTYPE '{EMBEDDING_STORAGE_DTYPE}' no soportado; se usará float32.")
+    EMBEDDING_STORAGE_DTYPE = "float32"
+LOAD_BATCH_SIZE = 2000
+
+
+def encode_vector(vector: Sequence[float], dtype: str = EMBEDDING_STORAGE_DTYPE) -> bytes:
+    return np.asarray(vector, dtype=dtype).tobytes()
+
+def decode_vector(blob: bytes, dtype: str = "float32") -> np.ndarray:
+    return np.frombuffer(blob, dtype=dtype).astype(np.float32, copy=False)
+
+def load_embedding_matrix(db: Session, dimension: int = EMBEDDING_DIMENSION, model=NoteChunk) -> Tuple[List[int], List[str], np.ndarray]:
+    """Carga todos los vectores de `model` en una matriz float32 (n, dimension).
+
+    Devuelve (ids de fila, Note.ids, matriz). Las filas con un tamaño de blob
+    que no corresponde a `dimension` se omiten.
+    """
+    total = db.query(func.count(model.id)).scalar() or 0
+    matrix = np.empty((total, dimension), dtype=np.float32)
+    embedding_ids: List[int] = []; note_ids: List[str] = []
+    row = 0
+    rows = db.query(model.id, model.note_id, model.vector, model.vector_dtype).yield_per(LOAD_BATCH_SIZE)
+    for embedding_id, note_id, blob, dtype in rows:
+        if row >= total: break # Filas insertadas después del COUNT
+        itemsize = np.dtype(dtype or "float32").itemsize
+        if blob is None or len(blob) != dimension * itemsize:
+            print(f"Dimensión incorrecta para note_id {note_id}. Omitiendo."); continue
+        matrix[row] = np.frombuffer(blob, dtype=dtype or "float32")
+        embedding_ids.append(embedding_id); note_ids.append(note_id); row += 1
+    return embedding_ids, note_ids, matrix[:row]
@@ -13,7 +13,7 @@ import { useChat } from './hooks/useChat';
 
 function App() {
   const [activeTab, setActiveTab] = useState('sync');
-  const { notes, stats, isLoading, syncFromGoogleDrive, searchNotes } = useKnowledgeBase();
+  const { notes, stats, isLoading, syncFromGoogleDrive, searchNotes, hasMoreNotes, loadMoreNotes, fetchNoteDetail, searchNoteIdsByContent } = useKnowledgeBase();
   const { messages, isLoading: isChatLoading, sendMessage, clearChat } = useChat();
 
   const renderContent = () => {
@@ -30,7 +30,7 @@ function App() {
       case 'search':
         return <SearchInterface onSearch={searchNotes} notes={notes} />;
       case 'library':
-        return <Library notes={notes} />;
+        return <Library notes={notes} hasMoreNotes={hasMoreNotes} onLoadMore={() => loadMoreNotes()} fetchNoteDetail={fetchNoteDetail} searchNoteIdsByContent={searchNoteIdsByContent} />;
       case 'analytics':
         return <Analytics notes={notes} stats={stats} />;
       case 'custom-gpt':
@@ -1,4 +1,4 @@
-import React, { useState, useMemo, useCallback } from 'react'; // useCallback añadido
+import React, { useState, useMemo, useCallback, useEffect } from 'react'; // useCallback añadido
 import { BookOpen, Search, Filter, Calendar, FileText, Hash } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Note } from '../types';
@@ -7,10 +7,31 @@ import NoteDetailModal from './NoteDetailModal'; // Importar el modal
 
 interface LibraryProps {
   notes: Note[];
+  hasMoreNotes?: boolean;
+  onLoadMore?: () => void;
+  fetchNoteDetail?: (noteId: string) => Promise<Note>;
+  searchNoteIdsByContent?: (query: string) => Promise<Set<string>>;
 }
 
-const Library: React.FC<LibraryProps> = ({ notes }) => {
+const Library: React.FC<LibraryProps> = ({ notes, hasMoreNotes, onLoadMore, fetchNoteDetail, searchNoteIdsByContent }) => {
   const [searchQuery, setSearchQuery] = useState('');
+  // Notas cuyo contenido completo coincide con la búsqueda (las tarjetas solo tienen el extracto)
+  const [contentMatchIds, setContentMatchIds] = useState<Set<string> | null>(null);
+
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (!query || !searchNoteIdsByContent) {
+      setContentMatchIds(null);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      searchNoteIdsByContent(query)
+        .then(ids => { if (!cancelled) setContentMatchIds(ids); })
+        .catch(error => console.error('Error searching note contents:', error));
+    }, 300);
+    return () => { cancelled = true; clearTimeout(timer); };
+  }, [searchQuery, searchNoteIdsByContent]);
   const [sortBy, setSortBy] = useState<'modified' | 'created' | 'title' | 'wordCount'>('modified');
   const [selectedTag, setSelectedTag] = useState<string>('');
 
@@ -45,7 +66,8 @@ const Library: React.FC<LibraryProps> = ({ notes }) => {
       const query = searchQuery.toLowerCase();
       filtered = filtered.filter(note =>
         note.title.toLowerCase().includes(query) ||
-        note.content.toLowerCase().includes(query) ||
+        (note.content || note.excerpt || '').toLowerCase().includes(query) ||
+        contentMatchIds?.has(note.id) ||
         note.tags.some(tag => tag.toLowerCase().includes(query))
       );
     }
@@ -69,7 +91,7 @@ const Library: React.FC<LibraryProps> = ({ notes }) => {
           return new Date(b.modified).getTime() - new Date(a.modified).getTime();
       }
     });
-  }, [notes, searchQuery, sortBy, selectedTag]);
+  }, [notes, searchQuery, contentMatchIds, sortBy, selectedTag]);
 
   return (
     <div className="max-w-7xl mx-auto p-6">
@@ -193,10 +215,13 @@ const Library: React.FC<LibraryProps> = ({ notes }) => {
           )}
         </AnimatePresence>
 
-        {/* Load More (placeholder for pagination) */}
-        {filteredAndSortedNotes.length > 0 && filteredAndSortedNotes.length >= 12 && (
+        {/* Load More: siguiente página del backend (paginación por cursor) */}
+        {hasMoreNotes && onLoadMore && (
           <div className="text-center mt-8">
-            <button className="bg-white border border-gray-300 text-gray-700 px-6 py-3 rounded-lg hover:bg-gray-50 transition-colors">
+            <button
+              onClick={onLoadMore}
+              className="bg-white border border-gray-300 text-gray-700 px-6 py-3 rounded-lg hover:bg-gray-50 transition-colors"
+            >
               Load More Notes
             </button>
           </div>
@@ -207,6 +232,7 @@ const Library: React.FC<LibraryProps> = ({ notes }) => {
         note={selectedNote}
         isOpen={isModalOpen}
         onClose={handleCloseModal}
+        fetchNoteDetail={fetchNoteDetail}
       />
     </div>
   );
@@ -68,7 +68,7 @@ const NoteCard: React.FC<NoteCardProps> = ({ note, searchMatches, relevanceScore
       </div>
 
       <p className="text-gray-600 mb-4 line-clamp-3">
-        {getPreview(note.content)}
+        {getPreview(note.content || note.excerpt || '')}
       </p>
 
       <div className="flex items-center justify-between">
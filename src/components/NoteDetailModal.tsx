@@ -1,4 +1,4 @@
-import React from 'react';
+import React, { useEffect, useState } from 'react';
 import { X, FileText, Calendar, Hash, ExternalLink } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 import ReactMarkdown from 'react-markdown';
@@ -9,9 +9,26 @@ interface NoteDetailModalProps {
   note: Note | null;
   isOpen: boolean;
   onClose: () => void;
+  // Carga la nota completa: el listado paginado de la biblioteca no incluye el contenido
+  fetchNoteDetail?: (noteId: string) => Promise<Note>;
 }
 
-const NoteDetailModal: React.FC<NoteDetailModalProps> = ({ note, isOpen, onClose }) => {
+const NoteDetailModal: React.FC<NoteDetailModalProps> = ({ note, isOpen, onClose, fetchNoteDetail }) => {
+  const [content, setContent] = useState<string>(note?.content || '');
+  const [isLoadingContent, setIsLoadingContent] = useState(false);
+
+  useEffect(() => {
+    setContent(note?.content || '');
+    if (!isOpen || !note || note.content || !fetchNoteDetail) return;
+    let cancelled = false;
+    setIsLoadingContent(true);
+    fetchNoteDetail(note.id)
+      .then(fullNote => { if (!cancelled) setContent(fullNote.content); })
+      .catch(error => { if (!cancelled) { console.error('Error loading note detail:', error); setContent(note.excerpt || ''); } })
+      .finally(() => { if (!cancelled) setIsLoadingContent(false); });
+    return () => { cancelled = true; };
+  }, [note, isOpen, fetchNoteDetail]);
+
   if (!note) return null;
 
   const formatDate = (date: Date) => {
@@ -88,9 +105,13 @@ const NoteDetailModal: React.FC<NoteDetailModalProps> = ({ note, isOpen, onClose
               </div>
 
               <article className="prose prose-sm lg:prose-base max-w-none">
-                <ReactMarkdown remarkPlugins={[remarkGfm]}>
-                  {note.content}
-                </ReactMarkdown>
+                {isLoadingContent ? (
+                  <p className="text-gray-500">Cargando nota...</p>
+                ) : (
+                  <ReactMarkdown remarkPlugins={[remarkGfm]}>
+                    {content}
+                  </ReactMarkdown>
+                )}
               </article>
             </div>
 
@@ -1,55 +1,119 @@
-import { useState, useCallback } from 'react';
+import { useState, useCallback, useRef, useEffect } from 'react';
 import { ChatMessage, Note } from '../types';
 
+// Lee un cuerpo text/event-stream y entrega cada evento (nombre + datos JSON) a medida que llega
+const readServerSentEvents = async (
+  body: ReadableStream<Uint8Array>,
+  onEvent: (event: string, data: { delta?: string; detail?: string; sources?: { id: string }[] }) => void,
+) => {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      const dataLines: string[] = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+      }
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+    }
+  }
+};
+
 export const useChat = () => {
   const [messages, setMessages] = useState<ChatMessage[]>([]);
-  const [isLoading, setIsLoading] = useState(false);
+  const [isLoading, setIsLoading] = useState(false); // Hasta el primer token
+  const [isStreaming, setIsStreaming] = useState(false); // Mientras llegan tokens
+  const abortControllerRef = useRef<AbortController | null>(null);
+
+  // Cancelar la generación en curso: al cortar la conexión el backend deja de pedir tokens a OpenAI
+  const stopGeneration = useCallback(() => {
+    abortControllerRef.current?.abort();
+    abortControllerRef.current = null;
+    setIsLoading(false);
+    setIsStreaming(false);
+  }, []);
+
+  useEffect(() => stopGeneration, [stopGeneration]);
 
   const sendMessage = useCallback(async (content: string, relevantNotes: Note[] = []) => {
+    stopGeneration();
+    const abortController = new AbortController();
+    abortControllerRef.current = abortController;
+
     const userMessage: ChatMessage = {
       id: Math.random().toString(36).substr(2, 9),
       type: 'user',
       content,
       timestamp: new Date(),
     };
+    const assistantId = Math.random().toString(36).substr(2, 9);
+    let sources = relevantNotes.slice(0, 3);
 
     setMessages(prev => [...prev, userMessage]);
     setIsLoading(true);
 
+    const appendToAssistant = (delta: string) => {
+      setIsLoading(false);
+      setIsStreaming(true);
+      setMessages(prev => {
+        if (!prev.some(message => message.id === assistantId)) {
+          return [...prev, {
+            id: assistantId,
+            type: 'assistant',
+            content: delta,
+            timestamp: new Date(),
+            sources,
+          }];
+        }
+        return prev.map(message => message.id === assistantId ? { ...message, content: message.content + delta } : message);
+      });
+    };
+
     try {
       const requestBody = {
         message: content,
-        relevant_notes_content: relevantNotes.map(note => note.content).slice(0, 5) // Enviar contenido de hasta 5 notas
+        // Solo los ids: el backend recupera de esas notas los fragmentos relevantes y los ajusta a su presupuesto de tokens
+        note_ids: relevantNotes.slice(0, 5).map(note => note.id),
       };
 
       // Obtener la URL del backend desde las variables de entorno de Vite
       const backendApiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://localhost:3001/api';
 
-      const response = await fetch(`${backendApiUrl}/chat`, {
+      // Respuesta en streaming (SSE): cada token se muestra en cuanto llega
+      const response = await fetch(`${backendApiUrl}/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Accept': 'text/event-stream',
         },
         body: JSON.stringify(requestBody),
+        signal: abortController.signal,
       });
 
-      if (!response.ok) {
-        const errorData = await response.json();
-        throw new Error(errorData.error || `Error ${response.status} from AI service`);
+      if (!response.ok || !response.body) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.detail || errorData.error || `Error ${response.status} from AI service`);
       }
 
-      const data = await response.json();
-
-      const aiResponse: ChatMessage = {
-        id: Math.random().toString(36).substr(2, 9),
-        type: 'assistant',
-        content: data.reply,
-        timestamp: new Date(),
-        sources: relevantNotes.slice(0, 3), // Mantener las fuentes como antes
-      };
-
-      setMessages(prev => [...prev, aiResponse]);
+      await readServerSentEvents(response.body, (event, data) => {
+        if (event === 'sources' && data.sources) {
+          // Fuentes que realmente entraron en el contexto
+          const usedIds = new Set(data.sources.map(source => source.id));
+          sources = relevantNotes.filter(note => usedIds.has(note.id)).slice(0, 3);
+        } else if (event === 'token') appendToAssistant(data.delta ?? '');
+        else if (event === 'error') throw new Error(data.detail);
+      });
     } catch (error) {
+      if (abortController.signal.aborted) return; // Cancelada por el usuario o por un nuevo mensaje
       console.error('Error sending message to AI:', error);
       const errorResponse: ChatMessage = {
         id: Math.random().toString(36).substr(2, 9),
@@ -60,18 +124,25 @@ export const useChat = () => {
       };
       setMessages(prev => [...prev, errorResponse]);
     } finally {
-      setIsLoading(false);
+      if (abortControllerRef.current === abortController) {
+        abortControllerRef.current = null;
+        setIsLoading(false);
+        setIsStreaming(false);
+      }
     }
-  }, []);
+  }, [stopGeneration]);
 
   const clearChat = useCallback(() => {
+    stopGeneration();
     setMessages([]);
-  }, []);
+  }, [stopGeneration]);
 
   return {
     messages,
     isLoading,
+    isStreaming,
     sendMessage,
+    stopGeneration,
     clearChat,
   };
 };
@@ -1,8 +1,12 @@
-import { useState, useCallback } from 'react';
+import { useState, useCallback, useEffect } from 'react';
 import { Note, SearchResult, KnowledgeStats } from '../types';
 
+// Campos del listado de la biblioteca: sin el contenido completo, que se pide al abrir la nota (fetchNoteDetail)
+const NOTE_LIST_FIELDS = 'title,path,created_at,modified_at,drive_modified_time,source_url,word_count,tags,excerpt';
+
 export const useKnowledgeBase = () => {
   const [notes, setNotes] = useState<Note[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(false);
   const [stats, setStats] = useState<KnowledgeStats>({
     totalNotes: 0,
@@ -14,7 +18,8 @@ export const useKnowledgeBase = () => {
   // Helper para transformar la estructura de nota de la API (de /api/notes o /api/drive/files) a la del frontend
   const transformApiResponseToFrontendNote = (apiNoteData: any): Note => {
     const content = apiNoteData.content || '';
-    const wordCount = content.split(/\s+/).filter(Boolean).length;
+    // El listado no trae el contenido: el backend guarda word_count al sincronizar (se cuenta aquí solo si falta)
+    const wordCount = typeof apiNoteData.word_count === 'number' ? apiNoteData.word_count : content.split(/\s+/).filter(Boolean).length;
     // El backend en /api/drive/files devuelve 'modifiedTime', pero /api/notes devuelve 'drive_modified_time' y 'modified_at'
     // Usaremos 'drive_modified_time' si existe, sino 'modifiedTime' (de Drive), sino 'modified_at' (de BD)
     const modifiedDate = apiNoteData.drive_modified_time || apiNoteData.modifiedTime || apiNoteData.modified_at;
@@ -23,26 +28,37 @@ export const useKnowledgeBase = () => {
       id: apiNoteData.id,
       title: apiNoteData.title,
       content: content,
+      excerpt: apiNoteData.excerpt,
       tags: apiNoteData.tags ? (Array.isArray(apiNoteData.tags) && apiNoteData.tags.every(t => typeof t === 'string') ? apiNoteData.tags : apiNoteData.tags.map((tag: any) => tag.name || tag)) : [],
       created: new Date(apiNoteData.created_at || apiNoteData.createdTime || Date.now()), // Adaptar a campos de Drive/BD
       modified: new Date(modifiedDate || Date.now()),
       path: apiNoteData.path || `${apiNoteData.title}.md`,
       wordCount: wordCount,
+      matchedPassages: Array.isArray(apiNoteData.chunks) ? apiNoteData.chunks.map((chunk: any) => chunk.text) : undefined,
       // sourceUrl: apiNoteData.sourceUrl, // Descomentar si se añade al tipo Note y se usa
     };
   };
 
+  // Una página del listado; la siguiente se pide con el cursor que devuelve el backend en X-Next-Cursor
+  const fetchNotesPage = async (limit: number, cursor: string | null) => {
+    const backendApiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://localhost:3001/api';
+    const params = new URLSearchParams({ limit: String(limit), fields: NOTE_LIST_FIELDS });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${backendApiUrl}/notes?${params}`);
+    if (!response.ok) {
+      throw new Error(`Error fetching notes: ${response.statusText}`);
+    }
+    const apiNotes: any[] = await response.json();
+    return { notes: apiNotes.map(transformApiResponseToFrontendNote), cursor: response.headers.get('X-Next-Cursor') };
+  };
+
   const fetchInitialNotes = useCallback(async (limit: number = 50) => {
     setIsLoading(true);
     try {
-      const backendApiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://localhost:3001/api';
-      const response = await fetch(`${backendApiUrl}/notes?skip=0&limit=${limit}`);
-      if (!response.ok) {
-        throw new Error(`Error fetching initial notes: ${response.statusText}`);
-      }
-      const apiNotes: any[] = await response.json();
-      const fetchedNotes = apiNotes.map(transformApiResponseToFrontendNote);
+      const page = await fetchNotesPage(limit, null);
+      const fetchedNotes = page.notes;
       setNotes(fetchedNotes);
+      setNextCursor(page.cursor);
 
       // Actualizar estadísticas (simplificado, el backend debería dar el total real para totalNotes)
       const allTags = new Set<string>();
@@ -70,6 +86,45 @@ export const useKnowledgeBase = () => {
     fetchInitialNotes();
   }, [fetchInitialNotes]);
 
+  const loadMoreNotes = useCallback(async (limit: number = 50) => {
+    if (!nextCursor) return;
+    setIsLoading(true);
+    try {
+      const page = await fetchNotesPage(limit, nextCursor);
+      setNotes(prev => [...prev, ...page.notes]);
+      setNextCursor(page.cursor);
+    } catch (error) {
+      console.error('Error fetching more notes from API:', error);
+    } finally {
+      setIsLoading(false);
+    }
+  }, [nextCursor]);
+
+  // Nota completa (con contenido) para NoteDetailModal
+  const fetchNoteDetail = useCallback(async (noteId: string): Promise<Note> => {
+    const backendApiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://localhost:3001/api';
+    const response = await fetch(`${backendApiUrl}/notes/${encodeURIComponent(noteId)}`);
+    if (!response.ok) {
+      throw new Error(`Error fetching note ${noteId}: ${response.statusText}`);
+    }
+    return transformApiResponseToFrontendNote(await response.json());
+  }, []);
+
+  // Ids de las notas cuyo contenido completo coincide con `query` (FTS5 en /api/simple_search): el listado solo trae el extracto
+  const searchNoteIdsByContent = useCallback(async (query: string, limit: number = 200): Promise<Set<string>> => {
+    const backendApiUrl = import.meta.env.VITE_BACKEND_API_URL || 'http://localhost:3001/api';
+    const response = await fetch(`${backendApiUrl}/simple_search`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ query, limit }),
+    });
+    if (!response.ok) {
+      throw new Error(`Error searching notes: ${response.statusText}`);
+    }
+    const results: any[] = await response.json();
+    return new Set(results.map(result => result.id));
+  }, []);
+
   // syncFromGoogleDrive es llamado por GoogleDriveSync.tsx.
   // El argumento 'driveSyncResponseNotes' es la respuesta del endpoint /api/drive/files,
   // que ya contiene las notas procesadas y guardadas/actualizadas en la BD por el backend.
@@ -135,11 +190,10 @@ export const useKnowledgeBase = () => {
       const apiNotes: any[] = await response.json();
       const frontendNotes = apiNotes.map(transformApiResponseToFrontendNote);
 
-      // Para la búsqueda semántica, la "relevancia" viene dada por el orden.
-      // Podríamos intentar obtener scores de FAISS si el backend los devolviera.
+      // La relevancia es la similitud coseno del mejor fragmento de cada nota (NoteCard la muestra como relevance * 10 %).
       const searchResults: SearchResult[] = frontendNotes.map((note, index) => ({
         note,
-        relevance: frontendNotes.length - index, // Relevancia simple basada en el orden (mayor es mejor)
+        relevance: typeof apiNotes[index].score === 'number' ? apiNotes[index].score * 10 : frontendNotes.length - index,
         matches: [], // La búsqueda semántica no identifica "matches" de términos exactos
       }));
 
@@ -165,6 +219,10 @@ export const useKnowledgeBase = () => {
     notes,
     stats,
     isLoading,
+    hasMoreNotes: nextCursor !== null,
+    loadMoreNotes,
+    fetchNoteDetail,
+    searchNoteIdsByContent,
     uploadFiles, // Keep for backward compatibility
     syncFromGoogleDrive,
     searchNotes,
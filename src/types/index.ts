@@ -1,12 +1,14 @@
 export interface Note {
   id: string;
   title: string;
-  content: string;
+  content: string; // Vacío en el listado paginado hasta abrir la nota (ver excerpt)
+  excerpt?: string; // Principio del contenido calculado por /api/notes?fields=...,excerpt
   tags: string[];
   created: Date;
   modified: Date;
   path: string;
   wordCount: number;
+  matchedPassages?: string[]; // Fragmentos devueltos por /api/knowledge-search
 }
 
 export interface SearchResult {